@@ -0,0 +1,643 @@
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+from itertools import product
+from os.path import isfile
+from os.path import join as opj
+from statistics import median
+
+from .profiling import NodeProfiler, node_type
+from .stub_tools import IDENTITY_TRANSFORM, install_stub_tools
+
+
+# Voxel sizes in mm of the synthetic T1w and PET images per fixture size
+BENCHMARK_SIZES = {
+    'small': {'t1_voxel_size': 2.0, 'pet_voxel_size': 4.0},
+    'medium': {'t1_voxel_size': 1.5, 'pet_voxel_size': 3.0},
+    'large': {'t1_voxel_size': 1.0, 'pet_voxel_size': 2.0},
+}
+
+# Field of view in mm of the synthetic images
+FIELD_OF_VIEW_MM = (160, 192, 160)
+
+BENCHMARK_FWHM = 6
+
+# Seconds between two polls of the MultiProc scheduler, short so that the
+# total wall time is dominated by the nodes instead of the polling
+POLL_SLEEP_DURATION = 0.1
+
+# Metrics compared against the baseline, with the smallest absolute
+# increase that counts as a regression, so that noise on short stages is
+# not flagged
+BENCHMARK_METRICS = {
+    'wall_time_s': 1.0,
+    'peak_rss_gb': 0.1,
+    'output_bytes': 1024 ** 2,
+}
+
+# Alignment metrics compared against the baseline, with the largest absolute
+# decrease that is not a regression
+BENCHMARK_QUALITY_METRICS = {
+    'dice_first_pass': 0.02,
+    'dice_second_pass': 0.02,
+}
+
+# Stages summed into a group per step of the workflow, by the prefix of their
+# node name, so that a step is compared as a whole when its nodes are split,
+# merged or renamed
+STAGE_GROUPS = {
+    'resampling': ('resample_T1', 'apply_motion_correction', 'compose_transformations',
+                   'apply_final_coreg', 'apply_coreg_and_norm'),
+    'compression': ('gzip_',),
+    'skullstrip': ('skull_strip',),
+}
+
+# gzip compression level of the outputs, as in pet_brain_preprocessing
+BENCHMARK_COMPRESS_LEVEL = 6
+
+# Brain extraction backend, as in pet_brain_preprocessing
+BENCHMARK_SKULLSTRIP_BACKEND = 'docker'
+
+
+def _grid(voxel_size, field_of_view=FIELD_OF_VIEW_MM):
+    # Image shape and affine of a grid centered on the origin
+    import numpy as np
+
+    shape = tuple(int(round(fov / voxel_size)) for fov in field_of_view)
+    affine = np.diag([voxel_size] * 3 + [1.0])
+    affine[:3, 3] = -(np.array(shape) - 1) / 2 * voxel_size
+    return shape, affine
+
+
+def _ellipsoid(coords, radii, center=(0, 0, 0)):
+    # Normalized squared distance to the center of an ellipsoid, < 1 inside
+    return sum(((coord - c) / r) ** 2 for coord, r, c in zip(coords, radii, center))
+
+
+def _phantom(shape, affine, shift=(0, 0, 0)):
+    # Tissue classes of a head phantom: 0 background, 1 scalp, 2 skull,
+    # 3 CSF, 4 gray matter, 5 white matter
+    import numpy as np
+
+    indices = np.indices(shape, dtype=np.float32)
+    coords = [affine[axis, axis] * indices[axis] + affine[axis, 3] - shift[axis]
+              for axis in range(3)]
+    brain_radii = (62, 80, 64)
+    brain = _ellipsoid(coords, brain_radii)
+    tissue = np.zeros(shape, dtype=np.uint8)
+    tissue[brain < 1.35] = 1
+    tissue[brain < 1.2] = 2
+    tissue[brain < 1.0] = 4
+    tissue[brain < 0.6] = 5
+    tissue[_ellipsoid(coords, (8, 20, 10), (0, 5, 5)) < 1] = 3
+    return tissue, coords
+
+
+def make_fixture(fixture_dir, size='small', n_frames=1, seed=0, participant_id=None):
+    """
+    Write a synthetic T1w image, brain mask, transform, atlas and PET image.
+
+    The T1w image is a head phantom, the PET image a smoothed uptake map of
+    the same phantom that is shifted by a few millimeters, so the
+    coregistration has something to do. Dynamic images get a different
+    uptake and a small shift per frame. The template is the T1w image itself
+    and the transform to it is the identity.
+
+    Parameters
+    ----------
+    fixture_dir : string
+        Folder to write the files to. Existing fixtures are reused.
+    size : string, optional
+        Fixture size, one of BENCHMARK_SIZES.
+    n_frames : int, optional
+        Number of frames of the PET image.
+    seed : int, optional
+        Seed of the image noise.
+    participant_id : string, optional
+        Participant label of the files, sub-<size><n_frames> by default.
+
+    Returns
+    -------
+    fixture : dict
+        Paths to the 'pet_image', 'T1', 'T1_mask', 'transform', 'template',
+        'atlas' and 'atlas_labels' and the 'label', 'n_frames' and
+        'voxel_size' of the PET image.
+
+    """
+    fixture_file = opj(fixture_dir, "fixture.json")
+    if isfile(fixture_file):
+        with open(fixture_file) as f:
+            return json.load(f)
+
+    import nibabel as nb
+    import numpy as np
+    from scipy import ndimage
+
+    if size not in BENCHMARK_SIZES:
+        raise ValueError(f"ERROR. Unknown benchmark size {size}.")
+    voxel_sizes = BENCHMARK_SIZES[size]
+    rng = np.random.default_rng(seed)
+    os.makedirs(fixture_dir, exist_ok=True)
+
+    def save(data, affine, name, dtype=np.float32):
+        img = nb.Nifti1Image(data.astype(dtype), affine)
+        img.set_data_dtype(dtype)
+        nb.save(img, opj(fixture_dir, name))
+        return opj(fixture_dir, name)
+
+    participant = participant_id or f"sub-{size}{n_frames}"
+    label = f"{participant}_trc-FDG"
+
+    # T1w image, brain mask and an atlas of the brain split into octants
+    shape, affine = _grid(voxel_sizes['t1_voxel_size'])
+    tissue, coords = _phantom(shape, affine)
+    intensities = np.array([0, 60, 20, 30, 70, 110], dtype=np.float32)
+    t1 = intensities[tissue] * (1 + 0.03 * rng.standard_normal(shape, dtype=np.float32))
+    brain = tissue >= 3
+    octant = 1 + (coords[0] > 0) + 2 * (coords[1] > 0) + 4 * (coords[2] > 0)
+    files = {
+        'T1': save(t1, affine, f"{participant}_desc-preproc_T1w.nii.gz"),
+        'T1_mask': save(brain, affine, f"{participant}_desc-brain_mask.nii.gz", np.uint8),
+        'atlas': save(np.where(brain, octant, 0), affine, f"{participant}_dseg.nii.gz",
+                      np.int16),
+    }
+    files['template'] = files['T1']
+    files['atlas_labels'] = opj(fixture_dir, f"{participant}_dseg.tsv")
+    with open(files['atlas_labels'], "w") as f:
+        f.write("index\tname\n")
+        f.writelines(f"{index}\toctant-{index}\n" for index in range(1, 9))
+    files['transform'] = opj(fixture_dir,
+                             f"{participant}_from-T1w_to-template_mode-image_xfm.txt")
+    with open(files['transform'], "w") as f:
+        f.write(IDENTITY_TRANSFORM)
+
+    # PET image, one shifted and smoothed uptake map per frame
+    pet_voxel_size = voxel_sizes['pet_voxel_size']
+    shape, affine = _grid(pet_voxel_size)
+    uptake = np.array([0, 0.1, 0.05, 0.05, 1.0, 0.4], dtype=np.float32)
+    sigma = 6 / np.sqrt(8 * np.log(2)) / pet_voxel_size
+    frames = []
+    for frame in range(n_frames):
+        shift = (4 + 0.5 * frame, -3, 2 - 0.3 * frame)
+        tissue, _ = _phantom(shape, affine, shift)
+        activity = ndimage.gaussian_filter(uptake[tissue], sigma) * (1 + frame / n_frames)
+        frames.append(np.clip(
+            activity + 0.02 * rng.standard_normal(shape, dtype=np.float32), 0, None))
+    pet = frames[0] if n_frames == 1 else np.stack(frames, axis=-1)
+    files['pet_image'] = save(1000 * pet, affine, f"{label}_pet.nii.gz")
+
+    fixture = {
+        **files,
+        'label': label,
+        'participant_id': participant,
+        'n_frames': n_frames,
+        'voxel_size': [pet_voxel_size] * 3,
+    }
+    with open(fixture_file, "w") as f:
+        json.dump(fixture, f, indent=2)
+    return fixture
+
+
+def run_case(fixtures, work_dir, n_procs=1, engine='external', registration_preset='default',
+             compress_level=BENCHMARK_COMPRESS_LEVEL,
+             skullstrip_backend=BENCHMARK_SKULLSTRIP_BACKEND, skullstrip_model=None):
+    """
+    Run pet_preprocessing_workflow on fixtures and profile every node.
+
+    The participant workflows are run by one MultiProc scheduler, which
+    reports the subnodes of MapNodes to the profiler, within a top level
+    workflow as in pet_brain_preprocessing.
+
+    Parameters
+    ----------
+    fixtures : dict or list of dicts
+        Fixtures written by make_fixture, of different participants.
+    n_procs : int, optional
+        Number of MultiProc processes. As in pet_brain_preprocessing, a
+        registration uses at most 8 threads.
+    registration_preset : string, optional
+        Coregistration settings, see REGISTRATION_PRESETS.
+    compress_level : int, optional
+        gzip compression level of the outputs, 0 writes them uncompressed.
+    skullstrip_backend : string, optional
+        Brain extraction backend, 'docker', 'python' or 'threshold'.
+    skullstrip_model : string, optional
+        SynthStrip model weights, required by the 'python' backend.
+
+    Returns
+    -------
+    records : list of dicts
+        Node statistics as recorded by NodeProfiler.
+    wall_time_s : float
+        Wall time of the whole run.
+
+    """
+    from nipype import Workflow, config
+    from .pet_brain_preprocessing import estimate_mem_gb
+    from .workflows.preprocessing_workflow import pet_preprocessing_workflow
+
+    if isinstance(fixtures, dict):
+        fixtures = [fixtures]
+
+    wf = Workflow(name='pet_brain_preprocessing_wf', base_dir=work_dir)
+    wf.config['execution']['poll_sleep_duration'] = POLL_SLEEP_DURATION
+
+    for fixture in fixtures:
+        scan = {
+            'label': fixture['label'],
+            'pet_image': fixture['pet_image'],
+            'session': None,
+            'n_frames': fixture['n_frames'],
+            'voxel_size': fixture['voxel_size'],
+            'mem_gb': estimate_mem_gb(fixture['pet_image'], fixture['T1']),
+        }
+        participant_wf = pet_preprocessing_workflow(
+            fixture['participant_id'], None, True, [scan],
+            omp_nthreads=min(n_procs, 8),
+            mem_gb=estimate_mem_gb(fixture['T1']),
+            atlas_file=fixture['atlas'],
+            atlas_labels=fixture['atlas_labels'],
+            template_mask=fixture['T1_mask'],
+            registration_preset=registration_preset,
+            compress_level=compress_level,
+            skullstrip_backend=skullstrip_backend,
+            skullstrip_model=skullstrip_model,
+            engine=engine,
+            name=f"coreg_and_norm_wf_{fixture['participant_id']}")
+        participant_wf.inputs.input_files.results_folder = opj(work_dir, "derivatives")
+        participant_wf.inputs.input_files.T1 = fixture['T1']
+        participant_wf.inputs.input_files.T1_mask = fixture['T1_mask']
+        participant_wf.inputs.input_files.template = fixture['template']
+        participant_wf.inputs.input_files.transform = fixture['transform']
+        participant_wf.inputs.input_files.smooth_fwhm = BENCHMARK_FWHM
+        wf.add_nodes([participant_wf])
+
+    config.enable_resource_monitor()
+    profiler = NodeProfiler()
+    start = time.perf_counter()
+    wf.run('MultiProc', plugin_args={'n_procs': n_procs, 'status_callback': profiler})
+    return profiler.records, time.perf_counter() - start
+
+
+def alignment_statistics(results_folder):
+    """
+    Median Dice overlap of the coregistered PET and T1w brain masks of the
+    images of a run, from the quality control TSV files in its results.
+    """
+    from .qc import aggregate_qc
+
+    values = {metric: [] for metric in BENCHMARK_QUALITY_METRICS}
+    for record in aggregate_qc([results_folder]):
+        for metric in values:
+            try:
+                value = float(record[metric])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if value == value:
+                values[metric].append(value)
+    return {'wall_time_s': None, 'peak_rss_gb': None,
+            **{metric: median(metric_values) if metric_values else None
+               for metric, metric_values in values.items()}}
+
+
+def output_statistics(results_folder):
+    """
+    Total size of the files a run wrote to its results folder.
+    """
+    output_bytes = 0
+    for root, _, files in os.walk(results_folder):
+        output_bytes += sum(os.path.getsize(opj(root, f)) for f in files)
+    return {'wall_time_s': None, 'peak_rss_gb': None, 'output_bytes': output_bytes}
+
+
+def _peak_rss_gb():
+    # Peak RSS of this process. On Linux ru_maxrss keeps the peak of the
+    # parent across fork and exec, the high water mark of /proc does not.
+    import resource
+
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    # kB on Linux, bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024 ** 3 if sys.platform == "darwin" else 1024 ** 2)
+
+
+def _launcher_run(fixtures):
+    # Steps of pet_brain_preprocessing between reading the inputs and
+    # running the workflow, meant to run in a fresh process
+    start = time.perf_counter()
+    from nibabel import load
+    from .pet_brain_preprocessing import count_frames, estimate_mem_gb
+    from .workflows.preprocessing_workflow import pet_preprocessing_workflow
+
+    for fixture in fixtures:
+        scan = {
+            'label': fixture['label'],
+            'pet_image': fixture['pet_image'],
+            'session': None,
+            'n_frames': count_frames(fixture['pet_image']),
+            'voxel_size': load(fixture['pet_image']).header.get_zooms()[:3],
+            'mem_gb': estimate_mem_gb(fixture['pet_image'], fixture['T1']),
+        }
+        pet_preprocessing_workflow(
+            fixture['participant_id'], None, True, [scan],
+            mem_gb=estimate_mem_gb(fixture['T1']),
+            atlas_file=fixture['atlas'],
+            atlas_labels=fixture['atlas_labels'],
+            template_mask=fixture['T1_mask'],
+            name=f"coreg_and_norm_wf_{fixture['participant_id']}")
+
+    return {'wall_time_s': time.perf_counter() - start, 'peak_rss_gb': _peak_rss_gb()}
+
+
+def launcher_statistics(fixtures):
+    """
+    Wall time and peak memory of the launcher on fixtures.
+
+    The launcher counts the frames, reads the image headers, estimates the
+    memory of the nodes and builds the workflows, as pet_brain_preprocessing
+    does before the workflow is run. It is run in a fresh process, so its
+    peak RSS is not inflated by earlier runs and includes the imports. It
+    should not grow with the size of the images.
+
+    Returns
+    -------
+    statistics : dict
+        'wall_time_s' and 'peak_rss_gb' of the launcher.
+
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import get_context
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(_launcher_run, fixtures).result()
+
+
+def stage_statistics(records, wall_time_s=None, participants=1):
+    """
+    Wall time and peak memory per stage of a run.
+
+    A stage is a node type (see node_type), the subnodes of a MapNode are
+    one stage. Their wall times are summed, their peak memory is the
+    largest of the subnodes. The stages of each of STAGE_GROUPS are
+    combined the same way.
+
+    Returns
+    -------
+    stages : dict of dicts
+        'wall_time_s' and 'peak_rss_gb' per stage and group, plus the
+        'total' of the run when its wall time is given. Groups also report
+        their 'wall_time_per_participant_s'.
+
+    """
+    stages = {}
+    for record in records:
+        stage = node_type(record['node'])
+        name = stage.rsplit('.', 1)[-1]
+        groups = [group for group, prefixes in STAGE_GROUPS.items()
+                  if name.startswith(prefixes)]
+        for key in [stage] + groups:
+            metrics = stages.setdefault(key, {'wall_time_s': None, 'peak_rss_gb': None})
+            if record['wall_time_s'] is not None:
+                metrics['wall_time_s'] = (metrics['wall_time_s'] or 0.0) + record['wall_time_s']
+            if record['peak_rss_gb'] is not None:
+                metrics['peak_rss_gb'] = max(metrics['peak_rss_gb'] or 0.0,
+                                             record['peak_rss_gb'])
+    for group in STAGE_GROUPS:
+        if group in stages and stages[group]['wall_time_s'] is not None:
+            stages[group]['wall_time_per_participant_s'] = \
+                stages[group]['wall_time_s'] / participants
+    if wall_time_s is not None:
+        stages['total'] = {'wall_time_s': wall_time_s, 'peak_rss_gb': None}
+    return stages
+
+
+def _median_statistics(runs):
+    # Per stage median of each metric over repeated runs
+    stages = {}
+    for run in runs:
+        for stage, metrics in run.items():
+            for metric, value in metrics.items():
+                stages.setdefault(stage, {}).setdefault(metric, [])
+                if value is not None:
+                    stages[stage][metric].append(value)
+    return {stage: {metric: median(values) if values else None
+                    for metric, values in metrics.items()}
+            for stage, metrics in stages.items()}
+
+
+def run_benchmark(work_dir, sizes=('small',), frames=(1,), repeats=1, n_procs=(1,),
+                  stub_tools=False, engine='external', participants=1,
+                  presets=('default',), compress_levels=(BENCHMARK_COMPRESS_LEVEL,),
+                  skullstrip_backends=(BENCHMARK_SKULLSTRIP_BACKEND,), skullstrip_model=None):
+    """
+    Run the workflow on synthetic fixtures of several sizes and numbers of
+    frames and collect the wall time and peak memory of every stage.
+
+    Parameters
+    ----------
+    work_dir : string
+        Folder for the fixtures and the working directories of the runs.
+        Fixtures are reused, runs always start from an empty working
+        directory.
+    sizes : list of strings, optional
+        Fixture sizes, see BENCHMARK_SIZES.
+    frames : list of ints, optional
+        Numbers of PET frames, every size is run with each.
+    repeats : int, optional
+        Number of runs per fixture, the median statistics are reported.
+    n_procs : list of ints, optional
+        Numbers of MultiProc processes, every case is run with each. With a
+        single process the nodes run one after the other, which gives the
+        most stable timings.
+    stub_tools : bool, optional
+        Replace synthstrip-docker, AFNI, ANTs and FSL by the stand-ins of
+        stub_tools, so the benchmark runs without them.
+    engine : string, optional
+        Engine of the resampling and smoothing steps, 'external' or
+        'python'. The stages keep their names, so a run of one engine can
+        be compared against a baseline of the other.
+    participants : int, optional
+        Number of participants processed together in every run. With
+        several participants and numbers of processes, the throughput in
+        'images_per_hour' shows how the scheduler packs the nodes.
+    presets : list of strings, optional
+        Registration presets, every case is run with each. The 'alignment'
+        of every case reports the median Dice overlap after both
+        coregistration passes, to weigh the runtime of a preset against
+        its accuracy.
+    compress_levels : list of ints, optional
+        gzip compression levels of the outputs, every case is run with
+        each. The 'outputs' of every case report the bytes written to the
+        results folder, the 'compression' group the time spent on gzip.
+    skullstrip_backends : list of strings, optional
+        Brain extraction backends, every case is run with each. The
+        'skull_strip' stage of every case reports the time of the backend,
+        the 'alignment' the Dice overlap of the coregistration it leads to.
+    skullstrip_model : string, optional
+        SynthStrip model weights, required by the 'python' backend.
+
+    Returns
+    -------
+    benchmark : dict
+        The benchmark 'settings' and per case
+        ('<size>_frames-<n>_procs-<n>', suffixed by '_preset-<preset>'
+        for other presets than 'default', by '_compress-<level>' for
+        other compression levels than BENCHMARK_COMPRESS_LEVEL and by
+        '_skullstrip-<backend>' for other backends than
+        BENCHMARK_SKULLSTRIP_BACKEND) the statistics per stage.
+
+    """
+    work_dir = os.path.abspath(work_dir)
+    environ = dict(os.environ)
+    if stub_tools:
+        bin_dir = install_stub_tools(opj(work_dir, "bin"))
+        os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+    cases = {}
+    try:
+        for size in sizes:
+            for n_frames in frames:
+                fixtures = []
+                for i in range(participants):
+                    participant_id = f"sub-{size}{n_frames}" + (f"n{i}" if i else "")
+                    fixtures.append(make_fixture(
+                        opj(work_dir, "fixtures", f"{size}_frames-{n_frames}", participant_id),
+                        size, n_frames, seed=i, participant_id=participant_id))
+
+                for procs, preset, compress_level, backend in product(
+                        n_procs, presets, compress_levels, skullstrip_backends):
+                    case = f"{size}_frames-{n_frames}_procs-{procs}" \
+                        + (f"_preset-{preset}" if preset != 'default' else "") \
+                        + (f"_compress-{compress_level}"
+                           if compress_level != BENCHMARK_COMPRESS_LEVEL else "") \
+                        + (f"_skullstrip-{backend}"
+                           if backend != BENCHMARK_SKULLSTRIP_BACKEND else "")
+                    runs = []
+                    for repeat in range(repeats):
+                        run_dir = opj(work_dir, "runs", case, f"repeat-{repeat}")
+                        shutil.rmtree(run_dir, ignore_errors=True)
+                        records, wall_time_s = run_case(fixtures, run_dir, procs, engine,
+                                                        preset, compress_level, backend,
+                                                        skullstrip_model)
+                        stages = stage_statistics(records, wall_time_s, participants)
+                        stages['total']['images_per_hour'] = 3600 * participants / wall_time_s
+                        stages['launcher'] = launcher_statistics(fixtures)
+                        stages['alignment'] = alignment_statistics(opj(run_dir, "derivatives"))
+                        stages['outputs'] = output_statistics(opj(run_dir, "derivatives"))
+                        runs.append(stages)
+                    cases[case] = _median_statistics(runs)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+    return {
+        'settings': {
+            'repeats': repeats,
+            'participants': participants,
+            'stub_tools': stub_tools,
+            'engine': engine,
+            'created': datetime.now().isoformat(timespec='seconds'),
+        },
+        'cases': cases,
+    }
+
+
+def compare_to_baseline(benchmark, baseline, tolerance=0.25):
+    """
+    Find the stages that got slower or use more memory than in a baseline.
+
+    Parameters
+    ----------
+    benchmark : dict
+        Benchmark results, see run_benchmark.
+    baseline : dict
+        Earlier benchmark results of the same cases and settings.
+    tolerance : float, optional
+        Fraction by which a metric may exceed the baseline. An increase must
+        also exceed the minimum in BENCHMARK_METRICS to count. Alignment
+        metrics only count when they decrease by more than the maximum in
+        BENCHMARK_QUALITY_METRICS.
+
+    Returns
+    -------
+    regressions : list of dicts
+        Per regression the 'case', 'stage', 'metric', 'baseline' and
+        'value'. Stages that were added or removed, e.g. by a change of the
+        node wiring, are listed with metric 'added' or 'removed'.
+
+    """
+    for setting in ['participants', 'stub_tools']:
+        if benchmark['settings'].get(setting) != baseline['settings'].get(setting):
+            raise ValueError(f"ERROR. The baseline was run with {setting} \
+                {baseline['settings'].get(setting)}, the benchmark with \
+                {benchmark['settings'].get(setting)}.")
+
+    regressions = []
+    for case, stages in benchmark['cases'].items():
+        if case not in baseline['cases']:
+            continue
+        baseline_stages = baseline['cases'][case]
+        for stage in sorted(set(stages) | set(baseline_stages)):
+            if stage not in baseline_stages or stage not in stages:
+                regressions.append({
+                    'case': case,
+                    'stage': stage,
+                    'metric': 'added' if stage in stages else 'removed',
+                    'baseline': None,
+                    'value': None,
+                })
+                continue
+            for metric, min_increase in BENCHMARK_METRICS.items():
+                value = stages[stage].get(metric)
+                baseline_value = baseline_stages[stage].get(metric)
+                if value is None or baseline_value is None:
+                    continue
+                if (value > baseline_value * (1 + tolerance)
+                        and value - baseline_value > min_increase):
+                    regressions.append({
+                        'case': case,
+                        'stage': stage,
+                        'metric': metric,
+                        'baseline': baseline_value,
+                        'value': value,
+                    })
+            for metric, max_decrease in BENCHMARK_QUALITY_METRICS.items():
+                value = stages[stage].get(metric)
+                baseline_value = baseline_stages[stage].get(metric)
+                if value is None or baseline_value is None:
+                    continue
+                if baseline_value - value > max_decrease:
+                    regressions.append({
+                        'case': case,
+                        'stage': stage,
+                        'metric': metric,
+                        'baseline': baseline_value,
+                        'value': value,
+                    })
+    return regressions
+
+
+def read_benchmark(file_path):
+    """
+    Read benchmark results or a baseline written by write_benchmark.
+    """
+    with open(file_path) as f:
+        return json.load(f)
+
+
+def write_benchmark(file_path, benchmark):
+    """
+    Write benchmark results as JSON, e.g. to be used as baseline.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    with open(file_path, "w") as f:
+        json.dump(benchmark, f, indent=2, sort_keys=True)
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+from os.path import abspath, expanduser, getsize, isdir, isfile
+from os.path import join as opj
+from tempfile import mkdtemp
+
+
+DEFAULT_CACHE_DIR = opj(
+    os.getenv("XDG_CACHE_HOME", expanduser(opj("~", ".cache"))),
+    "petbrainpreprocessing")
+
+HASH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+"""
+
+
+def file_hash(file_path, chunk_size=1024 ** 2):
+    """
+    Return the SHA-256 hex digest of the contents of a file.
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class DerivativeCache:
+    """
+    Content-addressed cache for derivatives that only depend on their inputs.
+
+    Each entry is a folder named after a hash of the input file contents and
+    the parameters used to create it. Entries are evicted least recently used
+    first once the cache grows beyond its maximum size. The digests of the
+    input files are kept in a SQLite database, which concurrent runs can
+    share.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Folder in which the cache entries are stored.
+    max_size_gb : float, optional
+        Maximum total size of the cache in GB. The cache is not limited if
+        not given.
+
+    Examples
+    --------
+    >>> cache = DerivativeCache('/scratch/cache', max_size_gb=10)
+    >>> key = cache.key('sub-01_T1w.nii.gz', voxel_size=(2.0, 2.0, 2.0))
+    >>> cache.fetch(key, 'sub-01_resampled_T1w.nii.gz', create_function)
+    """
+
+    def __init__(self, cache_dir, max_size_gb=None):
+        self.cache_dir = abspath(cache_dir)
+        self.max_size_gb = max_size_gb
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Concurrent launches wait for each other instead of failing
+        self._hash_index = sqlite3.connect(opj(self.cache_dir, "file_hashes.sqlite"),
+                                           timeout=600)
+        self._hash_index.executescript(HASH_SCHEMA)
+
+
+    def key(self, *file_paths, **parameters):
+        """
+        Build the cache key of a derivative from its input files and parameters.
+        """
+        sha = hashlib.sha256()
+        for file_path in file_paths:
+            sha.update(self._file_hash(file_path).encode())
+        sha.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+        return sha.hexdigest()
+
+
+    def fetch(self, key, filename, create_function, out_file=None):
+        """
+        Return the cached derivative, creating it first if it is not cached.
+
+        Parameters
+        ----------
+        key : string
+            Cache key as returned by `key`.
+        filename : string
+            File name of the derivative within the cache entry.
+        create_function : callable
+            Called with the output path to write the derivative when it is
+            not cached yet.
+        out_file : string, optional
+            Path to hard link, or copy, the derivative to. The entry may be
+            evicted by a later fetch, the linked file is not affected.
+
+        Returns
+        -------
+        file_path : string
+            Path to the cached derivative, or out_file when given.
+
+        """
+        entry = opj(self.cache_dir, key)
+        file_path = opj(entry, filename)
+        if isfile(file_path):
+            # Mark the entry as recently used
+            os.utime(entry)
+            return self._link(file_path, out_file)
+
+        # Write into a temporary folder first so concurrent runs never see
+        # a partially written derivative
+        tmp_entry = mkdtemp(prefix=f".{key}_", dir=self.cache_dir)
+        os.chmod(tmp_entry, 0o755)
+        try:
+            create_function(opj(tmp_entry, filename))
+            try:
+                os.replace(tmp_entry, entry)
+            except OSError:
+                # The entry exists already, e.g. with other derivatives of
+                # the same inputs
+                if not isfile(file_path):
+                    shutil.move(opj(tmp_entry, filename), file_path)
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        file_path = self._link(file_path, out_file)
+        self.evict(keep=key)
+        return file_path
+
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits its maximum size.
+
+        Digests of files that no longer exist are removed as well.
+        """
+        paths = [path for path, in self._hash_index.execute("SELECT path FROM file_hashes")]
+        with self._hash_index:
+            self._hash_index.executemany("DELETE FROM file_hashes WHERE path = ?",
+                                         [(path,) for path in paths if not isfile(path)])
+
+        if self.max_size_gb is None:
+            return
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = opj(self.cache_dir, name)
+            if name.startswith(".") or not isdir(entry):
+                continue
+            size = sum(getsize(opj(entry, f)) for f in os.listdir(entry))
+            entries.append((os.stat(entry).st_mtime, size, name))
+
+        total_size = sum(size for _, size, _ in entries)
+        max_size = self.max_size_gb * 1024 ** 3
+        for _, size, name in sorted(entries):
+            if total_size <= max_size:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(opj(self.cache_dir, name), ignore_errors=True)
+            total_size -= size
+
+
+    def _link(self, file_path, out_file):
+        # Hard link a cached file out of the cache, copy it across file systems
+        if out_file is None:
+            return file_path
+        out_file = abspath(out_file)
+        if os.path.lexists(out_file):
+            os.remove(out_file)
+        try:
+            os.link(file_path, out_file)
+        except OSError:
+            shutil.copy2(file_path, out_file)
+        return out_file
+
+
+    def _file_hash(self, file_path):
+        # Hashing large images on every run is slow, so digests are stored
+        # together with the size and modification time of the file
+        file_path = abspath(file_path)
+        stat = os.stat(file_path)
+
+        row = self._hash_index.execute(
+            "SELECT digest FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (file_path, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row is not None:
+            return row[0]
+
+        digest = file_hash(file_path)
+        with self._hash_index:
+            self._hash_index.execute(
+                "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                (file_path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
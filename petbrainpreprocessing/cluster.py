@@ -0,0 +1,76 @@
+from math import ceil
+
+
+PLUGINS = ['MultiProc', 'Linear', 'SLURM', 'SLURMGraph', 'SGE', 'SGEGraph']
+
+# Plugins that submit the whole graph at once, they do not report the
+# status of nodes back to the launcher
+GRAPH_PLUGINS = ['SLURMGraph', 'SGEGraph']
+
+# Parallel environment used to request multiple slots from SGE
+SGE_PARALLEL_ENVIRONMENT = 'smp'
+
+# Memory requested at least per job, covering the interpreter and the
+# tools themselves
+MIN_JOB_MEM_GB = 1.0
+
+
+def _lightweight_interfaces():
+    # Interfaces that only route or copy files, submitting them as jobs costs
+    # more than running them. Imported on demand, the plugin names above are
+    # needed to parse the command line before nipype is loaded.
+    from nipype.interfaces.io import DataSink
+    from nipype.interfaces.utility import Function, IdentityInterface, Merge
+
+    return (DataSink, Function, IdentityInterface, Merge)
+
+
+def _job_resources(plugin, n_procs, mem_gb):
+    # Scheduler options requesting the cores and memory of a node
+    mem_gb = max(mem_gb, MIN_JOB_MEM_GB)
+    if plugin.startswith('SLURM'):
+        return f"--cpus-per-task={n_procs} --mem={ceil(mem_gb * 1024)}M"
+    # h_vmem is a per slot limit in SGE
+    return (f"-pe {SGE_PARALLEL_ENVIRONMENT} {n_procs} "
+            f"-l h_vmem={ceil(mem_gb * 1024 / n_procs)}M")
+
+
+def set_cluster_resources(workflow, plugin):
+    """
+    Prepare the nodes of a workflow for a cluster execution plugin.
+
+    Every node requests the cores and memory it is configured with, so
+    registrations get many cores and much memory and resampling nodes get
+    little. Lightweight nodes are run by the launcher itself instead of
+    being submitted as jobs.
+
+    Graph plugins ignore run_without_submitting and submit every node as a
+    batch job, so each lightweight node of every image becomes a job of its
+    own that requests a single core and the minimum memory. They are not
+    grouped into fewer jobs; for large cohorts the non-graph plugins keep
+    the number of jobs down.
+
+    Parameters
+    ----------
+    workflow : nipype Workflow
+        Workflow whose nodes, including those of nested workflows, are
+        prepared.
+    plugin : string
+        Name of the nipype execution plugin. Nothing is changed for local
+        plugins.
+
+    """
+    if not plugin.startswith(('SLURM', 'SGE')):
+        return
+
+    lightweight_interfaces = _lightweight_interfaces()
+    args_key = 'sbatch_args' if plugin.startswith('SLURM') else 'qsub_args'
+    for node in workflow._get_all_nodes():
+        if isinstance(node.interface, lightweight_interfaces):
+            node.run_without_submitting = True
+            n_procs, mem_gb = 1, MIN_JOB_MEM_GB
+        else:
+            n_procs, mem_gb = node.n_procs, node.mem_gb
+
+        # Node arguments are appended to the global arguments of the plugin
+        node.plugin_args = {args_key: _job_resources(plugin, n_procs, mem_gb)}
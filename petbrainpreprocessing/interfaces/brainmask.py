@@ -0,0 +1,131 @@
+import os
+import numpy as np
+import nibabel as nb
+from scipy import ndimage
+from nipype.utils.filemanip import fname_presuffix
+
+from nipype.interfaces.base import (
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+    traits,
+    isdefined
+)
+
+
+def keep_largest_component(mask):
+    """
+    Keep the largest connected component of a binary mask and fill its holes.
+    """
+    labels, n_labels = ndimage.label(mask)
+    if n_labels > 1:
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0
+        mask = labels == sizes.argmax()
+    return ndimage.binary_fill_holes(mask)
+
+
+def save_brain_and_mask(img, mask, out_file, mask_file):
+    """
+    Write the masked image and the binary mask next to each other.
+    """
+    data = np.asanyarray(img.dataobj)
+    brain = nb.Nifti1Image(np.where(mask, data, 0).astype(data.dtype),
+                           img.affine, img.header)
+    nb.save(brain, out_file)
+
+    mask_img = nb.Nifti1Image(mask.astype(np.uint8), img.affine, img.header)
+    mask_img.set_data_dtype(np.uint8)
+    mask_img.header.set_slope_inter(1, 0)
+    nb.save(mask_img, mask_file)
+
+
+class ThresholdBrainMaskInputSpec(BaseInterfaceInputSpec):
+    in_file = File(
+        desc="input image to skullstrip",
+        exists=True,
+        mandatory=True
+    )
+    out_file = File(
+        desc="save stripped image to file",
+        hash_files=False
+    )
+    mask_file = File(
+        desc="save binary brain mask to file",
+        hash_files=False
+    )
+    threshold = traits.Range(
+        low=0.0,
+        high=1.0,
+        value=0.3,
+        usedefault=True,
+        desc="fraction of the robust maximum intensity counted as brain"
+    )
+    smoothing_fwhm = traits.Float(
+        4.0,
+        usedefault=True,
+        desc="FWHM in mm of the Gaussian kernel applied before thresholding"
+    )
+
+
+class ThresholdBrainMaskOutputSpec(TraitedSpec):
+    out_file = File(desc="output file", exists=True)
+    mask_file = File(desc="mask file", exists=True)
+
+
+class ThresholdBrainMask(BaseInterface):
+    """
+    Fast intensity based brain extraction for tracers with a high uptake in
+    brain tissue, such as FDG.
+
+    The image is smoothed and thresholded at a fraction of its 99.5th
+    percentile. The largest connected component, with holes filled, is kept
+    as brain mask.
+
+    Examples
+    --------
+    >>> mask = ThresholdBrainMask()
+    >>> mask.inputs.in_file = 'file.nii.gz'
+    >>> mask.inputs.threshold = 0.3
+    >>> mask.run()
+    """
+
+    input_spec = ThresholdBrainMaskInputSpec
+    output_spec = ThresholdBrainMaskOutputSpec
+
+
+    def _run_interface(self, runtime):
+        img = nb.load(self.inputs.in_file)
+        data = img.get_fdata(dtype=np.float32)
+
+        zooms = np.array(img.header.get_zooms()[:3])
+        sigma = self.inputs.smoothing_fwhm / np.sqrt(8 * np.log(2)) / zooms
+        data = ndimage.gaussian_filter(data, sigma)
+
+        # An empty mask would only fail later in the coregistration
+        positive = data[data > 0]
+        if not positive.size:
+            raise ValueError(f"ERROR. Cannot threshold {self.inputs.in_file}, \
+                it has no positive intensities.")
+        threshold = self.inputs.threshold * np.percentile(positive, 99.5)
+        mask = keep_largest_component(data > threshold)
+
+        outputs = self._list_outputs()
+        save_brain_and_mask(img, mask, outputs["out_file"], outputs["mask_file"])
+        return runtime
+
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["out_file"] = self.inputs.out_file
+        if not isdefined(outputs["out_file"]):
+            outputs["out_file"] = fname_presuffix(
+                self.inputs.in_file, suffix="_brain", newpath=os.getcwd())
+        outputs["mask_file"] = self.inputs.mask_file
+        if not isdefined(outputs["mask_file"]):
+            outputs["mask_file"] = fname_presuffix(
+                self.inputs.in_file, suffix="_brain_mask", newpath=os.getcwd())
+        outputs["out_file"] = os.path.abspath(outputs["out_file"])
+        outputs["mask_file"] = os.path.abspath(outputs["mask_file"])
+        return outputs
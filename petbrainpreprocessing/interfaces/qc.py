@@ -0,0 +1,149 @@
+import os
+import numpy as np
+import nibabel as nb
+from nibabel.processing import resample_from_to
+from nipype.utils.filemanip import split_filename
+
+from nipype.interfaces.base import (
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+    traits,
+    isdefined
+)
+
+from ..profiling import write_tsv
+from ..qc import (QC_FIELDS, brain_coverage, dice, mosaic, normalized_mutual_information,
+                  write_png)
+
+
+def _load_on_grid(file_path, reference, order=1):
+    # Image data on the grid of the reference image, 4D images are averaged
+    img = nb.load(file_path)
+    if len(img.shape) > 3:
+        img = nb.Nifti1Image(img.get_fdata(dtype=np.float32).mean(axis=3), img.affine)
+    if img.shape[:3] != reference.shape[:3] or not np.allclose(img.affine, reference.affine):
+        img = resample_from_to(img, (reference.shape[:3], reference.affine), order=order)
+    return img.get_fdata(dtype=np.float32)
+
+
+class CoregistrationQCInputSpec(BaseInterfaceInputSpec):
+    first_pass_mask = File(
+        desc="PET brain mask after the first coregistration pass, in T1w space",
+        exists=True,
+        mandatory=True
+    )
+    coreg_pet = File(
+        desc="skull stripped PET image after the second coregistration pass, in T1w space",
+        exists=True,
+        mandatory=True
+    )
+    T1 = File(
+        desc="T1w image",
+        exists=True,
+        mandatory=True
+    )
+    T1_mask = File(
+        desc="T1w brain mask",
+        exists=True,
+        mandatory=True
+    )
+    norm_pet = File(
+        desc="PET image in template space, 3D or 4D",
+        exists=True,
+        mandatory=True
+    )
+    template_mask = File(
+        desc="brain mask of the template, needed for the brain coverage",
+        exists=True
+    )
+    label = traits.Str(
+        desc="label of the PET image, used as file name and first column"
+    )
+
+
+class CoregistrationQCOutputSpec(TraitedSpec):
+    out_file = File(desc="quality control metrics", exists=True)
+    coreg_mosaic = File(desc="T1w image with the outline of the coregistered PET brain",
+                        exists=True)
+    norm_mosaic = File(desc="normalized PET image with the outline of the template brain",
+                       exists=True)
+
+
+class CoregistrationQC(BaseInterface):
+    """
+    Quality control metrics and snapshots of the coregistration and
+    normalization of a PET image.
+
+    The Dice overlap of the PET brain mask with the T1w brain mask is
+    computed after the first and the second coregistration pass, the
+    normalized mutual information of the coregistered PET and T1w images
+    within the T1w brain mask, and the fraction of the template brain
+    covered by the normalized PET image. Downsampled axial mosaics show the
+    alignment at a glance.
+
+    Examples
+    --------
+    >>> qc = CoregistrationQC()
+    >>> qc.inputs.first_pass_mask = 'petmask2anatmask.nii'
+    >>> qc.inputs.coreg_pet = 'pet2anat.nii'
+    >>> qc.inputs.T1 = 'sub-01_desc-preproc_T1w.nii.gz'
+    >>> qc.inputs.T1_mask = 'sub-01_desc-brain_mask.nii.gz'
+    >>> qc.inputs.norm_pet = 'sub-01_pet_trans.nii'
+    >>> qc.inputs.template_mask = 'tpl-MNI152NLin2009cAsym_res-02_desc-brain_mask.nii.gz'
+    >>> qc.run()
+    """
+
+    input_spec = CoregistrationQCInputSpec
+    output_spec = CoregistrationQCOutputSpec
+
+
+    def _run_interface(self, runtime):
+        label = self.inputs.label if isdefined(self.inputs.label) else \
+            split_filename(self.inputs.coreg_pet)[1]
+
+        # Coregistration, in T1w space
+        t1_img = nb.load(self.inputs.T1)
+        t1 = t1_img.get_fdata(dtype=np.float32)
+        t1_mask = _load_on_grid(self.inputs.T1_mask, t1_img, order=0) > 0
+        first_pass_mask = _load_on_grid(self.inputs.first_pass_mask, t1_img) > 0.5
+        coreg_pet = _load_on_grid(self.inputs.coreg_pet, t1_img)
+        # The PET image is skull stripped, its brain is where it is not zero
+        coreg_mask = coreg_pet > 0
+
+        # Normalization, in template space
+        norm_img = nb.load(self.inputs.norm_pet)
+        norm_pet = _load_on_grid(self.inputs.norm_pet, norm_img)
+        template_mask = None
+        if isdefined(self.inputs.template_mask):
+            template_mask = _load_on_grid(self.inputs.template_mask, norm_img, order=0) > 0
+
+        metrics = {
+            'label': label,
+            'dice_first_pass': dice(first_pass_mask, t1_mask),
+            'dice_second_pass': dice(coreg_mask, t1_mask),
+            'normalized_mutual_information': normalized_mutual_information(
+                coreg_pet, t1, t1_mask),
+            'brain_coverage': None if template_mask is None else
+                brain_coverage(norm_pet, template_mask),
+        }
+        metrics = {key: None if isinstance(value, float) and np.isnan(value) else value
+                   for key, value in metrics.items()}
+
+        self._out_file = os.path.abspath(f"{label}_qc.tsv")
+        write_tsv(self._out_file, [metrics], QC_FIELDS)
+
+        self._coreg_mosaic = os.path.abspath(f"{label}_coreg.png")
+        write_png(self._coreg_mosaic, mosaic(t1, coreg_mask))
+        self._norm_mosaic = os.path.abspath(f"{label}_norm.png")
+        write_png(self._norm_mosaic, mosaic(norm_pet, template_mask))
+        return runtime
+
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["out_file"] = self._out_file
+        outputs["coreg_mosaic"] = self._coreg_mosaic
+        outputs["norm_mosaic"] = self._norm_mosaic
+        return outputs
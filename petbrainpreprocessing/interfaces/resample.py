@@ -0,0 +1,122 @@
+import os
+import nibabel as nb
+from nibabel.processing import resample_to_output
+from nipype.utils.filemanip import split_filename
+
+from nipype.interfaces.base import (
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+    Directory,
+    traits,
+    isdefined
+)
+
+from ..cache import DerivativeCache
+
+
+def voxel_size_entity(voxel_size):
+    """
+    File name entity of a voxel size, e.g. res-3p0mm or res-2p0x2p0x2p43mm.
+
+    Examples
+    --------
+    >>> voxel_size_entity([3.0, 3.0, 3.0])
+    'res-3p0mm'
+    """
+    sizes = [f"{size:.1f}" if round(size, 1) == size else f"{size:g}"
+             for size in voxel_size]
+    if len(set(sizes)) == 1:
+        sizes = sizes[:1]
+    return f"res-{'x'.join(sizes).replace('.', 'p')}mm"
+
+
+class ResampleToReferenceInputSpec(BaseInterfaceInputSpec):
+    in_file = File(
+        desc="image to resample",
+        exists=True,
+        mandatory=True
+    )
+    reference_image = File(
+        desc="image whose voxel size is used, only its header is read",
+        exists=True,
+        mandatory=True
+    )
+    order = traits.Range(
+        low=0,
+        high=5,
+        value=3,
+        usedefault=True,
+        desc="spline interpolation order"
+    )
+    cache_dir = Directory(
+        desc="content-addressed cache for the resampled image"
+    )
+    cache_size_gb = traits.Float(
+        desc="maximum size of the cache in GB"
+    )
+
+
+class ResampleToReferenceOutputSpec(TraitedSpec):
+    out_file = File(desc="resampled image", exists=True)
+
+
+class ResampleToReference(BaseInterface):
+    """
+    Resample an image to the voxel size of a reference image.
+
+    The output is written uncompressed, so later nodes can memory-map it.
+    Its name includes the voxel size (e.g. res-3p0mm), so images resampled
+    to the PET images of different voxel sizes of a session can share an
+    output folder.
+    When a cache folder is given, the resampled image is looked up by the
+    contents of the input image and the target voxel size and only computed
+    when it is not cached yet. The cached image is hard linked into the node
+    folder, so it stays available when the entry is evicted from the cache.
+
+    Examples
+    --------
+    >>> resample = ResampleToReference()
+    >>> resample.inputs.in_file = 'sub-01_desc-preproc_T1w.nii.gz'
+    >>> resample.inputs.reference_image = 'sub-01_pet.nii.gz'
+    >>> resample.inputs.cache_dir = '/scratch/cache'
+    >>> resample.run()
+    """
+
+    input_spec = ResampleToReferenceInputSpec
+    output_spec = ResampleToReferenceOutputSpec
+
+
+    def _run_interface(self, runtime):
+        voxel_size = [round(float(size), 4) for size in
+                      nb.load(self.inputs.reference_image).header.get_zooms()[:3]]
+        _, base, _ = split_filename(self.inputs.in_file)
+        filename = (f"{base.replace('_T1w', '')}_{voxel_size_entity(voxel_size)}"
+                    "_resampled-to-PET_T1w.nii")
+
+        def resample(out_file):
+            nb.save(resample_to_output(nb.load(self.inputs.in_file), voxel_size,
+                                       order=self.inputs.order), out_file)
+
+        if isdefined(self.inputs.cache_dir):
+            max_size_gb = None
+            if isdefined(self.inputs.cache_size_gb):
+                max_size_gb = self.inputs.cache_size_gb
+            cache = DerivativeCache(self.inputs.cache_dir, max_size_gb)
+            key = cache.key(self.inputs.in_file, voxel_size=voxel_size,
+                            order=self.inputs.order)
+            # Linked into the node folder, so eviction of the entry by
+            # another node does not remove the output of this one
+            self._out_file = cache.fetch(key, filename, resample,
+                                         out_file=os.path.abspath(filename))
+        else:
+            self._out_file = os.path.abspath(filename)
+            resample(self._out_file)
+        return runtime
+
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["out_file"] = self._out_file
+        return outputs
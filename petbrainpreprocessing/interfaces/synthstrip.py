@@ -1,15 +1,23 @@
 import os
 import warnings
 import os.path as op
+import numpy as np
+import nibabel as nb
+from nibabel.processing import conform, resample_from_to
 from nipype.interfaces.fsl.base import FSLCommand, FSLCommandInputSpec
+from nipype.utils.filemanip import fname_presuffix
 
 from nipype.interfaces.base import (
+    BaseInterface,
+    BaseInterfaceInputSpec,
     TraitedSpec,
     File,
     traits,
     isdefined
 )
 
+from .brainmask import keep_largest_component, save_brain_and_mask
+
 warnings.filterwarnings("always", category=UserWarning)
 
 
@@ -43,8 +51,7 @@ class SynthstripInputSpec(FSLCommandInputSpec):
         argstr="-d %s",
         position=3,
         mandatory=False,
-        hash_files=False,
-        genfile=True
+        hash_files=False
     )
     use_gpu = traits.Bool(
         desc="use the GPU",
@@ -67,6 +74,12 @@ class SynthstripInputSpec(FSLCommandInputSpec):
         argstr="--model %s",
         copyfile=False
     )
+    num_threads = traits.Int(
+        desc="number of PyTorch CPU threads",
+        argstr="-t %d",
+        mandatory=False,
+        nohash=True
+    )
 
 class SynthstripOutputSpec(TraitedSpec):
     out_file = File(desc="output file", exists=True)
@@ -89,6 +102,7 @@ class Synthstrip(FSLCommand):
     >>> synthstrip.inputs.border = 1
     >>> synthstrip.inputs.no_csf = True
     >>> synthstrip.inputs.model_file = 'model.pth'
+    >>> synthstrip.inputs.num_threads = 4
     >>> synthstrip.cmdline
     >>> synthstrip.run()
     """
@@ -100,7 +114,10 @@ class Synthstrip(FSLCommand):
 
     def _run_interface(self, runtime):
         runtime = super()._run_interface(runtime)
-        if runtime.stderr:
+        # Docker reports pulls and warnings on stderr, so only missing
+        # outputs mean that the brain extraction failed
+        outputs = self._list_outputs()
+        if not all(op.isfile(outputs[name]) for name in ["out_file", "mask_file"]):
             self.raise_exception(runtime)
         return runtime
 
@@ -130,22 +147,11 @@ class Synthstrip(FSLCommand):
         return mask_file
 
 
-    def _gen_dtfilename(self):
-        dt_file = self.inputs.dt_file
-        # Generate default output filename if non specified.
-        if not isdefined(dt_file) and isdefined(self.inputs.in_file):
-            dt_file = self._gen_fname(self.inputs.in_file, suffix="_brain_dt")
-            return dt_file
-        return dt_file
-
-
     def _gen_filename(self, name):
         if name == "out_file":
             return self._gen_outfilename()
         if name == "mask_file":
             return self._gen_maskfilename()
-        if name == "dt_file":
-            return self._gen_dtfilename()
         return None
 
 
@@ -162,10 +168,146 @@ class Synthstrip(FSLCommand):
         else:
             outputs['mask_file'] = self._gen_fname(suffix="_mask", **kwargs)
 
+        # The distance transform is only written on request
         if isdefined(self.inputs.dt_file):
-            outputs['dt_file'] = self.inputs.dt_file
-        else:
-            outputs['dt_file'] = self._gen_fname(suffix="_dt", **kwargs)
+            outputs['dt_file'] = os.path.abspath(self.inputs.dt_file)
 
         return outputs
     
+
+
+
+# Models loaded by SynthstripPython, kept per worker process
+_MODEL_CACHE = {}
+
+
+def load_synthstrip_model(model_file, device="cpu"):
+    """
+    Load a TorchScript SynthStrip model once per process.
+
+    Subsequent calls with the same model file and device return the model
+    that is already in memory.
+    """
+    key = (op.abspath(model_file), device)
+    if key not in _MODEL_CACHE:
+        try:
+            import torch
+        except ImportError as e:
+            raise ImportError("ERROR. The python skull strip backend requires \
+                PyTorch. Install it with `pip install torch`.") from e
+        model = torch.jit.load(model_file, map_location=device)
+        model.eval()
+        _MODEL_CACHE[key] = model
+    return _MODEL_CACHE[key]
+
+
+class SynthstripPythonInputSpec(BaseInterfaceInputSpec):
+    in_file = File(
+        desc="input image to skullstrip",
+        exists=True,
+        mandatory=True
+    )
+    out_file = File(
+        desc="save stripped image to file",
+        hash_files=False
+    )
+    mask_file = File(
+        desc="save binary brain mask to file",
+        hash_files=False
+    )
+    model_file = File(
+        exists=True,
+        mandatory=True,
+        desc="SynthStrip model weights exported with TorchScript"
+    )
+    use_gpu = traits.Bool(
+        False,
+        usedefault=True,
+        desc="use the GPU"
+    )
+    border = traits.Float(
+        1.0,
+        usedefault=True,
+        desc="mask border threshold in mm, defaults to 1"
+    )
+    num_threads = traits.Int(
+        desc="number of PyTorch CPU threads",
+        nohash=True
+    )
+
+
+class SynthstripPythonOutputSpec(TraitedSpec):
+    out_file = File(desc="output file", exists=True)
+    mask_file = File(desc="mask file", exists=True)
+
+
+class SynthstripPython(BaseInterface):
+    """
+    In-process brain extraction with a SynthStrip model.
+
+    The model is loaded once per worker process and reused for every image
+    that worker handles, which avoids the container startup and model loading
+    of synthstrip-docker. As in mri_synthstrip, the image is conformed to a
+    1 mm grid with a shape that is a multiple of 64, and the predicted signed
+    distance transform is thresholded at the border distance in the native
+    image space.
+
+    Examples
+    --------
+    >>> synthstrip = SynthstripPython()
+    >>> synthstrip.inputs.in_file = 'file.nii.gz'
+    >>> synthstrip.inputs.model_file = 'synthstrip.pt'
+    >>> synthstrip.inputs.num_threads = 4
+    >>> synthstrip.run()
+    """
+
+    input_spec = SynthstripPythonInputSpec
+    output_spec = SynthstripPythonOutputSpec
+
+
+    def _run_interface(self, runtime):
+        import torch
+
+        device = "cuda" if self.inputs.use_gpu else "cpu"
+        model = load_synthstrip_model(self.inputs.model_file, device)
+        if isdefined(self.inputs.num_threads):
+            torch.set_num_threads(self.inputs.num_threads)
+
+        img = nb.load(self.inputs.in_file)
+        extent = np.array(img.shape[:3]) * img.header.get_zooms()[:3]
+        out_shape = np.clip(np.ceil(extent / 64) * 64, 192, 320).astype(int)
+        conformed = conform(img, out_shape=tuple(out_shape), order=1,
+                            orientation="LIA")
+
+        data = conformed.get_fdata(dtype=np.float32)
+        data -= data.min()
+        data = np.clip(data / np.percentile(data, 99), 0, 1)
+
+        with torch.no_grad():
+            sdt = model(torch.from_numpy(data[None, None]).to(device))
+        sdt = sdt.cpu().numpy().squeeze().astype(np.float32)
+
+        # Threshold the distance transform in the native image space
+        sdt_img = nb.Nifti1Image(sdt, conformed.affine)
+        sdt_native = resample_from_to(sdt_img, img, order=1, cval=sdt.max())
+        mask = keep_largest_component(
+            np.asanyarray(sdt_native.dataobj) < self.inputs.border)
+
+        outputs = self._list_outputs()
+        save_brain_and_mask(img, mask, outputs["out_file"], outputs["mask_file"])
+        return runtime
+
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["out_file"] = self.inputs.out_file
+        if not isdefined(outputs["out_file"]):
+            outputs["out_file"] = fname_presuffix(
+                self.inputs.in_file, suffix="_brain", newpath=os.getcwd())
+        outputs["mask_file"] = self.inputs.mask_file
+        if not isdefined(outputs["mask_file"]):
+            outputs["mask_file"] = fname_presuffix(
+                self.inputs.in_file, suffix="_brain_mask", newpath=os.getcwd())
+        outputs["out_file"] = os.path.abspath(outputs["out_file"])
+        outputs["mask_file"] = os.path.abspath(outputs["mask_file"])
+        return outputs
@@ -0,0 +1,324 @@
+import os
+import numpy as np
+import nibabel as nb
+from nipype.utils.filemanip import fname_presuffix
+
+from nipype.interfaces.base import (
+    BaseInterface,
+    BaseInterfaceInputSpec,
+    TraitedSpec,
+    File,
+    InputMultiObject,
+    traits,
+    isdefined
+)
+
+from ..transforms import (apply_transform_chains, apply_transforms, displacement_field,
+                          gaussian_smooth, read_transforms)
+
+
+def _save_float(data, img, out_file, affine=None):
+    # Save float32 data with the header of an image, without scaling
+    out_img = nb.Nifti1Image(data, img.affine if affine is None else affine, img.header)
+    out_img.set_data_dtype(np.float32)
+    out_img.header.set_slope_inter(1, 0)
+    nb.save(out_img, out_file)
+
+
+def _save_resampled(data, img, reference, out_file):
+    # Save a resampled image with the voxel size of the reference and the
+    # frame timing of the input image
+    header = img.header.copy()
+    header.set_data_shape(data.shape)
+    header.set_zooms(reference.header.get_zooms()[:3]
+                     + img.header.get_zooms()[3:len(data.shape)])
+    out_img = nb.Nifti1Image(data, reference.affine, header)
+    out_img.set_data_dtype(np.float32)
+    out_img.header.set_slope_inter(1, 0)
+    nb.save(out_img, out_file)
+
+
+class ApplyTransformsPythonInputSpec(BaseInterfaceInputSpec):
+    input_image = File(
+        desc="3D or 4D image to resample",
+        exists=True,
+        mandatory=True
+    )
+    reference_image = File(
+        desc="image defining the output grid, only its header is read",
+        exists=True,
+        mandatory=True
+    )
+    transforms = InputMultiObject(
+        File(exists=True),
+        desc="transform files, the first is applied to the output grid first",
+        mandatory=True
+    )
+    invert_transform_flags = InputMultiObject(
+        traits.Bool(),
+        desc="invert the linear transform of the same position"
+    )
+    interpolation = traits.Enum(
+        "Linear",
+        "NearestNeighbor",
+        usedefault=True,
+        desc="interpolation method"
+    )
+    default_value = traits.Float(
+        0.0,
+        usedefault=True,
+        desc="value of points outside of the input image"
+    )
+    output_image = traits.Str(
+        desc="output file name",
+        hash_files=False
+    )
+    print_out_composite_warp_file = traits.Bool(
+        False,
+        usedefault=True,
+        desc="write the composed transforms as displacement field instead of "
+             "resampling the input image"
+    )
+
+
+class ApplyTransformsPythonOutputSpec(TraitedSpec):
+    output_image = File(desc="resampled image or displacement field", exists=True)
+
+
+class ApplyTransformsPython(BaseInterface):
+    """
+    In-process alternative to antsApplyTransforms.
+
+    Reads the linear (.mat, .txt, .h5) and displacement field transforms of
+    ANTs and resamples the input image with NumPy and SciPy. Consecutive
+    linear transforms are combined into one matrix, the output grid is
+    mapped once for all frames of a 4D image, and the frames are
+    interpolated in float32 in chunks of voxels. As with
+    --print-out-composite-warp-file, the chain can be written as a single
+    displacement field instead.
+
+    Examples
+    --------
+    >>> apply = ApplyTransformsPython()
+    >>> apply.inputs.input_image = 'sub-01_pet.nii'
+    >>> apply.inputs.reference_image = 'tpl-MNI152NLin2009cAsym_res-02_T1w.nii.gz'
+    >>> apply.inputs.transforms = ['sub-01_from-T1w_to-MNI152NLin2009cAsym_mode-image_xfm.h5',
+    ...                            'pet2anat0GenericAffine.mat']
+    >>> apply.run()
+    """
+
+    input_spec = ApplyTransformsPythonInputSpec
+    output_spec = ApplyTransformsPythonOutputSpec
+
+
+    def _run_interface(self, runtime):
+        invert_flags = self.inputs.invert_transform_flags \
+            if isdefined(self.inputs.invert_transform_flags) else None
+        mappings = read_transforms(self.inputs.transforms, invert_flags)
+        reference = nb.load(self.inputs.reference_image)
+        out_file = self._list_outputs()["output_image"]
+
+        if self.inputs.print_out_composite_warp_file:
+            field = nb.Nifti1Image(displacement_field(mappings, reference), reference.affine)
+            field.header.set_intent("vector")
+            nb.save(field, out_file)
+            return runtime
+
+        img = nb.load(self.inputs.input_image)
+        data = apply_transforms(
+            img, reference, mappings,
+            order=0 if self.inputs.interpolation == "NearestNeighbor" else 1,
+            default_value=self.inputs.default_value)
+        _save_resampled(data, img, reference, out_file)
+        return runtime
+
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["output_image"] = self.inputs.output_image
+        if not isdefined(outputs["output_image"]):
+            outputs["output_image"] = fname_presuffix(
+                self.inputs.input_image, suffix="_trans", newpath=os.getcwd(),
+                use_ext=False) + ".nii"
+        outputs["output_image"] = os.path.abspath(outputs["output_image"])
+        return outputs
+
+
+class ApplyTransformPairPythonInputSpec(BaseInterfaceInputSpec):
+    input_image = File(
+        desc="3D or 4D image to resample",
+        exists=True,
+        mandatory=True
+    )
+    reference_image = File(
+        desc="image defining the first output grid, only its header is read",
+        exists=True,
+        mandatory=True
+    )
+    transforms = InputMultiObject(
+        File(exists=True),
+        desc="transform files to the first output grid",
+        mandatory=True
+    )
+    invert_transform_flags = InputMultiObject(
+        traits.Bool(),
+        desc="invert the linear transform of the same position"
+    )
+    output_image = traits.Str(
+        desc="first output file name",
+        hash_files=False
+    )
+    second_reference_image = File(
+        desc="image defining the second output grid, only its header is read",
+        exists=True,
+        mandatory=True
+    )
+    second_transforms = InputMultiObject(
+        File(exists=True),
+        desc="transform files to the second output grid",
+        mandatory=True
+    )
+    second_invert_transform_flags = InputMultiObject(
+        traits.Bool(),
+        desc="invert the linear transform of the same position"
+    )
+    second_output_image = traits.Str(
+        desc="second output file name, relative paths may include a folder",
+        hash_files=False
+    )
+    interpolation = traits.Enum(
+        "Linear",
+        "NearestNeighbor",
+        usedefault=True,
+        desc="interpolation method"
+    )
+    default_value = traits.Float(
+        0.0,
+        usedefault=True,
+        desc="value of points outside of the input image"
+    )
+
+
+class ApplyTransformPairPythonOutputSpec(TraitedSpec):
+    output_image = File(desc="image resampled to the first grid", exists=True)
+    second_output_image = File(desc="image resampled to the second grid", exists=True)
+
+
+class ApplyTransformPairPython(BaseInterface):
+    """
+    Resample an image through two transform chains, e.g. to the T1w and the
+    template space, reading the input image once for both.
+
+    Works as two ApplyTransformsPython runs on the same input image. The
+    second output is written to the folder 'second' by default, so both
+    outputs may share their file name.
+
+    Examples
+    --------
+    >>> apply = ApplyTransformPairPython()
+    >>> apply.inputs.input_image = 'sub-01_pet.nii'
+    >>> apply.inputs.reference_image = 'sub-01_desc-preproc_T1w.nii.gz'
+    >>> apply.inputs.transforms = ['pet2anat0GenericAffine.mat']
+    >>> apply.inputs.second_reference_image = 'tpl-MNI152NLin2009cAsym_res-02_T1w.nii.gz'
+    >>> apply.inputs.second_transforms = [
+    ...     'sub-01_from-T1w_to-MNI152NLin2009cAsym_mode-image_xfm.h5',
+    ...     'pet2anat0GenericAffine.mat']
+    >>> apply.run()
+    """
+
+    input_spec = ApplyTransformPairPythonInputSpec
+    output_spec = ApplyTransformPairPythonOutputSpec
+
+
+    def _run_interface(self, runtime):
+        targets = []
+        for prefix in ["", "second_"]:
+            invert_flags = getattr(self.inputs, f"{prefix}invert_transform_flags")
+            mappings = read_transforms(getattr(self.inputs, f"{prefix}transforms"),
+                                       invert_flags if isdefined(invert_flags) else None)
+            targets.append((nb.load(getattr(self.inputs, f"{prefix}reference_image")),
+                            mappings))
+
+        img = nb.load(self.inputs.input_image)
+        resampled = apply_transform_chains(
+            img, targets,
+            order=0 if self.inputs.interpolation == "NearestNeighbor" else 1,
+            default_value=self.inputs.default_value)
+
+        outputs = self._list_outputs()
+        for (reference, _), data, name in zip(targets, resampled,
+                                              ["output_image", "second_output_image"]):
+            os.makedirs(os.path.dirname(outputs[name]), exist_ok=True)
+            _save_resampled(data, img, reference, outputs[name])
+        return runtime
+
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        for name, folder in [("output_image", ""), ("second_output_image", "second")]:
+            outputs[name] = getattr(self.inputs, name)
+            if not isdefined(outputs[name]):
+                outputs[name] = fname_presuffix(
+                    self.inputs.input_image, suffix="_trans",
+                    newpath=os.path.join(os.getcwd(), folder), use_ext=False) + ".nii"
+            outputs[name] = os.path.abspath(outputs[name])
+        return outputs
+
+
+class SmoothPythonInputSpec(BaseInterfaceInputSpec):
+    in_file = File(
+        desc="3D or 4D image to smooth",
+        exists=True,
+        mandatory=True
+    )
+    fwhm = traits.Float(
+        desc="full width at half maximum of the Gaussian kernel in mm",
+        mandatory=True
+    )
+    smoothed_file = File(
+        desc="output file name",
+        hash_files=False
+    )
+
+
+class SmoothPythonOutputSpec(TraitedSpec):
+    smoothed_file = File(desc="smoothed image", exists=True)
+
+
+class SmoothPython(BaseInterface):
+    """
+    In-process alternative to fsl.Smooth.
+
+    The Gaussian kernel is applied as three separable 1D filters, frame by
+    frame in float32, so no 3D kernel or float64 copy of a dynamic image is
+    held in memory. At the borders the kernel is renormalized to the part
+    inside the image, as by fslmaths (see gaussian_smooth).
+
+    Examples
+    --------
+    >>> smooth = SmoothPython()
+    >>> smooth.inputs.in_file = 'sub-01_pet_trans.nii'
+    >>> smooth.inputs.fwhm = 6
+    >>> smooth.run()
+    """
+
+    input_spec = SmoothPythonInputSpec
+    output_spec = SmoothPythonOutputSpec
+
+
+    def _run_interface(self, runtime):
+        img = nb.load(self.inputs.in_file)
+        data = gaussian_smooth(img, self.inputs.fwhm)
+        _save_float(data, img, self._list_outputs()["smoothed_file"])
+        return runtime
+
+
+    def _list_outputs(self):
+        outputs = self.output_spec().get()
+        outputs["smoothed_file"] = self.inputs.smoothed_file
+        if not isdefined(outputs["smoothed_file"]):
+            outputs["smoothed_file"] = fname_presuffix(
+                self.inputs.in_file, suffix="_smooth", newpath=os.getcwd(),
+                use_ext=False) + ".nii"
+        outputs["smoothed_file"] = os.path.abspath(outputs["smoothed_file"])
+        return outputs
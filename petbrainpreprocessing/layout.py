@@ -0,0 +1,225 @@
+import json
+import os
+import re
+import sqlite3
+from os.path import abspath, basename, dirname, expanduser
+
+
+ENTITY_PATTERN = re.compile(r"^([a-zA-Z0-9]+)-([a-zA-Z0-9]+)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    subdirectories TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    root TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    entities TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_subject ON files (root, subject);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+"""
+
+
+def parse_entities(filename):
+    """
+    Split a BIDS file name into its entities, suffix and extension.
+
+    Returns None for files that do not follow the BIDS naming scheme.
+
+    Examples
+    --------
+    >>> parse_entities('sub-01_ses-1_trc-FDG_pet.nii.gz')
+    {'sub': '01', 'ses': '1', 'trc': 'FDG', 'suffix': 'pet', 'extension': '.nii.gz'}
+    """
+    stem, dot, extension = filename.partition(".")
+    parts = stem.split("_")
+    entities = {}
+    for part in parts[:-1]:
+        match = ENTITY_PATTERN.match(part)
+        if match is None:
+            return None
+        entities[match.group(1)] = match.group(2)
+    if "sub" not in entities or "-" in parts[-1] or not parts[-1]:
+        return None
+    entities["suffix"] = parts[-1]
+    entities["extension"] = dot + extension
+    return entities
+
+
+def _matches(entities, filters):
+    # A filter value of None requires the entity to be absent, a list or
+    # tuple allows any of its values
+    for key, value in filters.items():
+        if value is None:
+            if key in entities:
+                return False
+        elif isinstance(value, (list, tuple)):
+            if entities.get(key) not in value:
+                return False
+        elif entities.get(key) != value:
+            return False
+    return True
+
+
+class DatasetIndex:
+    """
+    Persistent index of the files of BIDS and BIDS-derivatives datasets.
+
+    The index is stored in a SQLite database. Updating it only lists the
+    directories whose modification time changed since the last update, so
+    after the first scan an update costs a single stat call per directory
+    and queries never touch the dataset itself.
+
+    Parameters
+    ----------
+    db_path : string
+        Path of the SQLite database, created if it does not exist.
+
+    Examples
+    --------
+    >>> index = DatasetIndex('/scratch/layout.sqlite')
+    >>> index.update('/data/bids')
+    >>> index.get('/data/bids', sub='01', suffix='pet', extension='.nii.gz')
+    """
+
+    def __init__(self, db_path):
+        self.db_path = abspath(expanduser(db_path))
+        os.makedirs(dirname(self.db_path), exist_ok=True)
+        # Concurrent launches wait for each other instead of failing
+        self._connection = sqlite3.connect(self.db_path, timeout=600)
+        self._connection.executescript(SCHEMA)
+
+
+    def update(self, root):
+        """
+        Bring the index of a dataset up to date.
+
+        Only the participant folders (sub-*) of the dataset are indexed.
+
+        Returns
+        -------
+        n_scanned : int
+            Number of directories that were listed because they changed.
+
+        """
+        root = abspath(root)
+        known = {path: (mtime_ns, json.loads(subdirectories))
+                 for path, mtime_ns, subdirectories in self._connection.execute(
+                    "SELECT path, mtime_ns, subdirectories FROM directories WHERE root = ?",
+                    (root,))}
+
+        n_scanned = 0
+        with self._connection:
+            stack = [root]
+            while stack:
+                directory = stack.pop()
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+
+                if directory in known and known[directory][0] == mtime_ns:
+                    stack += known[directory][1]
+                    continue
+
+                n_scanned += 1
+                subdirectories = self._scan(root, directory, mtime_ns)
+                if directory in known:
+                    for removed in set(known[directory][1]) - set(subdirectories):
+                        self._remove_tree(removed)
+                stack += subdirectories
+        return n_scanned
+
+
+    def _scan(self, root, directory, mtime_ns):
+        # List a single directory and replace its entries in the index
+        subdirectories = []
+        rows = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    if directory != root or entry.name.startswith("sub-"):
+                        subdirectories.append(entry.path)
+                    continue
+                if directory == root:
+                    continue
+                entities = parse_entities(entry.name)
+                if entities is None:
+                    continue
+                # The datatype is the folder the file is stored in
+                datatype = basename(directory)
+                if not datatype.startswith(("sub-", "ses-")):
+                    entities["datatype"] = datatype
+                rows.append((entry.path, directory, root, entities["sub"],
+                             json.dumps(entities)))
+
+        self._connection.execute("DELETE FROM files WHERE directory = ?", (directory,))
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", rows)
+        self._connection.execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)",
+            (directory, root, mtime_ns, json.dumps(sorted(subdirectories))))
+        return subdirectories
+
+
+    def _remove_tree(self, directory):
+        # Remove a deleted directory and everything below it, '0' is the
+        # character following the path separator
+        for table, column in (("files", "directory"), ("directories", "path")):
+            self._connection.execute(
+                f"DELETE FROM {table} WHERE {column} = ? OR ({column} >= ? AND {column} < ?)",
+                (directory, directory + os.sep, directory + "0"))
+
+
+    def subjects(self, root):
+        """
+        Return the sorted participant labels (without sub- prefix) of a dataset.
+        """
+        return [subject for subject, in self._connection.execute(
+            "SELECT DISTINCT subject FROM files WHERE root = ? ORDER BY subject",
+            (abspath(root),))]
+
+
+    def get(self, root, sub=None, **filters):
+        """
+        Return the sorted paths of the files of a dataset matching all filters.
+
+        Parameters
+        ----------
+        root : string
+            Dataset directory as passed to `update`.
+        sub : string, optional
+            Participant label without the sub- prefix.
+        filters : optional
+            Entities (e.g. ses, trc, desc), suffix, extension or datatype the
+            files must have. None requires an entity to be absent and a list
+            allows any of its values.
+
+        """
+        query = "SELECT path, entities FROM files WHERE root = ?"
+        parameters = [abspath(root)]
+        if sub is not None:
+            query += " AND subject = ?"
+            parameters.append(sub)
+        return sorted(path for path, entities in
+                      self._connection.execute(query, parameters)
+                      if _matches(json.loads(entities), filters))
+
+
+    def entities(self, file_path):
+        """
+        Return the entities of an indexed file.
+        """
+        row = self._connection.execute(
+            "SELECT entities FROM files WHERE path = ?", (abspath(file_path),)).fetchone()
+        if row is None:
+            raise KeyError(f"ERROR. {file_path} is not indexed.")
+        return json.loads(row[0])
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from os.path import isfile
+from os.path import join as opj
+
+
+def parameters_hash(parameters):
+    """
+    Return the SHA-256 hex digest of a dictionary of parameters.
+    """
+    return hashlib.sha256(
+        json.dumps(parameters, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def complete_record(manifest_dir, label, outputs):
+    """
+    Mark the record of a PET image complete, run as node of its workflow.
+    """
+    from petbrainpreprocessing.manifest import RunManifest
+
+    if not isinstance(outputs, list):
+        outputs = [outputs]
+    RunManifest(manifest_dir)._finish(label, "complete", sorted(outputs))
+
+
+class RunManifest:
+    """
+    Record of the processing state of every PET image of a cohort.
+
+    Each PET image has its own JSON record holding the hashes of its input
+    files, the parameters it was processed with and, once its outputs are
+    written, the list of output files. Separate records keep concurrent
+    batch launches from overwriting each other.
+
+    The manifest is also a nipype status callback: the record of an image is
+    completed when the DataSink of its workflow finishes, and marked failed
+    when one of its nodes raises. Graph plugins submit all nodes at once and
+    report no status back, the workflows then complete their records
+    themselves (see add_completion_node). Images that failed there remain
+    "running", which is not complete either, so they are processed again.
+
+    Parameters
+    ----------
+    manifest_dir : string
+        Folder holding the records.
+
+    Examples
+    --------
+    >>> manifest = RunManifest('/output/logs/manifest')
+    >>> if not manifest.is_complete('sub-01_trc-FDG', input_hashes, parameters):
+    ...     manifest.start('sub-01_trc-FDG', 'coreg_and_norm_wf_sub-01_trc-FDG',
+    ...                    input_hashes, parameters)
+    >>> wf.run('MultiProc', plugin_args={'status_callback': manifest})
+    """
+
+    def __init__(self, manifest_dir):
+        self.manifest_dir = manifest_dir
+        self._workflows = {}
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+
+    def _record_path(self, label):
+        return opj(self.manifest_dir, f"{label}_manifest.json")
+
+
+    def read(self, label):
+        """
+        Return the record of a PET image, or None if it was never processed.
+        """
+        record_path = self._record_path(label)
+        if not isfile(record_path):
+            return None
+        try:
+            with open(record_path) as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+
+    def _write(self, record):
+        record_path = self._record_path(record["label"])
+        tmp_path = f"{record_path}.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(record, f, indent=2)
+        os.replace(tmp_path, record_path)
+
+
+    def is_complete(self, label, input_hashes, parameters):
+        """
+        Check whether a PET image was processed with the same inputs and
+        parameters and all its outputs still exist.
+        """
+        record = self.read(label)
+        return (record is not None
+                and record["status"] == "complete"
+                and record["input_hashes"] == input_hashes
+                and record["parameters_hash"] == parameters_hash(parameters)
+                and all(isfile(output) for output in record["outputs"]))
+
+
+    def start(self, label, workflow_name, input_hashes, parameters):
+        """
+        Record that a PET image is processed by the given workflow.
+        """
+        self._workflows[workflow_name] = label
+        self._write({
+            "label": label,
+            "status": "running",
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "finished": None,
+            "input_hashes": input_hashes,
+            "parameters": parameters,
+            "parameters_hash": parameters_hash(parameters),
+            "outputs": [],
+        })
+
+
+    def _finish(self, label, status, outputs=None):
+        record = self.read(label)
+        if record is None or record["status"] == "failed":
+            return
+        record["status"] = status
+        record["finished"] = datetime.now().isoformat(timespec="seconds")
+        if outputs is not None:
+            record["outputs"] = outputs
+        self._write(record)
+
+
+    def __call__(self, node, status):
+        workflow_name = next((name for name in node.fullname.split(".")
+                              if name in self._workflows), None)
+        if workflow_name is None or status == "start":
+            return
+        label = self._workflows[workflow_name]
+
+        if status == "exception":
+            self._finish(label, "failed")
+        elif node.name == "output_files":
+            # The DataSink is the last node of a workflow
+            outputs = node.result.outputs.out_file
+            if not isinstance(outputs, list):
+                outputs = [outputs]
+            self._finish(label, "complete", sorted(outputs))
+
+
+    def add_completion_node(self, workflow, workflow_name):
+        """
+        Complete the record of a PET image from within its workflow, after
+        its DataSink, for plugins that do not call the status callback.
+
+        Parameters
+        ----------
+        workflow : nipype Workflow
+            Workflow containing the workflow of the image.
+        workflow_name : string
+            Name of the workflow of the image, as given to start.
+
+        """
+        from nipype import Node
+        from nipype.interfaces.utility import Function
+
+        label = self._workflows[workflow_name]
+        complete = Node(Function(input_names=['manifest_dir', 'label', 'outputs'],
+                                 output_names=[],
+                                 function=complete_record),
+                        name=f'complete_manifest_{label}')
+        complete.inputs.manifest_dir = os.path.abspath(self.manifest_dir)
+        complete.inputs.label = label
+        workflow.connect(workflow.get_node(workflow_name), 'output_files.out_file',
+                         complete, 'outputs')
@@ -1,126 +1,558 @@
-from petbrainpreprocessing.workflows.preprocessing_workflow import \
-    pet_preprocessing_workflow
-from templateflow import api as tflow
+# Only light modules are imported here, so that --help and argument errors
+# are fast. nibabel and nipype are imported once the inputs are validated.
+from petbrainpreprocessing.cache import DEFAULT_CACHE_DIR, DerivativeCache
+from petbrainpreprocessing.cluster import GRAPH_PLUGINS, PLUGINS
+from petbrainpreprocessing.layout import DatasetIndex
+from petbrainpreprocessing.manifest import RunManifest
+from petbrainpreprocessing.profiling import NodeProfiler
+from petbrainpreprocessing.templates import (DEFAULT_RESOLUTION, DEFAULT_TEMPLATE,
+                                             fetch_templates)
 import argparse
+import json
+import sys
 from os import makedirs
-from os.path import exists, isfile
+from os.path import basename, exists, isfile
 from os.path import join as opj
-from nibabel.processing import resample_to_output
-from nibabel import load, save
 from multiprocessing import cpu_count
+from math import prod
+
+
+def get_participants(index, bids_dir, participant_labels=None):
+    """
+    Return the list of participants to process.
+
+    Parameters
+    ----------
+    index : DatasetIndex
+        Index of the BIDS dataset.
+    bids_dir : string
+        Path to the BIDS dataset directory.
+    participant_labels : list of strings, optional
+        Participant identifiers with or without the sub- prefix. If not
+        given, all participants found in the BIDS directory are returned.
+
+    """
+    if not participant_labels:
+        participants = [f"sub-{subject}" for subject in index.subjects(bids_dir)]
+        if not participants:
+            raise FileNotFoundError(f"ERROR. Cannot find any participants \
+                in BIDS folder {bids_dir}.")
+        return participants
+
+    participants = []
+    for label in participant_labels:
+        participant = label if label.startswith("sub-") else f"sub-{label}"
+        if participant not in participants:
+            participants.append(participant)
+    return participants
+
+
+# Entities of the fMRIPrep anatomical derivatives in native T1w space
+ANATOMICAL_FILTERS = {
+    "T1": {"datatype": "anat", "desc": "preproc", "suffix": "T1w",
+           "space": None, "extension": [".nii.gz", ".nii"]},
+    "T1_mask": {"datatype": "anat", "desc": "brain", "suffix": "mask",
+                "space": None, "extension": [".nii.gz", ".nii"]},
+    "transform": {"datatype": "anat", "from": "T1w", "to": DEFAULT_TEMPLATE,
+                  "mode": "image", "suffix": "xfm", "extension": ".h5"},
+}
+
+
+def find_anatomical(index, anat_derivatives_dir, participant, session, name,
+                    template=DEFAULT_TEMPLATE):
+    """
+    Find an anatomical derivative of a participant.
+
+    Derivatives of the same session are preferred. Longitudinal fMRIPrep
+    runs store a single anatomical reference without session entity, which
+    is used for all sessions. The transform is the one to the given template.
+    """
+    filters = dict(ANATOMICAL_FILTERS[name])
+    if name == "transform":
+        filters["to"] = template
+    for ses in ([session, None] if session is not None else [None]):
+        candidates = index.get(anat_derivatives_dir, sub=participant[4:], ses=ses,
+                               **filters)
+        if len(candidates) > 1:
+            raise ValueError(f"ERROR. Ambiguous {name} derivatives of \
+                {participant}: {', '.join(candidates)}.")
+        if candidates:
+            return candidates[0]
+    return None
+
+
+def collect_participant_inputs(participant, index, bids_dir, anat_derivatives_dir,
+                               template=DEFAULT_TEMPLATE):
+    """
+    Collect and check the input files of a single participant.
+
+    Every PET image of the participant, e.g. of different sessions,
+    tracers (trc-), acquisitions (acq-) or runs, is processed separately.
+
+    Parameters
+    ----------
+    participant : string
+        Participant identifier including the sub- prefix.
+    index : DatasetIndex
+        Index of the BIDS and fMRIPrep derivatives datasets.
+    bids_dir : string
+        Path to the BIDS dataset directory.
+    anat_derivatives_dir : string
+        fMRIPrep Anatomical derivatives directory.
+    template : string, optional
+        Template space the PET images are normalized to.
+
+    Returns
+    -------
+    inputs : list of dicts
+        Per PET image the paths to the PET image, T1w image, brain mask and
+        T1w to template transform, the label of the PET image (its file name
+        without suffix) and the session.
+
+    """
+    pet_images = index.get(bids_dir, sub=participant[4:], datatype="pet",
+                           suffix="pet", extension=[".nii.gz", ".nii"])
+    if not pet_images:
+        raise FileNotFoundError(f"ERROR. Cannot find any PET images of \
+            {participant} in BIDS folder {bids_dir}.")
+
+    inputs = []
+    missing_files = []
+    for pet_image in pet_images:
+        session = index.entities(pet_image).get("ses")
+        pet_inputs = {
+            "pet_image": pet_image,
+            "label": basename(pet_image).split("_pet.")[0],
+            "session": session,
+        }
+        for name in ANATOMICAL_FILTERS:
+            pet_inputs[name] = find_anatomical(
+                index, anat_derivatives_dir, participant, session, name, template)
+            if pet_inputs[name] is None:
+                missing_files.append(f"{name} of {pet_inputs['label']}")
+        inputs.append(pet_inputs)
+
+    # Check for missing input data
+    if missing_files:
+        raise FileNotFoundError(f"ERROR. The following fMRIPrep derivatives \
+            are missing in {anat_derivatives_dir}: {', '.join(missing_files)}")
+
+    return inputs
+
+
+def collect_inputs(participants, index, bids_dir, anat_derivatives_dir,
+                   template=DEFAULT_TEMPLATE, skip_incomplete=False):
+    """
+    Collect and check the input files of all participants.
+
+    Parameters
+    ----------
+    participants : list of strings
+        Participant identifiers including the sub- prefix.
+    index : DatasetIndex
+        Index of the BIDS and fMRIPrep derivatives datasets.
+    bids_dir : string
+        Path to the BIDS dataset directory.
+    anat_derivatives_dir : string
+        fMRIPrep Anatomical derivatives directory.
+    template : string, optional
+        Template space the PET images are normalized to.
+    skip_incomplete : bool, optional
+        Skip participants without PET images or fMRIPrep derivatives with a
+        warning instead of raising, used when the participants were not
+        selected explicitly.
+
+    Returns
+    -------
+    inputs : list of dicts
+        Inputs of every PET image, see collect_participant_inputs.
+
+    """
+    inputs = []
+    for participant in participants:
+        try:
+            inputs.extend(collect_participant_inputs(
+                participant, index, bids_dir, anat_derivatives_dir, template))
+        except FileNotFoundError as error:
+            if not skip_incomplete:
+                raise
+            reason = " ".join(str(error).split()).removeprefix("ERROR. ")
+            print(f"WARNING. Skipping {participant}: {reason}", file=sys.stderr)
+
+    if not inputs:
+        raise FileNotFoundError(f"ERROR. Cannot find any participants with PET \
+            images and fMRIPrep derivatives in {bids_dir}.")
+    return inputs
+
+
+def count_frames(pet_file_path):
+    """
+    Return the number of frames of a PET image, only the header is read.
+    """
+    from nibabel import load
+
+    pet_shape = load(pet_file_path).header.get_data_shape()
+    if len(pet_shape) > 4 and any(size > 1 for size in pet_shape[4:]):
+        raise ValueError(f"ERROR. Unsupported PET image dimensions \
+            {pet_shape} of {pet_file_path}.")
+    return pet_shape[3] if len(pet_shape) > 3 else 1
+
+
+def estimate_mem_gb(*file_paths):
+    """
+    Estimate the memory footprint of a volume of the largest of the given images.
+
+    Only the image headers are read. For 4D images the size of a single
+    volume is used. The estimate assumes the data is held in double
+    precision, which is what ANTs uses internally.
+
+    Parameters
+    ----------
+    file_paths : strings
+        Paths to NIfTI images.
+
+    Returns
+    -------
+    mem_gb : float
+        Size in GB of the largest volume.
+
+    """
+    from nibabel import load
+
+    return max(prod(load(file_path).shape[:3]) * 8 / 1024 ** 3
+               for file_path in file_paths)
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Function that handles the inputs for preprocessing pet images."
     )
-    parser.add_argument("bids_dir", 
+    parser.add_argument("bids_dir",
                         help="Path to the BIDS dataset directory.")
-    parser.add_argument("output_dir", 
+    parser.add_argument("output_dir",
                         help="Output directory.")
-    parser.add_argument("anat_derivatives_dir", 
+    parser.add_argument("anat_derivatives_dir",
                         help="fMRIPrep Anatomical derivatives directory.")
     parser.add_argument("--participant-label",
-                        required=True,
+                        nargs="+",
                         help="A space delimited list of participant identifiers or \
-                            a single identifier (the sub- prefix can be removed).",
+                            a single identifier (the sub- prefix can be removed). \
+                            All participants in bids_dir are processed if omitted, \
+                            skipping those without PET images or fMRIPrep \
+                            derivatives.",
     )
     parser.add_argument("--nprocs",
                         type=int,
                         help="Maximum number of threads across all processes.",
     )
+    parser.add_argument("--omp-nthreads",
+                        type=int,
+                        help="Maximum number of threads per process \
+                            (defaults to nprocs, at most 8).",
+    )
+    parser.add_argument("--mem-gb",
+                        type=float,
+                        help="Upper bound memory limit in GB across all processes.",
+    )
     parser.add_argument("--fwhm",
                         type=float,
                         help="The full width at half maximum smoothing kernel.",
     )
+    parser.add_argument("--skullstrip-backend",
+                        choices=["docker", "python", "threshold"],
+                        default="docker",
+                        help="Brain extraction backend: synthstrip-docker, an \
+                            in-process SynthStrip model or a fast intensity \
+                            threshold mask (FDG only).",
+    )
+    parser.add_argument("--skullstrip-model",
+                        help="Alternative SynthStrip model weights. Required \
+                            for the python backend (TorchScript model).",
+    )
+    parser.add_argument("--registration-preset",
+                        choices=["fast", "default", "precise"],
+                        default="default",
+                        help="Multi-resolution schedule and convergence criteria \
+                            of the coregistration.",
+    )
+    parser.add_argument("--engine",
+                        choices=["external", "python"],
+                        default="external",
+                        help="Engine of the resampling and smoothing steps: \
+                            antsApplyTransforms and FSL, or in-process NumPy \
+                            and SciPy. Registrations always run ANTs.",
+    )
+    parser.add_argument("--template",
+                        default=DEFAULT_TEMPLATE,
+                        help="Templateflow template space the PET images are \
+                            normalized to. The fMRIPrep derivatives must contain \
+                            the transform to this space.",
+    )
+    parser.add_argument("--template-resolution",
+                        type=int,
+                        default=DEFAULT_RESOLUTION,
+                        help="Templateflow resolution index of the template and \
+                            atlas (e.g. 1 for 1 mm, 2 for 2 mm).",
+    )
+    parser.add_argument("--template-cache",
+                        help="Read-only template cache filled with \
+                            pet_brain_preprocessing_tools prefetch-templates. \
+                            Templates are taken from it without network access.",
+    )
+    parser.add_argument("--atlas",
+                        help="Templateflow atlas (e.g. Schaefer2018) or label \
+                            image in template space. The regional statistics of \
+                            the normalized PET images are computed.",
+    )
+    parser.add_argument("--atlas-desc",
+                        help="Templateflow atlas variant (e.g. 400Parcels7Networks).",
+    )
+    parser.add_argument("--reference-region",
+                        nargs="+",
+                        help="Names or label indices of the atlas regions used \
+                            as SUVR reference region.",
+    )
+    parser.add_argument("--compress-level",
+                        type=int,
+                        choices=range(10),
+                        default=6,
+                        metavar="{0-9}",
+                        help="gzip compression level of the output images, 0 \
+                            writes them uncompressed. Intermediate images are \
+                            never compressed.",
+    )
     parser.add_argument("--work-dir",
-                        help="Path where intermediate results should be stored.",
+                        help="Path where intermediate results should be stored \
+                            (defaults to work in the output dir). Kept between \
+                            runs, so a rerun only repeats the steps whose inputs \
+                            or settings changed.",
+    )
+    parser.add_argument("--cache-dir",
+                        default=DEFAULT_CACHE_DIR,
+                        help="Path where derivatives that only depend on their \
+                            inputs (e.g. the resampled T1w) are cached.",
+    )
+    parser.add_argument("--cache-size-gb",
+                        type=float,
+                        default=10.0,
+                        help="Maximum size of the derivative cache in GB. Least \
+                            recently used entries are removed first.",
+    )
+    parser.add_argument("--plugin",
+                        choices=PLUGINS,
+                        default="MultiProc",
+                        help="Nipype execution plugin. The cluster plugins submit \
+                            every node as a job requesting its own cores and \
+                            memory.",
+    )
+    parser.add_argument("--plugin-args",
+                        help="JSON object with additional plugin arguments, e.g. \
+                            '{\"sbatch_args\": \"--partition=short\"}'.",
+    )
+    parser.add_argument("--layout-db",
+                        help="SQLite database indexing the BIDS and derivatives \
+                            folders (defaults to layout.sqlite in the cache dir).",
+    )
+    parser.add_argument("--skip-layout-update",
+                        action="store_true",
+                        help="Resolve inputs from the existing dataset index \
+                            without checking the folders for changes.",
     )
     args = parser.parse_args()
 
     # Check arguments
-    participant = f"sub-{args.participant_label}"
+    if args.skullstrip_backend == "python" and args.skullstrip_model is None:
+        parser.error("--skullstrip-model is required for the python skull strip backend")
+    if args.skullstrip_model is not None and not isfile(args.skullstrip_model):
+        raise FileNotFoundError(f"ERROR. Cannot find skull strip model \
+            {args.skullstrip_model}.")
+
+    if args.reference_region and args.atlas is None:
+        parser.error("--reference-region requires --atlas")
+
+    extra_plugin_args = {}
+    if args.plugin_args is not None:
+        try:
+            extra_plugin_args = json.loads(args.plugin_args)
+        except ValueError:
+            parser.error("--plugin-args must be a JSON object")
+        if not isinstance(extra_plugin_args, dict):
+            parser.error("--plugin-args must be a JSON object")
+
+    if not exists(args.bids_dir):
+        raise FileNotFoundError(f"ERROR. Cannot find BIDS folder {args.bids_dir}.")
+
     if not exists(args.anat_derivatives_dir):
         raise FileNotFoundError(f"ERROR. Cannot find fMRIPrep derivatives \
             folder {args.anat_derivatives_dir}.")
 
-    participant_fmriprep_anat_folder = \
-        opj(args.anat_derivatives_dir, participant, "anat")
-    
-    if not exists(participant_fmriprep_anat_folder):
-        raise FileNotFoundError(f"ERROR. Cannot find fMRIPrep derivatives \
-            participant_folder {participant_fmriprep_anat_folder}.")
+    # Only directories that changed since the last run are listed again
+    index = DatasetIndex(args.layout_db or opj(args.cache_dir, "layout.sqlite"))
+    if not args.skip_layout_update:
+        index.update(args.bids_dir)
+        index.update(args.anat_derivatives_dir)
 
-    participant_bids_folder = opj(args.bids_dir, participant)
+    participants = get_participants(index, args.bids_dir, args.participant_label)
 
-    if not exists(participant_bids_folder):
-        raise FileNotFoundError(f"ERROR. Cannot find BIDS participant_folder \
-            {participant_bids_folder}.")
+    # Check all participants before anything is run. Participants that were
+    # not named explicitly are skipped if their inputs are incomplete.
+    pet_inputs = collect_inputs(participants, index, args.bids_dir,
+                                args.anat_derivatives_dir, args.template,
+                                skip_incomplete=not args.participant_label)
+    n_frames = {inputs["label"]: count_frames(inputs["pet_image"])
+                for inputs in pet_inputs}
 
     # Make sure the workdir exists
-    if args.work_dir is not None:
-        makedirs(args.work_dir, exist_ok=True)
+    if args.work_dir is None:
+        args.work_dir = opj(args.output_dir, "work")
+    makedirs(args.work_dir, exist_ok=True)
 
     # Make sure the output dir exists
     makedirs(args.output_dir, exist_ok=True)
 
-    # Fetch files
-    anat_file_path = opj(participant_fmriprep_anat_folder,
-        f"{participant}_desc-preproc_T1w.nii.gz")
-    anat_mask_file_path = opj(participant_fmriprep_anat_folder,
-        f"{participant}_desc-brain_mask.nii.gz")
-    anat2mni_matrix = opj(participant_fmriprep_anat_folder,
-        f"{participant}_from-T1w_to-MNI152NLin2009cAsym_mode-image_xfm.h5")
-    pet_file_path = opj(participant_bids_folder, "pet",
-        f"{participant}_pet.nii.gz")
+    # Fetch template and the atlas for the regional statistics
+    template_files = fetch_templates(args.template, args.template_resolution,
+                                     args.atlas, args.atlas_desc, args.template_cache)
+    template = template_files['T1w']
+    atlas_file = template_files['atlas']
+    atlas_labels = template_files['atlas_labels']
 
-    # Check for missing input data
-    missing_files = []
-    for file_path in [anat_file_path, anat_mask_file_path, anat2mni_matrix, pet_file_path]:
-        if not isfile(file_path):
-            missing_files.append(file_path)
-    
-    if missing_files:
-        raise FileNotFoundError(f"ERROR. The following files are missing: {', '.join(missing_files)}")
-
-    # Fetch MNI template
-    template = tflow.get('MNI152NLin2009cAsym', desc=None, resolution=2,
-                          suffix='T1w', extension='nii.gz')
-
-    # Resample T1w to PET voxel dimensions (needed as reference image for ANTs)
-    pet_file_img = load(pet_file_path)
-    anat_file_img = load(anat_file_path)
-    resample_size = abs(pet_file_img.affine.diagonal()[0:3])
-    T1w_resampled_img = resample_to_output(anat_file_img, resample_size)
-    T1w_resampled_path = opj(participant_fmriprep_anat_folder, 
-        f'{participant}_desc-preproc_resampled-to-PET_T1w.nii.gz')
-    save(T1w_resampled_img, T1w_resampled_path)
-    
     # Set nprocs to max if not specified
     if args.nprocs == None:
         args.nprocs = cpu_count()
 
-    # Set up coregistration + normalization pipeline
-    wf = pet_preprocessing_workflow(participant,  args.work_dir, args.fwhm != None)
-    wf.inputs.input_files.results_folder = args.output_dir
-    wf.inputs.input_files.T1 = anat_file_path
-    wf.inputs.input_files.T1_mask = anat_mask_file_path
-    wf.inputs.input_files.T1_resampled_template = T1w_resampled_path
-    wf.inputs.input_files.participant_id = participant
-    wf.inputs.input_files.template = template
-    wf.inputs.input_files.pet_image =  pet_file_path
-    wf.inputs.input_files.num_threads = int(args.nprocs)
-    wf.inputs.input_files.transform = anat2mni_matrix
-
-    # Optional smoothing
-    if args.fwhm is not None:
-        wf.inputs.input_files.smooth_fwhm = int(args.fwhm)
+    # A single registration should not claim the whole machine, so MultiProc
+    # can run other nodes next to it
+    if args.omp_nthreads is None:
+        args.omp_nthreads = min(args.nprocs, 8)
+    omp_nthreads = min(args.omp_nthreads, args.nprocs)
+
+    plugin_args = {'n_procs': int(args.nprocs)}
+    if args.mem_gb is not None:
+        plugin_args['memory_gb'] = args.mem_gb
+        # Nodes requesting more memory than available are run on their own
+        plugin_args['raise_insufficient'] = False
+    plugin_args.update(extra_plugin_args)
+
+    # The inputs are valid, load the workflow engine
+    from nibabel import load
+    from nipype import Workflow, config
+    from petbrainpreprocessing.cluster import set_cluster_resources
+    from petbrainpreprocessing.workflows.preprocessing_workflow import \
+        pet_preprocessing_workflow
+
+    # Collect all participant pipelines in one workflow so that a single
+    # scheduler shares nprocs across participants
+    wf = Workflow(name='pet_brain_preprocessing_wf', base_dir=args.work_dir)
+
+    # Skip images that were completely processed with the same inputs and
+    # settings. Images that are processed again reuse the unchanged steps
+    # from the work dir, e.g. only smoothing is rerun when --fwhm changes.
+    manifest = RunManifest(opj(args.output_dir, "logs", "manifest"))
+    cache = DerivativeCache(args.cache_dir, args.cache_size_gb)
+    parameters = {
+        'fwhm': args.fwhm,
+        'skullstrip_backend': args.skullstrip_backend,
+        'skullstrip_model': args.skullstrip_model and cache.key(args.skullstrip_model),
+        'registration_preset': args.registration_preset,
+        'engine': args.engine,
+        'compress_level': args.compress_level,
+        'atlas': atlas_file and cache.key(atlas_file),
+        'reference_region': args.reference_region,
+    }
+
+    # Scans of a participant that share their anatomical derivatives are
+    # processed by one workflow, so anatomical work is done once
+    anatomy_scans = {}
+    for inputs in pet_inputs:
+        input_hashes = {name: cache.key(inputs[name]) for name in
+                        ["pet_image", "T1", "T1_mask", "transform"]}
+        input_hashes["template"] = cache.key(template)
+        if manifest.is_complete(inputs["label"], input_hashes, parameters):
+            print(f"{inputs['label']} is up to date, skipping.")
+            continue
+        anatomy = (inputs["T1"], inputs["T1_mask"], inputs["transform"])
+        anatomy_scans.setdefault(anatomy, []).append((inputs, input_hashes))
+
+    if not anatomy_scans:
+        print("All PET images are up to date.")
+        return
+
+    for (T1, T1_mask, transform), scans in anatomy_scans.items():
+        # sub-<label>, with session for session specific derivatives
+        anatomy_label = basename(T1).split("_desc-")[0]
+        participant = anatomy_label.split("_")[0]
+
+        # Set up coregistration + normalization pipeline
+        participant_wf = pet_preprocessing_workflow(
+            participant, None, args.fwhm != None,
+            [{
+                "label": inputs["label"],
+                "pet_image": inputs["pet_image"],
+                "session": inputs["session"],
+                "n_frames": n_frames[inputs["label"]],
+                "voxel_size": load(inputs["pet_image"]).header.get_zooms()[:3],
+                "mem_gb": estimate_mem_gb(inputs["pet_image"], T1),
+            } for inputs, _ in scans],
+            omp_nthreads=omp_nthreads,
+            mem_gb=estimate_mem_gb(T1),
+            skullstrip_backend=args.skullstrip_backend,
+            skullstrip_model=args.skullstrip_model,
+            cache_dir=args.cache_dir,
+            cache_size_gb=args.cache_size_gb,
+            registration_preset=args.registration_preset,
+            compress_level=args.compress_level,
+            atlas_file=atlas_file,
+            atlas_labels=atlas_labels,
+            reference_region=args.reference_region,
+            template_mask=template_files['mask'],
+            engine=args.engine,
+            name=f'coreg_and_norm_wf_{anatomy_label}')
+        participant_wf.inputs.input_files.results_folder = args.output_dir
+        participant_wf.inputs.input_files.T1 = T1
+        participant_wf.inputs.input_files.T1_mask = T1_mask
+        participant_wf.inputs.input_files.template = template
+        participant_wf.inputs.input_files.transform = transform
+
+        # Optional smoothing
+        if args.fwhm is not None:
+            participant_wf.inputs.input_files.smooth_fwhm = int(args.fwhm)
+
+        wf.add_nodes([participant_wf])
+        for inputs, input_hashes in scans:
+            manifest.start(inputs["label"], f'pet_wf_{inputs["label"]}',
+                           input_hashes, parameters)
+            # Graph plugins report nothing back, the workflow completes the record
+            if args.plugin in GRAPH_PLUGINS:
+                manifest.add_completion_node(participant_wf, f'pet_wf_{inputs["label"]}')
 
     # Write pipeline graph
     wf.write_graph(graph2use='flat', simple_form=True)
 
-    # Run pipeline
-    wf.run('MultiProc', plugin_args={'n_procs': int(args.nprocs)})
+    # Request the resources of every node from the cluster scheduler
+    set_cluster_resources(wf, args.plugin)
+
+    # Graph plugins submit all nodes at once and report nothing back, so no
+    # run report is written
+    if args.plugin in GRAPH_PLUGINS:
+        wf.run(args.plugin, plugin_args=plugin_args)
+        return
+
+    # Record runtime and resource usage of every node and the finished images
+    config.enable_resource_monitor()
+    profiler = NodeProfiler()
+
+    def status_callback(node, status):
+        profiler(node, status)
+        manifest(node, status)
+
+    plugin_args['status_callback'] = status_callback
+
+    # Run pipeline, write the run report also when a node fails
+    try:
+        wf.run(args.plugin, plugin_args=plugin_args)
+    finally:
+        profiler.write(opj(args.output_dir, "logs"))
 
 
 if __name__ == '__main__':
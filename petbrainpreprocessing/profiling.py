@@ -0,0 +1,284 @@
+import csv
+import json
+import os
+import re
+from datetime import datetime, timezone
+from glob import glob
+from os.path import getsize, isdir
+from os.path import join as opj
+from statistics import median
+
+
+PROFILE_FIELDS = [
+    'participant_id',
+    'node',
+    'status',
+    'start',
+    'finish',
+    'wall_time_s',
+    'cpu_time_s',
+    'peak_rss_gb',
+    'output_bytes',
+    'n_procs',
+    'mem_gb',
+]
+
+
+def _participant_id(label):
+    match = re.search(r"sub-[a-zA-Z0-9]+", label)
+    return match.group(0) if match else "n/a"
+
+
+def _node_label(node, output_dir):
+    # Name of the node below the top level workflow. Subnodes of MapNodes do
+    # not know their workflow, so their label is taken from their folder.
+    if node.name.startswith("_") and output_dir and "mapflow" in output_dir:
+        parts = output_dir.split(os.sep)
+        mapflow = len(parts) - 1 - parts[::-1].index("mapflow")
+        first = next((i for i, part in enumerate(parts) if "sub-" in part), mapflow - 1)
+        index = re.sub(r"\D", "", node.name) or "0"
+        return ".".join(parts[first:mapflow]) + f"[{index}]"
+    return node.fullname.split(".", 1)[-1]
+
+
+def node_type(label):
+    """
+    Node label without the participant and scan specific workflow names and
+    MapNode indices, so the same node of different images shares its type.
+    """
+    return re.sub(r"_sub-[a-zA-Z0-9]+(_[a-zA-Z0-9]+-[a-zA-Z0-9]+)*|\[\d+\]$", "", label)
+
+
+def _cpu_time(runtime):
+    # Integrate the sampled CPU usage of the resource monitor over time
+    prof_dict = getattr(runtime, "prof_dict", None) or {}
+    times = prof_dict.get("time", [])
+    cpu_percent = prof_dict.get("cpus", [])
+    return sum((t1 - t0) * cpu / 100 for t0, t1, cpu in
+               zip(times[:-1], times[1:], cpu_percent[1:]))
+
+
+def _output_bytes(output_dir):
+    # Size of all files a node left in its working directory
+    if not output_dir or not isdir(output_dir):
+        return 0
+    total = 0
+    for root, _, files in os.walk(output_dir):
+        for f in files:
+            try:
+                total += getsize(opj(root, f))
+            except OSError:
+                pass
+    return total
+
+
+def _started_before(runtime, time):
+    # Whether a runtime started before a time, i.e. it was loaded from the
+    # results of an earlier run. Older nipype versions write naive UTC times.
+    try:
+        start = datetime.fromisoformat(runtime.startTime)
+    except (AttributeError, TypeError, ValueError):
+        return False
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    return start < time
+
+
+def node_profile(node, status):
+    """
+    Collect the runtime statistics of a finished nipype node.
+
+    CPU time and peak RSS are only available when the nipype resource monitor
+    is enabled. Output bytes are the size of the node's working directory.
+    """
+    runtime = None
+    try:
+        runtime = node.result.runtime
+    except Exception:
+        pass
+    # MapNodes hold the runtimes of their subnodes, which are recorded separately
+    if isinstance(runtime, list):
+        runtime = None
+
+    try:
+        output_dir = node.output_dir()
+    except Exception:
+        output_dir = None
+
+    label = _node_label(node, output_dir)
+    return {
+        'participant_id': _participant_id(label),
+        'node': label,
+        'status': 'ok' if status == 'end' else 'failed',
+        'start': getattr(runtime, 'startTime', None),
+        'finish': getattr(runtime, 'endTime', None),
+        'wall_time_s': getattr(runtime, 'duration', None),
+        'cpu_time_s': _cpu_time(runtime) if runtime is not None else None,
+        'peak_rss_gb': getattr(runtime, 'mem_peak_gb', None),
+        'output_bytes': _output_bytes(output_dir),
+        'n_procs': node.n_procs,
+        'mem_gb': node.mem_gb,
+    }
+
+
+class NodeProfiler:
+    """
+    Status callback for nipype plugins that records per-node statistics.
+
+    Nodes whose results are found in the working directory are not rerun,
+    their cached runtime is from an earlier run and is skipped, so only
+    the nodes that ran after the profiler was created are recorded.
+
+    Examples
+    --------
+    >>> profiler = NodeProfiler()
+    >>> wf.run('MultiProc', plugin_args={'status_callback': profiler})
+    >>> profiler.write('/output/logs')
+    """
+
+    def __init__(self):
+        self.records = []
+        self.started = datetime.now(timezone.utc)
+
+
+    def __call__(self, node, status):
+        if status == 'start':
+            return
+        if status == 'end':
+            try:
+                runtime = node.result.runtime
+            except Exception:
+                runtime = None
+            # MapNodes hold the runtimes of their subnodes
+            runtimes = runtime if isinstance(runtime, list) else [runtime]
+            if runtimes and all(_started_before(runtime, self.started)
+                                for runtime in runtimes):
+                return
+        self.records.append(node_profile(node, status))
+
+
+    def write(self, out_dir, prefix='pet_brain_preprocessing'):
+        """
+        Write the run report as JSON and TSV files.
+
+        Returns
+        -------
+        tsv_file : string
+            Path to the TSV run report.
+
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        base = opj(out_dir, f"{prefix}_run-{timestamp}_profile")
+
+        with open(f"{base}.json", "w") as f:
+            json.dump(self.records, f, indent=2, default=str)
+        write_tsv(f"{base}.tsv", self.records, PROFILE_FIELDS)
+        return f"{base}.tsv"
+
+
+def write_tsv(file_path, records, fields):
+    """
+    Write a list of dictionaries as a tab separated table.
+    """
+    with open(file_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, delimiter="\t",
+                                restval="n/a", extrasaction="ignore")
+        writer.writeheader()
+        for record in records:
+            writer.writerow({key: "n/a" if value is None else value
+                             for key, value in record.items()})
+
+
+def read_tsv(file_path):
+    """
+    Read a tab separated table as a list of dictionaries.
+    """
+    with open(file_path, newline="") as f:
+        return list(csv.DictReader(f, delimiter="\t"))
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def aggregate_profiles(paths, out_file=None, top=10, outlier_threshold=3.0):
+    """
+    Summarize run reports of a cohort.
+
+    Parameters
+    ----------
+    paths : list of strings
+        Run report TSV files, or folders that are searched for them.
+    out_file : string, optional
+        Path to write the per node summary to as TSV.
+    top : int, optional
+        Number of slowest nodes to return.
+    outlier_threshold : float, optional
+        Participants whose total wall time deviates more than this number of
+        median absolute deviations from the cohort median are outliers.
+
+    Returns
+    -------
+    node_summary : list of dicts
+        Wall time, CPU time and peak memory statistics per node type, slowest
+        first.
+    outliers : list of dicts
+        Participants with an unusual total wall time.
+
+    """
+    files = []
+    for path in paths:
+        if isdir(path):
+            files += sorted(glob(opj(path, "**", "*_profile.tsv"), recursive=True))
+        else:
+            files.append(path)
+
+    records = [record for file_path in files for record in read_tsv(file_path)]
+
+    by_node = {}
+    by_participant = {}
+    for record in records:
+        wall_time = _float(record["wall_time_s"])
+        if wall_time is None:
+            continue
+        node = node_type(record["node"])
+        by_node.setdefault(node, []).append(record)
+        by_participant.setdefault(record["participant_id"], 0.0)
+        by_participant[record["participant_id"]] += wall_time
+
+    node_summary = []
+    for node, node_records in by_node.items():
+        wall_times = [_float(r["wall_time_s"]) for r in node_records]
+        cpu_times = [t for t in (_float(r["cpu_time_s"]) for r in node_records) if t is not None]
+        peak_rss = [m for m in (_float(r["peak_rss_gb"]) for r in node_records) if m is not None]
+        node_summary.append({
+            'node': node,
+            'count': len(node_records),
+            'total_wall_time_s': sum(wall_times),
+            'median_wall_time_s': median(wall_times),
+            'max_wall_time_s': max(wall_times),
+            'total_cpu_time_s': sum(cpu_times) if cpu_times else None,
+            'max_peak_rss_gb': max(peak_rss) if peak_rss else None,
+        })
+    node_summary.sort(key=lambda summary: summary['total_wall_time_s'], reverse=True)
+
+    outliers = []
+    if by_participant:
+        totals = list(by_participant.values())
+        cohort_median = median(totals)
+        mad = median(abs(total - cohort_median) for total in totals)
+        for participant, total in sorted(by_participant.items()):
+            deviation = (total - cohort_median) / mad if mad else 0.0
+            if abs(deviation) > outlier_threshold:
+                outliers.append({'participant_id': participant,
+                                 'total_wall_time_s': total,
+                                 'deviation_mad': deviation})
+
+    if out_file is not None:
+        write_tsv(out_file, node_summary, list(node_summary[0]) if node_summary else ['node'])
+
+    return node_summary[:top], outliers
@@ -0,0 +1,214 @@
+import os
+import struct
+import zlib
+from glob import glob
+from os.path import basename, isdir
+from os.path import join as opj
+
+import numpy as np
+
+from .layout import parse_entities
+from .profiling import read_tsv, write_tsv
+
+
+QC_FIELDS = [
+    'label',
+    'dice_first_pass',
+    'dice_second_pass',
+    'normalized_mutual_information',
+    'brain_coverage',
+]
+
+# Red outline of masks drawn on the mosaics
+OUTLINE_COLOR = (255, 0, 0)
+
+
+def dice(mask_a, mask_b):
+    """
+    Dice overlap of two binary masks on the same grid, NaN if both are empty.
+    """
+    mask_a = np.asarray(mask_a, dtype=bool)
+    mask_b = np.asarray(mask_b, dtype=bool)
+    total = mask_a.sum() + mask_b.sum()
+    if total == 0:
+        return float('nan')
+    return 2 * float(np.logical_and(mask_a, mask_b).sum()) / total
+
+
+def normalized_mutual_information(image_a, image_b, mask=None, bins=32):
+    """
+    Normalized mutual information (H(A) + H(B)) / H(A, B) of two images.
+
+    The value is 1 for independent images and 2 for images that determine
+    each other, so it can be compared across participants and tracers.
+
+    Parameters
+    ----------
+    image_a, image_b : arrays
+        Images on the same grid.
+    mask : array, optional
+        Voxels to use, e.g. a brain mask. All voxels by default.
+    bins : int, optional
+        Number of intensity bins per image.
+
+    """
+    a = np.asarray(image_a, dtype=np.float32)
+    b = np.asarray(image_b, dtype=np.float32)
+    valid = np.isfinite(a) & np.isfinite(b)
+    if mask is not None:
+        valid &= np.asarray(mask, dtype=bool)
+    if not valid.any():
+        return float('nan')
+
+    joint, _, _ = np.histogram2d(a[valid], b[valid], bins=bins)
+    joint /= joint.sum()
+
+    def entropy(p):
+        p = p[p > 0]
+        return -float(np.sum(p * np.log(p)))
+
+    joint_entropy = entropy(joint)
+    if joint_entropy == 0:
+        return float('nan')
+    return (entropy(joint.sum(axis=1)) + entropy(joint.sum(axis=0))) / joint_entropy
+
+
+def brain_coverage(image, brain_mask):
+    """
+    Fraction of a brain mask covered by an image, i.e. in which the image is
+    finite and not zero. Parts of the brain outside the field of view of a
+    normalized PET image are filled with zeros.
+    """
+    brain_mask = np.asarray(brain_mask, dtype=bool)
+    if not brain_mask.any():
+        return float('nan')
+    image = np.asarray(image)
+    covered = np.isfinite(image) & (image != 0)
+    return float(covered[brain_mask].mean())
+
+
+def _outline(mask):
+    # Voxels of a mask that border on the background within an axial slice
+    from scipy import ndimage
+
+    mask = np.asarray(mask, dtype=bool)
+    return mask & ~ndimage.binary_erosion(mask, structure=np.ones((3, 3, 1), dtype=bool))
+
+
+def mosaic(image, mask=None, n_slices=8, n_columns=4, max_size=96):
+    """
+    Render evenly spaced axial slices of an image side by side.
+
+    Parameters
+    ----------
+    image : array
+        3D image.
+    mask : array, optional
+        Binary mask on the same grid, its outline is drawn in red.
+    n_slices : int, optional
+        Number of slices, taken between 10 and 90 % of the axial extent.
+    n_columns : int, optional
+        Number of slices per row.
+    max_size : int, optional
+        Largest width or height in pixels of a slice. Larger slices are
+        downsampled by taking every n-th voxel.
+
+    Returns
+    -------
+    rgb : array of uint8
+        Mosaic of shape (height, width, 3).
+
+    """
+    image = np.nan_to_num(np.asarray(image, dtype=np.float32))
+    positive = image[image > 0]
+    scale = np.percentile(positive, 99) if positive.size else 1.0
+    gray = (np.clip(image / (scale or 1.0), 0, 1) * 255).astype(np.uint8)
+    rgb = np.repeat(gray[..., None], 3, axis=-1)
+    if mask is not None:
+        rgb[_outline(mask)] = OUTLINE_COLOR
+
+    step = max(1, int(np.ceil(max(image.shape[:2]) / max_size)))
+    slices = np.linspace(0.1, 0.9, n_slices) * (image.shape[2] - 1)
+    # Anterior up, as seen from above
+    tiles = [np.rot90(rgb[::step, ::step, int(round(z))]) for z in slices]
+    tiles += [np.zeros_like(tiles[0])] * (-len(tiles) % n_columns)
+    rows = [np.concatenate(tiles[i:i + n_columns], axis=1)
+            for i in range(0, len(tiles), n_columns)]
+    return np.concatenate(rows, axis=0)
+
+
+def write_png(file_path, rgb):
+    """
+    Write an RGB image of uint8 as PNG, without an imaging library.
+    """
+    rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+    height, width = rgb.shape[:2]
+    # Every row starts with filter type 0, no filtering
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8),
+                          rgb.reshape(height, width * 3)], axis=1).tobytes()
+
+    def chunk(chunk_type, data):
+        return (struct.pack(">I", len(data)) + chunk_type + data
+                + struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+    with open(file_path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw, 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+def aggregate_qc(paths, out_file=None):
+    """
+    Combine the quality control metrics of a cohort into one table.
+
+    Parameters
+    ----------
+    paths : list of strings
+        Quality control TSV files, or folders that are searched for them.
+    out_file : string, optional
+        Path to write the table to as TSV.
+
+    Returns
+    -------
+    records : list of dicts
+        One row per image with the participant, session and tracer of the
+        image, sorted by the Dice overlap after the second coregistration
+        pass, so the worst aligned images come first.
+
+    """
+    files = []
+    for path in paths:
+        if isdir(path):
+            files += sorted(glob(opj(path, "**", "*_qc.tsv"), recursive=True))
+        else:
+            files.append(path)
+
+    fields = ['participant_id', 'session', 'tracer'] + QC_FIELDS
+    records = []
+    for file_path in files:
+        for row in read_tsv(file_path):
+            label = row.get("label") or basename(file_path)
+            entities = parse_entities(f"{label}_pet.nii.gz") or {}
+            records.append({
+                'participant_id': f"sub-{entities['sub']}" if 'sub' in entities else "n/a",
+                'session': entities.get('ses', "n/a"),
+                'tracer': entities.get('trc', "n/a"),
+                **row,
+            })
+
+    def sort_key(record):
+        try:
+            value = float(record['dice_second_pass'])
+        except (TypeError, ValueError):
+            value = float('nan')
+        # Missing values first, they need a look as well
+        return (not np.isnan(value), value)
+
+    records.sort(key=sort_key)
+
+    if out_file is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok=True)
+        write_tsv(out_file, records, fields)
+
+    return records
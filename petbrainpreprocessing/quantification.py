@@ -0,0 +1,163 @@
+import csv
+import os
+from glob import glob
+from os.path import basename, isdir
+from os.path import join as opj
+
+import numpy as np
+
+from .layout import parse_entities
+from .profiling import read_tsv, write_tsv
+
+
+REGION_FIELDS = [
+    'label',
+    'frame',
+    'index',
+    'name',
+    'n_voxels',
+    'volume_mm3',
+    'mean',
+    'median',
+    'suvr',
+]
+
+
+def read_atlas_labels(labels_file):
+    """
+    Read the region names of an atlas from a templateflow style TSV file
+    with 'index' and 'name' columns.
+
+    Returns
+    -------
+    names : dict
+        Region name per label index.
+
+    """
+    with open(labels_file, newline="") as f:
+        return {int(row["index"]): row["name"]
+                for row in csv.DictReader(f, delimiter="\t")}
+
+
+def resolve_regions(regions, names):
+    """
+    Translate region names or label indices to label indices.
+    """
+    indices = []
+    lower_names = {name.lower(): index for index, name in names.items()}
+    for region in regions:
+        region = str(region)
+        if region.isdigit():
+            indices.append(int(region))
+        elif region.lower() in lower_names:
+            indices.append(lower_names[region.lower()])
+        else:
+            raise ValueError(f"ERROR. Unknown atlas region {region}.")
+    return indices
+
+
+def regional_statistics(data, atlas, reference_labels=None):
+    """
+    Compute the statistics of all atlas regions in a single pass.
+
+    Sums and voxel counts of all regions are computed with one label indexed
+    bincount. Medians are taken from one sort of the voxels by label and
+    value. No step loops over regions, so the cost hardly depends on the
+    number of regions.
+
+    Parameters
+    ----------
+    data : array
+        3D image.
+    atlas : array of ints
+        Label image on the same grid, 0 is background.
+    reference_labels : list of ints, optional
+        Labels of the reference region. The regional means divided by the
+        mean of all voxels of the reference region are returned as SUVR.
+
+    Returns
+    -------
+    stats : dict of arrays
+        'index', 'n_voxels', 'mean', 'median' and 'suvr' (NaN without
+        reference region) of every label present in the atlas.
+
+    """
+    labels = np.asarray(atlas, dtype=np.int64).ravel()
+    values = np.asarray(data, dtype=np.float64).ravel()
+    valid = (labels > 0) & np.isfinite(values)
+    labels, values = labels[valid], values[valid]
+
+    counts = np.bincount(labels)
+    sums = np.bincount(labels, weights=values, minlength=len(counts))
+    present = np.flatnonzero(counts)
+    n_voxels = counts[present]
+    means = sums[present] / n_voxels
+
+    # Voxels sorted by label, then value. The regions are consecutive blocks
+    # in label order, the median is taken from the middle of each block.
+    sorted_values = values[np.lexsort((values, labels))]
+    starts = np.concatenate(([0], np.cumsum(n_voxels)[:-1]))
+    medians = (sorted_values[starts + (n_voxels - 1) // 2]
+               + sorted_values[starts + n_voxels // 2]) / 2
+
+    suvr = np.full(len(present), np.nan)
+    if reference_labels:
+        reference = np.asarray([label for label in reference_labels
+                                if label < len(counts)], dtype=np.int64)
+        reference_count = counts[reference].sum()
+        if reference_count == 0:
+            raise ValueError("ERROR. The reference region contains no voxels.")
+        suvr = means / (sums[reference].sum() / reference_count)
+
+    return {
+        'index': present,
+        'n_voxels': n_voxels,
+        'mean': means,
+        'median': medians,
+        'suvr': suvr,
+    }
+
+
+def aggregate_regional_stats(paths, out_file=None):
+    """
+    Combine the regional statistics of a cohort into one tidy table.
+
+    Parameters
+    ----------
+    paths : list of strings
+        Regional statistics TSV files, or folders that are searched for them.
+    out_file : string, optional
+        Path to write the table to as TSV.
+
+    Returns
+    -------
+    records : list of dicts
+        One row per image, frame and region, with the participant, session
+        and tracer of the image taken from its label.
+
+    """
+    files = []
+    for path in paths:
+        if isdir(path):
+            files += sorted(glob(opj(path, "**", "*_regions.tsv"), recursive=True))
+        else:
+            files.append(path)
+
+    fields = ['participant_id', 'session', 'tracer'] + REGION_FIELDS
+    records = []
+    for file_path in files:
+        rows = read_tsv(file_path)
+        label = rows[0]["label"] if rows else basename(file_path)
+        entities = parse_entities(f"{label}_pet.nii.gz") or {}
+        image = {
+            'participant_id': f"sub-{entities['sub']}" if 'sub' in entities else "n/a",
+            'session': entities.get('ses', "n/a"),
+            'tracer': entities.get('trc', "n/a"),
+        }
+        records += [{**image, **row} for row in rows]
+
+    if out_file is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(out_file)), exist_ok=True)
+        write_tsv(out_file, records, fields)
+
+    return records
@@ -0,0 +1,276 @@
+"""
+Lightweight stand-ins for the external tools called by the workflow.
+
+The stand-ins accept the command lines nipype builds for synthstrip-docker,
+AFNI, ANTs and FSL and write outputs with the names, grids and data types
+the real tools write, using nibabel and scipy. Their results are not
+meant for analysis: registrations return the identity transform and
+transforms are not applied. They let the benchmark run the full workflow,
+with its node wiring, file handling and image I/O, on a machine without
+the neuroimaging tools installed.
+"""
+import os
+import re
+import stat
+import sys
+from os.path import abspath, dirname
+from os.path import join as opj
+
+
+# Identity transform in the ITK text format
+IDENTITY_TRANSFORM = """#Insight Transform File V1.0
+#Transform 0
+Transform: AffineTransform_double_3_3
+Parameters: 1 0 0 0 1 0 0 0 1 0 0 0
+FixedParameters: 0 0 0
+"""
+
+ANTS_VERSION = "ANTs Version: 2.5.0"
+
+
+def _option(args, name, n_values=1):
+    # Values following a command line option, None if it is not given
+    if name not in args:
+        return None
+    i = args.index(name)
+    return args[i + 1:i + 1 + n_values] if n_values > 1 else args[i + 1]
+
+
+def _bracket_values(args, name):
+    # Values of an ANTs option written as name [ a, b, c ], which nipype
+    # passes through the shell, so the values are split over arguments
+    command = " ".join(args)
+    match = re.search(rf"{name} \w*\[\s*([^\]]*)\]", command)
+    if match is None:
+        value = _option(args, name)
+        return [value] if value is not None else None
+    return [value.strip() for value in match.group(1).split(",")]
+
+
+def _image_path(file_path):
+    # FSL tools add the extension of FSLOUTPUTTYPE to bare output names
+    if file_path.endswith((".nii", ".nii.gz")):
+        return file_path
+    extension = ".nii.gz" if os.environ.get("FSLOUTPUTTYPE", "NIFTI_GZ") == "NIFTI_GZ" \
+        else ".nii"
+    return file_path + extension
+
+
+def _save(data, img, file_path, affine=None):
+    import nibabel as nb
+    import numpy as np
+
+    out_img = nb.Nifti1Image(np.asarray(data, dtype=np.float32),
+                             img.affine if affine is None else affine, img.header)
+    out_img.set_data_dtype(np.float32)
+    out_img.header.set_slope_inter(1, 0)
+    nb.save(out_img, _image_path(file_path))
+
+
+def _resample(in_file, reference_file, out_file):
+    # Resample every volume of an image to the grid of the reference in
+    # world coordinates, i.e. with the identity transform
+    import nibabel as nb
+    import numpy as np
+    from nibabel.processing import resample_from_to
+
+    img = nb.load(in_file)
+    reference = nb.load(reference_file)
+    data = img.get_fdata(dtype=np.float32)
+    volumes = [data] if data.ndim == 3 else [data[..., i] for i in range(data.shape[3])]
+    resampled = [resample_from_to(nb.Nifti1Image(volume, img.affine),
+                                  (reference.shape[:3], reference.affine),
+                                  order=1).get_fdata(dtype=np.float32)
+                 for volume in volumes]
+    data = resampled[0] if data.ndim == 3 else np.stack(resampled, axis=-1)
+    _save(data, reference, out_file)
+
+
+def autobox(args):
+    """
+    3dAutobox: crop the image to the box of voxels above a clip level.
+    """
+    import nibabel as nb
+    import numpy as np
+
+    img = nb.load(_option(args, "-input"))
+    padding = int(_option(args, "-npad") or 0)
+    data = img.get_fdata(dtype=np.float32)
+    volume = data if data.ndim == 3 else data.mean(axis=3)
+    nonzero = np.argwhere(volume > 0.1 * volume.max())
+    start = np.maximum(nonzero.min(axis=0) - padding, 0)
+    stop = np.minimum(nonzero.max(axis=0) + padding + 1, volume.shape)
+    crop = tuple(slice(a, b) for a, b in zip(start, stop))
+    affine = img.affine.copy()
+    affine[:3, 3] = img.affine[:3, :3] @ start + img.affine[:3, 3]
+    _save(data[crop], img, _option(args, "-prefix"), affine)
+
+
+def synthstrip(args):
+    """
+    synthstrip-docker: threshold brain mask instead of the SynthStrip model.
+    """
+    import nibabel as nb
+    import numpy as np
+    from scipy import ndimage
+
+    img = nb.load(_option(args, "-i"))
+    data = img.get_fdata(dtype=np.float32)
+    mask = ndimage.gaussian_filter(data, 1) > 0.3 * np.percentile(data[data > 0], 99.5)
+    labels, n_labels = ndimage.label(mask)
+    if n_labels > 1:
+        sizes = np.bincount(labels.ravel())
+        sizes[0] = 0
+        mask = labels == sizes.argmax()
+    mask = ndimage.binary_fill_holes(mask)
+    _save(np.where(mask, data, 0), img, _option(args, "-o"))
+    _save(mask, img, _option(args, "-m"))
+
+
+def ants_registration(args):
+    """
+    antsRegistration: identity transforms and the moving image resampled to
+    the fixed image.
+    """
+    if "--version" in args:
+        print(ANTS_VERSION)
+        return
+
+    fixed_image, moving_image = _bracket_values(args, "--metric")[:2]
+    output = _bracket_values(args, "--output")
+    prefix = output[0]
+
+    if _option(args, "--write-composite-transform") == "1":
+        transforms = ["Composite.h5", "InverseComposite.h5"]
+    else:
+        transforms = ["0GenericAffine.mat"]
+    for transform in transforms:
+        with open(prefix + transform, "w") as f:
+            f.write(IDENTITY_TRANSFORM)
+
+    if len(output) > 1:
+        _resample(moving_image, fixed_image, output[1])
+
+
+def ants_apply_transforms(args):
+    """
+    antsApplyTransforms: the input image resampled to the reference image,
+    or an identity displacement field when a composite warp is requested.
+    """
+    import nibabel as nb
+    import numpy as np
+
+    if "--version" in args:
+        print(ANTS_VERSION)
+        return
+
+    output = _bracket_values(args, "--output")
+    reference_file = _option(args, "--reference-image")
+    if len(output) > 1 and output[1] == "1":
+        reference = nb.load(reference_file)
+        field = nb.Nifti1Image(np.zeros(reference.shape[:3] + (1, 3), dtype=np.float32),
+                               reference.affine)
+        field.header.set_intent("vector")
+        nb.save(field, output[0])
+        return
+    _resample(_option(args, "--input"), reference_file, output[0])
+
+
+def fslsplit(args):
+    """
+    fslsplit: one image per frame, named vol0000, vol0001, ...
+    """
+    import nibabel as nb
+    import numpy as np
+
+    img = nb.load(args[0])
+    out_base = args[1] if len(args) > 1 and not args[1].startswith("-") else "vol"
+    data = img.get_fdata(dtype=np.float32)
+    data = data[..., None] if data.ndim == 3 else data
+    for i in range(data.shape[3]):
+        _save(data[..., i], img, f"{out_base}{i:04d}")
+
+
+def fslmerge(args):
+    """
+    fslmerge -t: concatenate images along time.
+    """
+    import nibabel as nb
+    import numpy as np
+
+    imgs = [nb.load(file_path) for file_path in args[2:]]
+    data = [img.get_fdata(dtype=np.float32) for img in imgs]
+    data = [volume[..., None] if volume.ndim == 3 else volume for volume in data]
+    _save(np.concatenate(data, axis=3), imgs[0], args[1])
+
+
+def fslmaths(args):
+    """
+    fslmaths: the -Tmean and -kernel gauss -fmean operations of the workflow.
+    """
+    import nibabel as nb
+    import numpy as np
+    from scipy import ndimage
+
+    img = nb.load(args[0])
+    data = img.get_fdata(dtype=np.float32)
+    if "-Tmean" in args:
+        data = data.mean(axis=3) if data.ndim == 4 else data
+    if "-kernel" in args:
+        sigma_mm = float(_option(args, "-kernel", 2)[1])
+        sigma = [sigma_mm / zoom for zoom in img.header.get_zooms()[:3]]
+        # The kernel is renormalized to the part of it inside the image
+        weights = ndimage.gaussian_filter(np.ones(data.shape[:3], dtype=np.float32), sigma,
+                                          mode='constant')
+        sigma += [0] * (data.ndim - 3)
+        data = ndimage.gaussian_filter(data, sigma, mode='constant')
+        data /= weights.reshape(weights.shape + (1,) * (data.ndim - 3))
+    _save(data, img, args[-1])
+
+
+STUB_TOOLS = {
+    '3dAutobox': autobox,
+    'synthstrip-docker': synthstrip,
+    'antsRegistration': ants_registration,
+    'antsApplyTransforms': ants_apply_transforms,
+    'fslsplit': fslsplit,
+    'fslmerge': fslmerge,
+    'fslmaths': fslmaths,
+}
+
+
+def install_stub_tools(bin_dir):
+    """
+    Write an executable per stand-in tool to a folder, to be put in front
+    of the PATH.
+
+    Returns
+    -------
+    bin_dir : string
+        Absolute path of the folder.
+
+    """
+    bin_dir = abspath(bin_dir)
+    os.makedirs(bin_dir, exist_ok=True)
+    package_root = dirname(dirname(abspath(__file__)))
+    for tool in STUB_TOOLS:
+        file_path = opj(bin_dir, tool)
+        with open(file_path, "w") as f:
+            f.write("#!/bin/sh\n"
+                    f'export PYTHONPATH="{package_root}${{PYTHONPATH:+:$PYTHONPATH}}"\n'
+                    f'exec "{sys.executable}" -m petbrainpreprocessing.stub_tools '
+                    f'{tool} "$@"\n')
+        os.chmod(file_path, os.stat(file_path).st_mode | stat.S_IXUSR | stat.S_IXGRP
+                 | stat.S_IXOTH)
+    return bin_dir
+
+
+def main():
+    tool, args = sys.argv[1], sys.argv[2:]
+    if tool not in STUB_TOOLS:
+        sys.exit(f"ERROR. Unknown tool {tool}.")
+    STUB_TOOLS[tool](args)
+
+
+if __name__ == '__main__':
+    main()
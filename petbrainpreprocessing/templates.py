@@ -0,0 +1,220 @@
+import json
+import os
+import shutil
+from os.path import abspath, basename, isfile
+from os.path import join as opj
+
+
+DEFAULT_TEMPLATE = 'MNI152NLin2009cAsym'
+DEFAULT_RESOLUTION = 2
+
+
+def _query_key(template, query):
+    return json.dumps({'template': template, **query}, sort_keys=True, default=str)
+
+
+def _templateflow_get(template, **query):
+    # Imported on demand: importing templateflow may already access the network
+    from templateflow import api as tflow
+
+    file_path = tflow.get(template, **query)
+    if not file_path or isinstance(file_path, list):
+        raise FileNotFoundError(f"ERROR. Cannot find a single {template} file \
+            matching {query} in templateflow.")
+    return str(file_path)
+
+
+class TemplateCache:
+    """
+    Read-only local copy of the templateflow files used by the pipeline.
+
+    The files are fetched from templateflow once with `prefetch`, e.g. on a
+    login node with network access. Workers only read the index and the
+    files, they never import templateflow or access the network.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Folder holding the template files and their index.
+
+    Examples
+    --------
+    >>> cache = TemplateCache('/shared/templates')
+    >>> cache.prefetch('MNI152NLin6Asym', resolution=1, desc=None, suffix='T1w',
+    ...                extension='nii.gz')
+    >>> cache.get('MNI152NLin6Asym', resolution=1, desc=None, suffix='T1w',
+    ...           extension='nii.gz')
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = abspath(cache_dir)
+        self._index_file = opj(self.cache_dir, "templates.json")
+
+
+    def _read_index(self):
+        if not isfile(self._index_file):
+            return {}
+        with open(self._index_file) as f:
+            return json.load(f)
+
+
+    def get(self, template, **query):
+        """
+        Return the path of a prefetched template file.
+        """
+        index = self._read_index()
+        key = _query_key(template, query)
+        if key not in index:
+            raise FileNotFoundError(f"ERROR. The {template} file matching {query} \
+                is not in the template cache {self.cache_dir}. Add it with \
+                pet_brain_preprocessing_tools prefetch-templates.")
+        return opj(self.cache_dir, index[key])
+
+
+    def prefetch(self, template, **query):
+        """
+        Fetch a template file from templateflow and add it to the cache.
+        """
+        source = _templateflow_get(template, **query)
+        relative_path = opj(f"tpl-{template}", basename(source))
+        file_path = opj(self.cache_dir, relative_path)
+
+        os.makedirs(opj(self.cache_dir, f"tpl-{template}"), exist_ok=True)
+        if not isfile(file_path):
+            shutil.copyfile(source, f"{file_path}.tmp")
+            # Workers only read the cache
+            os.chmod(f"{file_path}.tmp", 0o444)
+            os.replace(f"{file_path}.tmp", file_path)
+
+        index = self._read_index()
+        index[_query_key(template, query)] = relative_path
+        with open(f"{self._index_file}.tmp", "w") as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(f"{self._index_file}.tmp", self._index_file)
+        return file_path
+
+
+def get_template_file(template, template_cache=None, **query):
+    """
+    Return the path of a template file, from the template cache if given or
+    from templateflow otherwise.
+    """
+    if template_cache is not None:
+        return TemplateCache(template_cache).get(template, **query)
+    return _templateflow_get(template, **query)
+
+
+def template_queries(template=DEFAULT_TEMPLATE, resolution=DEFAULT_RESOLUTION,
+                     atlas=None, atlas_desc=None):
+    """
+    Return the templateflow queries of the files a run needs: the template
+    T1w image, its brain mask and, with an atlas, its label image and region
+    names.
+
+    Returns
+    -------
+    queries : dict
+        Query per file ('T1w', 'mask', 'atlas' and 'atlas_labels'). The atlas
+        region names are queried with and without desc, as they are often
+        shared by all variants of an atlas.
+
+    """
+    queries = {'T1w': [{'resolution': resolution, 'desc': None, 'suffix': 'T1w',
+                        'extension': 'nii.gz'}],
+               'mask': [{'resolution': resolution, 'desc': 'brain', 'suffix': 'mask',
+                         'extension': 'nii.gz'}]}
+    if atlas is not None:
+        queries['atlas'] = [{'atlas': atlas, 'desc': atlas_desc, 'resolution': resolution,
+                             'suffix': 'dseg', 'extension': 'nii.gz'}]
+        queries['atlas_labels'] = [{'atlas': atlas, 'desc': desc, 'suffix': 'dseg',
+                                    'extension': 'tsv'}
+                                   for desc in dict.fromkeys([atlas_desc, None])]
+    return queries
+
+
+def fetch_templates(template=DEFAULT_TEMPLATE, resolution=DEFAULT_RESOLUTION,
+                    atlas=None, atlas_desc=None, template_cache=None):
+    """
+    Return the template T1w image, its brain mask and, optionally, an atlas.
+
+    Parameters
+    ----------
+    template : string, optional
+        Templateflow template space.
+    resolution : int, optional
+        Templateflow resolution index of the template and atlas.
+    atlas : string, optional
+        Templateflow atlas name (e.g. Schaefer2018) or the path to a label
+        image in template space. The region names of a local label image are
+        read from a TSV file with the same name, if it exists.
+    atlas_desc : string, optional
+        Templateflow atlas variant (e.g. 400Parcels7Networks).
+    template_cache : string, optional
+        Read-only template cache to take the files from instead of
+        templateflow.
+
+    Returns
+    -------
+    files : dict
+        Paths to the template 'T1w' image, its brain 'mask', the 'atlas' label
+        image and the 'atlas_labels' TSV file. The mask and atlas files are
+        None if not available.
+
+    """
+    queries = template_queries(template, resolution, atlas, atlas_desc)
+    files = {'T1w': get_template_file(template, template_cache, **queries['T1w'][0]),
+             'mask': None,
+             'atlas': None,
+             'atlas_labels': None}
+
+    # The brain mask is only used for quality control
+    try:
+        files['mask'] = get_template_file(template, template_cache, **queries['mask'][0])
+    except FileNotFoundError:
+        pass
+
+    if atlas is not None and isfile(atlas):
+        labels_file = atlas.replace(".nii.gz", "").replace(".nii", "") + ".tsv"
+        files['atlas'] = atlas
+        files['atlas_labels'] = labels_file if isfile(labels_file) else None
+    elif atlas is not None:
+        files['atlas'] = get_template_file(template, template_cache, **queries['atlas'][0])
+        for query in queries['atlas_labels']:
+            try:
+                files['atlas_labels'] = get_template_file(template, template_cache, **query)
+                break
+            except FileNotFoundError:
+                pass
+    return files
+
+
+def prefetch_templates(cache_dir, templates=(DEFAULT_TEMPLATE,),
+                       resolutions=(DEFAULT_RESOLUTION,), atlas=None, atlas_desc=None):
+    """
+    Fill a template cache with the files of the given templates and
+    resolutions, so that runs using it need no network access.
+
+    Returns
+    -------
+    file_paths : list of strings
+        Paths of the cached files.
+
+    """
+    cache = TemplateCache(cache_dir)
+    file_paths = []
+    for template in templates:
+        for resolution in resolutions:
+            queries = template_queries(template, resolution, atlas, atlas_desc)
+            file_paths.append(cache.prefetch(template, **queries['T1w'][0]))
+            try:
+                file_paths.append(cache.prefetch(template, **queries['mask'][0]))
+            except FileNotFoundError:
+                pass
+            if atlas is not None:
+                file_paths.append(cache.prefetch(template, **queries['atlas'][0]))
+                for query in queries['atlas_labels']:
+                    try:
+                        file_paths.append(cache.prefetch(template, **query))
+                    except FileNotFoundError:
+                        pass
+    return file_paths
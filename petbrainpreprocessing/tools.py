@@ -0,0 +1,249 @@
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cohort level tools for PET brain preprocessing."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    profiles_parser = subparsers.add_parser("aggregate-profiles",
+        help="Summarize the run reports of a cohort: slowest nodes and outlier participants.")
+    profiles_parser.add_argument("paths",
+                                 nargs="+",
+                                 help="Run report TSV files or folders containing them.")
+    profiles_parser.add_argument("--out-file",
+                                 help="Write the per node summary to this TSV file.")
+    profiles_parser.add_argument("--top",
+                                 type=int,
+                                 default=10,
+                                 help="Number of slowest nodes to show.")
+    profiles_parser.add_argument("--outlier-threshold",
+                                 type=float,
+                                 default=3.0,
+                                 help="Number of median absolute deviations from the \
+                                     median total wall time that marks an outlier participant.")
+
+    regions_parser = subparsers.add_parser("aggregate-regions",
+        help="Combine the regional statistics (SUVR) of a cohort into one tidy table.")
+    regions_parser.add_argument("paths",
+                                nargs="+",
+                                help="Regional statistics TSV files or folders containing them.")
+    regions_parser.add_argument("--out-file",
+                                required=True,
+                                help="TSV file to write the cohort table to.")
+
+    qc_parser = subparsers.add_parser("aggregate-qc",
+        help="Combine the quality control metrics of a cohort into one table, worst first.")
+    qc_parser.add_argument("paths",
+                           nargs="+",
+                           help="Quality control TSV files or folders containing them.")
+    qc_parser.add_argument("--out-file",
+                           required=True,
+                           help="TSV file to write the cohort table to.")
+
+    templates_parser = subparsers.add_parser("prefetch-templates",
+        help="Fetch templates and atlases from templateflow into a read-only template cache.")
+    templates_parser.add_argument("template_cache",
+                                  help="Folder of the template cache.")
+    templates_parser.add_argument("--template",
+                                  nargs="+",
+                                  default=["MNI152NLin2009cAsym"],
+                                  help="Templateflow template spaces.")
+    templates_parser.add_argument("--template-resolution",
+                                  nargs="+",
+                                  type=int,
+                                  default=[2],
+                                  help="Templateflow resolution indices.")
+    templates_parser.add_argument("--atlas",
+                                  help="Templateflow atlas (e.g. Schaefer2018).")
+    templates_parser.add_argument("--atlas-desc",
+                                  help="Templateflow atlas variant (e.g. 400Parcels7Networks).")
+
+    index_parser = subparsers.add_parser("index-dataset",
+        help="Build or update the dataset index used to resolve the pipeline inputs.")
+    index_parser.add_argument("layout_db",
+                              help="SQLite database of the dataset index.")
+    index_parser.add_argument("dataset_dirs",
+                              nargs="+",
+                              help="BIDS and derivatives folders to index.")
+
+    benchmark_parser = subparsers.add_parser("benchmark",
+        help="Time the workflow on synthetic data and compare against a baseline.")
+    benchmark_parser.add_argument("work_dir",
+                                  help="Folder for the synthetic data and the runs.")
+    benchmark_parser.add_argument("--sizes",
+                                  nargs="+",
+                                  choices=["small", "medium", "large"],
+                                  default=["small"],
+                                  help="Sizes of the synthetic images.")
+    benchmark_parser.add_argument("--frames",
+                                  nargs="+",
+                                  type=int,
+                                  default=[1],
+                                  help="Numbers of frames of the synthetic PET images.")
+    benchmark_parser.add_argument("--repeats",
+                                  type=int,
+                                  default=1,
+                                  help="Runs per case, the median is reported.")
+    benchmark_parser.add_argument("--nprocs",
+                                  nargs="+",
+                                  type=int,
+                                  default=[1],
+                                  help="Numbers of processes, every case is run with each \
+                                      (e.g. 4 16 64). One runs the nodes one after the other.")
+    benchmark_parser.add_argument("--participants",
+                                  type=int,
+                                  default=1,
+                                  help="Participants processed together per run, several \
+                                      measure the throughput in images per hour.")
+    benchmark_parser.add_argument("--presets",
+                                  nargs="+",
+                                  choices=["fast", "default", "precise"],
+                                  default=["default"],
+                                  help="Registration presets, every case is run with each \
+                                      to compare their runtime and Dice overlap.")
+    benchmark_parser.add_argument("--compress-levels",
+                                  nargs="+",
+                                  type=int,
+                                  choices=range(10),
+                                  default=[6],
+                                  metavar="{0-9}",
+                                  help="gzip compression levels of the outputs, every case \
+                                      is run with each to compare the bytes written and \
+                                      the time spent compressing.")
+    benchmark_parser.add_argument("--skullstrip-backends",
+                                  nargs="+",
+                                  choices=["docker", "python", "threshold"],
+                                  default=["docker"],
+                                  help="Brain extraction backends, every case is run with \
+                                      each to compare their runtime and Dice overlap.")
+    benchmark_parser.add_argument("--skullstrip-model",
+                                  help="SynthStrip model weights of the python backend \
+                                      (TorchScript model).")
+    benchmark_parser.add_argument("--stub-tools",
+                                  action="store_true",
+                                  help="Replace synthstrip-docker, AFNI, ANTs and FSL by \
+                                      lightweight stand-ins, to benchmark without them.")
+    benchmark_parser.add_argument("--engine",
+                                  choices=["external", "python"],
+                                  default="external",
+                                  help="Engine of the resampling and smoothing steps.")
+    benchmark_parser.add_argument("--baseline",
+                                  help="Benchmark JSON file to compare against.")
+    benchmark_parser.add_argument("--tolerance",
+                                  type=float,
+                                  default=0.25,
+                                  help="Fraction by which a stage may exceed the baseline.")
+    benchmark_parser.add_argument("--out-file",
+                                  help="Write the results to this JSON file, which can \
+                                      serve as baseline of later runs.")
+
+    args = parser.parse_args()
+
+    if args.command == "benchmark" and "python" in args.skullstrip_backends \
+            and args.skullstrip_model is None:
+        parser.error("--skullstrip-model is required for the python skull strip backend")
+
+    if args.command == "aggregate-profiles":
+        from petbrainpreprocessing.profiling import aggregate_profiles
+
+        node_summary, outliers = aggregate_profiles(
+            args.paths, args.out_file, args.top, args.outlier_threshold)
+
+        print("Slowest nodes (total wall time):")
+        for summary in node_summary:
+            print(f"  {summary['node']}: {summary['total_wall_time_s']:.1f} s total, "
+                  f"{summary['median_wall_time_s']:.1f} s median, "
+                  f"{summary['max_wall_time_s']:.1f} s max over {summary['count']} runs")
+
+        print("Outlier participants:")
+        for outlier in outliers:
+            print(f"  {outlier['participant_id']}: {outlier['total_wall_time_s']:.1f} s "
+                  f"({outlier['deviation_mad']:+.1f} MAD)")
+        if not outliers:
+            print("  none")
+
+    elif args.command == "aggregate-regions":
+        from petbrainpreprocessing.quantification import aggregate_regional_stats
+
+        records = aggregate_regional_stats(args.paths, args.out_file)
+        n_images = len({record['label'] for record in records})
+        print(f"{len(records)} regions of {n_images} images written to {args.out_file}")
+
+    elif args.command == "aggregate-qc":
+        from petbrainpreprocessing.qc import aggregate_qc
+
+        records = aggregate_qc(args.paths, args.out_file)
+        print(f"Quality control of {len(records)} images written to {args.out_file}")
+
+    elif args.command == "prefetch-templates":
+        from petbrainpreprocessing.templates import prefetch_templates
+
+        for file_path in prefetch_templates(args.template_cache, args.template,
+                                            args.template_resolution, args.atlas,
+                                            args.atlas_desc):
+            print(file_path)
+
+    elif args.command == "index-dataset":
+        from petbrainpreprocessing.layout import DatasetIndex
+
+        index = DatasetIndex(args.layout_db)
+        for dataset_dir in args.dataset_dirs:
+            n_scanned = index.update(dataset_dir)
+            print(f"{dataset_dir}: {len(index.subjects(dataset_dir))} participants, "
+                  f"{n_scanned} changed folders indexed")
+
+    elif args.command == "benchmark":
+        from petbrainpreprocessing.benchmark import (BENCHMARK_QUALITY_METRICS,
+                                                     compare_to_baseline, read_benchmark,
+                                                     run_benchmark, write_benchmark)
+
+        benchmark = run_benchmark(args.work_dir, args.sizes, args.frames, args.repeats,
+                                  args.nprocs, args.stub_tools, args.engine,
+                                  args.participants, args.presets, args.compress_levels,
+                                  args.skullstrip_backends, args.skullstrip_model)
+        if args.out_file:
+            write_benchmark(args.out_file, benchmark)
+
+        for case, stages in benchmark['cases'].items():
+            print(f"{case}:")
+            for stage, metrics in sorted(stages.items(),
+                                         key=lambda item: -(item[1]['wall_time_s'] or 0)):
+                wall_time = metrics['wall_time_s']
+                peak_rss = metrics['peak_rss_gb']
+                images_per_hour = metrics.get('images_per_hour')
+                per_participant = metrics.get('wall_time_per_participant_s')
+                output_bytes = metrics.get('output_bytes')
+                values = [f"{wall_time:.1f} s" if wall_time is not None else None,
+                          f"{per_participant:.1f} s per participant"
+                          if per_participant is not None else None,
+                          f"{peak_rss:.2f} GB" if peak_rss is not None else None,
+                          f"{images_per_hour:.0f} images/h" if images_per_hour else None,
+                          f"{output_bytes / 1024 ** 2:.1f} MB"
+                          if output_bytes is not None else None]
+                values += [f"{metric} {metrics[metric]:.3f}"
+                           for metric in BENCHMARK_QUALITY_METRICS
+                           if metrics.get(metric) is not None]
+                print(f"  {stage}: " + ", ".join(value for value in values if value))
+
+        if args.baseline:
+            regressions = compare_to_baseline(benchmark, read_benchmark(args.baseline),
+                                              args.tolerance)
+            print("Regressions:")
+            for regression in regressions:
+                if regression['baseline'] is None:
+                    print(f"  {regression['case']} {regression['stage']}: "
+                          f"{regression['metric']}")
+                else:
+                    print(f"  {regression['case']} {regression['stage']} "
+                          f"{regression['metric']}: {regression['baseline']:.2f} -> "
+                          f"{regression['value']:.2f}")
+            if not regressions:
+                print("  none")
+            else:
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
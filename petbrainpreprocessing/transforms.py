@@ -0,0 +1,430 @@
+import re
+
+import numpy as np
+
+
+# Points mapped per chunk when resampling, bounds the temporary arrays to
+# a few tens of MB whatever the image size
+CHUNK_SIZE = 2 ** 20
+
+# ITK transforms work in LPS coordinates, nibabel in RAS
+LPS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+# Text transform files are recognized by their header whatever their extension
+ITK_TEXT_HEADER = b"#Insight Transform File"
+
+
+class AffineMapping:
+    """
+    Affine mapping of points in RAS world coordinates.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = np.asarray(matrix, dtype=np.float64)
+
+
+    def map(self, points):
+        return points @ self.matrix[:3, :3].T + self.matrix[:3, 3]
+
+
+    def inverse(self):
+        return AffineMapping(np.linalg.inv(self.matrix))
+
+
+class DisplacementMapping:
+    """
+    Dense displacement field mapping of points in RAS world coordinates.
+
+    Parameters
+    ----------
+    field : array
+        Displacement vectors in mm in RAS coordinates, of shape (X, Y, Z, 3).
+    affine : array
+        Voxel to RAS world affine of the field.
+
+    """
+
+    def __init__(self, field, affine):
+        self.field = np.asarray(field, dtype=np.float32)
+        self.affine = np.asarray(affine, dtype=np.float64)
+        self._inverse_affine = np.linalg.inv(self.affine)
+
+
+    def map(self, points):
+        from scipy import ndimage
+
+        coords = (points @ self._inverse_affine[:3, :3].T + self._inverse_affine[:3, 3]).T
+        # No displacement outside of the field, as in ITK
+        return points + np.stack([
+            ndimage.map_coordinates(self.field[..., axis], coords, order=1,
+                                    mode='constant', cval=0.0)
+            for axis in range(3)], axis=-1)
+
+
+    def inverse(self):
+        raise ValueError("ERROR. Displacement fields cannot be inverted, use the \
+            inverse field written by the registration.")
+
+
+def _itk_affine(matrix, translation, center):
+    # ITK maps x to M (x - c) + t + c in LPS coordinates, as RAS affine
+    matrix = np.asarray(matrix, dtype=np.float64).reshape(3, 3)
+    center = np.asarray(center, dtype=np.float64)
+    lps = np.eye(4)
+    lps[:3, :3] = matrix
+    lps[:3, 3] = np.asarray(translation, dtype=np.float64) + center - matrix @ center
+    return LPS @ lps @ LPS
+
+
+def _euler_matrix(angles, zyx=False):
+    ax, ay, az = angles
+    rx = np.array([[1, 0, 0], [0, np.cos(ax), -np.sin(ax)], [0, np.sin(ax), np.cos(ax)]])
+    ry = np.array([[np.cos(ay), 0, np.sin(ay)], [0, 1, 0], [-np.sin(ay), 0, np.cos(ay)]])
+    rz = np.array([[np.cos(az), -np.sin(az), 0], [np.sin(az), np.cos(az), 0], [0, 0, 1]])
+    return rz @ ry @ rx if zyx else rz @ rx @ ry
+
+
+def _versor_matrix(versor):
+    x, y, z = versor
+    w = np.sqrt(max(0.0, 1 - x ** 2 - y ** 2 - z ** 2))
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ])
+
+
+def _itk_transform(transform_type, parameters, fixed_parameters):
+    # Point mapping of a single ITK transform
+    kind = transform_type.split("_")[0]
+    parameters = np.asarray(parameters, dtype=np.float64).ravel()
+    fixed_parameters = np.asarray(fixed_parameters, dtype=np.float64).ravel()
+
+    if kind in ("AffineTransform", "MatrixOffsetTransformBase", "Rigid3DTransform"):
+        return AffineMapping(_itk_affine(parameters[:9], parameters[9:12],
+                                         fixed_parameters[:3]))
+    if kind == "Euler3DTransform":
+        zyx = len(fixed_parameters) > 3 and bool(fixed_parameters[3])
+        return AffineMapping(_itk_affine(_euler_matrix(parameters[:3], zyx),
+                                         parameters[3:6], fixed_parameters[:3]))
+    if kind == "VersorRigid3DTransform":
+        return AffineMapping(_itk_affine(_versor_matrix(parameters[:3]),
+                                         parameters[3:6], fixed_parameters[:3]))
+    if kind == "TranslationTransform":
+        return AffineMapping(_itk_affine(np.eye(3), parameters[:3], np.zeros(3)))
+    if kind == "DisplacementFieldTransform":
+        size = fixed_parameters[:3].astype(int)
+        origin, spacing = fixed_parameters[3:6], fixed_parameters[6:9]
+        direction = fixed_parameters[9:18].reshape(3, 3)
+        affine = np.eye(4)
+        affine[:3, :3] = direction * spacing
+        affine[:3, 3] = origin
+        # ITK buffers run fastest along x, the vectors are in LPS
+        field = parameters.reshape(size[2], size[1], size[0], 3).transpose(2, 1, 0, 3)
+        return DisplacementMapping(field * [-1, -1, 1], LPS @ affine)
+    raise ValueError(f"ERROR. Unsupported transform type {transform_type}.")
+
+
+def _read_text_transforms(file_path):
+    # ITK text transform files, composite files list their transforms in
+    # the order they were added
+    transforms = []
+    with open(file_path) as f:
+        text = f.read()
+    for block in re.split(r"#Transform \d+", text)[1:]:
+        fields = dict(re.findall(r"^(\w+): *(.*)$", block, re.MULTILINE))
+        if fields["Transform"].startswith("CompositeTransform"):
+            continue
+        transforms.append(_itk_transform(
+            fields["Transform"],
+            [float(value) for value in fields.get("Parameters", "").split()],
+            [float(value) for value in fields.get("FixedParameters", "").split()]))
+    return transforms
+
+
+def _read_matlab_transform(file_path):
+    # ITK MATLAB transform files as written by antsRegistration
+    from scipy.io import loadmat
+
+    contents = loadmat(file_path)
+    transform_type = next(key for key in contents if key.endswith("_3_3"))
+    return [_itk_transform(transform_type, contents[transform_type], contents["fixed"])]
+
+
+def _read_hdf5_transforms(file_path):
+    try:
+        import h5py
+    except ImportError as e:
+        raise ImportError("ERROR. Reading HDF5 transforms with the python engine \
+            requires h5py. Install it with `pip install h5py`.") from e
+
+    transforms = []
+    with h5py.File(file_path, "r") as f:
+        group = f["TransformGroup"]
+        for key in sorted(group, key=int):
+            transform_type = group[key]["TransformType"][0]
+            if isinstance(transform_type, bytes):
+                transform_type = transform_type.decode()
+            if transform_type.startswith("CompositeTransform"):
+                continue
+            transforms.append(_itk_transform(
+                transform_type,
+                group[key]["TransformParameters"][()],
+                group[key]["TransformFixedParameters"][()]))
+    return transforms
+
+
+def _read_displacement_field(file_path):
+    # Displacement field image, (X, Y, Z, 1, 3) with LPS vectors in ANTs
+    import nibabel as nb
+
+    img = nb.load(file_path)
+    field = np.asanyarray(img.dataobj, dtype=np.float32).reshape(img.shape[:3] + (3,))
+    return [DisplacementMapping(field * np.array([-1, -1, 1], dtype=np.float32),
+                                img.affine)]
+
+
+def read_transform(file_path, invert=False):
+    """
+    Read an ANTs/ITK transform file as a list of point mappings.
+
+    Supported are ITK text (.txt, .tfm), MATLAB (.mat) and HDF5 (.h5)
+    transforms, including composite transforms, and displacement field
+    images (.nii, .nii.gz). Like ITK, a transform maps points of the fixed
+    (output) space to the moving (input) space.
+
+    Parameters
+    ----------
+    file_path : string
+        Transform file.
+    invert : bool, optional
+        Return the inverse transform. Only possible for linear transforms.
+
+    Returns
+    -------
+    mappings : list
+        Mappings in the order they are applied to a point.
+
+    """
+    with open(file_path, "rb") as f:
+        text = f.read(len(ITK_TEXT_HEADER)) == ITK_TEXT_HEADER
+
+    if text:
+        transforms = _read_text_transforms(file_path)
+    elif file_path.endswith((".nii", ".nii.gz")):
+        transforms = _read_displacement_field(file_path)
+    elif file_path.endswith(".mat"):
+        transforms = _read_matlab_transform(file_path)
+    elif file_path.endswith(".h5"):
+        transforms = _read_hdf5_transforms(file_path)
+    else:
+        transforms = _read_text_transforms(file_path)
+
+    # Composite transforms apply the transform added last first
+    transforms = transforms[::-1]
+    if invert:
+        transforms = [transform.inverse() for transform in transforms[::-1]]
+    return transforms
+
+
+def read_transforms(file_paths, invert_flags=None):
+    """
+    Read a chain of transforms as passed to antsApplyTransforms.
+
+    A point of the output space is mapped by the first transform of the
+    list first. Subsequent linear transforms are combined into a single
+    affine, so a chain of linear transforms costs a single matrix product.
+
+    Returns
+    -------
+    mappings : list
+        Mappings in the order they are applied to a point.
+
+    """
+    invert_flags = invert_flags or [False] * len(file_paths)
+    mappings = []
+    for file_path, invert in zip(file_paths, invert_flags):
+        for mapping in read_transform(file_path, invert):
+            if (mappings and isinstance(mapping, AffineMapping)
+                    and isinstance(mappings[-1], AffineMapping)):
+                mappings[-1] = AffineMapping(mapping.matrix @ mappings[-1].matrix)
+            else:
+                mappings.append(mapping)
+    return mappings
+
+
+def _grid_points(shape, affine, start, stop):
+    # RAS world coordinates of the voxels start to stop of a grid, in
+    # the order of ravel
+    indices = np.unravel_index(np.arange(start, stop), shape)
+    voxels = np.stack(indices, axis=-1).astype(np.float64)
+    return voxels @ affine[:3, :3].T + affine[:3, 3]
+
+
+def map_grid(mappings, shape, affine, chunk_size=CHUNK_SIZE):
+    """
+    Map every voxel of a grid through a chain of transforms.
+
+    Returns
+    -------
+    points : array of float32
+        Mapped RAS world coordinates of shape (n_voxels, 3), in the order of
+        ravel. Computed in chunks, only the result is held in full.
+
+    """
+    n_voxels = int(np.prod(shape))
+    points = np.empty((n_voxels, 3), dtype=np.float32)
+    for start in range(0, n_voxels, chunk_size):
+        stop = min(start + chunk_size, n_voxels)
+        chunk = _grid_points(shape, affine, start, stop)
+        for mapping in mappings:
+            chunk = mapping.map(chunk)
+        points[start:stop] = chunk
+    return points
+
+
+def apply_transforms(img, reference, mappings, order=1, default_value=0.0,
+                     chunk_size=CHUNK_SIZE):
+    """
+    Resample an image to the grid of a reference image through a chain of
+    transforms, as antsApplyTransforms does.
+
+    The voxel positions are mapped once and reused for every frame of a 4D
+    image. Frames are read one at a time as float32 and interpolated in
+    chunks. Points outside of the input image get the default value.
+
+    Parameters
+    ----------
+    img : nibabel image
+        3D or 4D image to resample.
+    reference : nibabel image
+        Image defining the output grid.
+    mappings : list
+        Point mappings, see read_transforms.
+    order : int, optional
+        Interpolation order, 1 is linear and 0 nearest neighbour.
+    default_value : float, optional
+        Value of points outside of the input image.
+
+    Returns
+    -------
+    data : array of float32
+        Resampled image on the reference grid, 4D for 4D input images.
+
+    """
+    data, = apply_transform_chains(img, [(reference, mappings)], order, default_value,
+                                   chunk_size)
+    return data
+
+
+def apply_transform_chains(img, targets, order=1, default_value=0.0, chunk_size=CHUNK_SIZE):
+    """
+    Resample an image through several chains of transforms, each to the grid
+    of its own reference image, reading every frame only once.
+
+    Parameters
+    ----------
+    img : nibabel image
+        3D or 4D image to resample.
+    targets : list of tuples
+        Reference image and point mappings of every output, see
+        apply_transforms.
+
+    Returns
+    -------
+    data : list of arrays of float32
+        Resampled image per target.
+
+    """
+    from scipy import ndimage
+
+    inverse = np.linalg.inv(img.affine)
+    n_frames = img.shape[3] if len(img.shape) > 3 else 1
+    in_shape = np.array(img.shape[:3])
+    grids = []
+    for reference, mappings in targets:
+        shape = reference.shape[:3]
+        points = map_grid(mappings, shape, reference.affine, chunk_size)
+        grids.append((shape, points,
+                      np.empty((int(np.prod(shape)), n_frames), dtype=np.float32)))
+
+    for frame in range(n_frames):
+        volume = np.asanyarray(img.dataobj[..., frame] if len(img.shape) > 3
+                               else img.dataobj, dtype=np.float32)
+        for _, points, data in grids:
+            for start in range(0, len(points), chunk_size):
+                coords = (points[start:start + chunk_size] @ inverse[:3, :3].T
+                          + inverse[:3, 3]).T
+                values = ndimage.map_coordinates(volume, coords, order=order, mode='nearest')
+                # Only points within the image are interpolated, as in ITK
+                outside = np.any((coords < -0.5) | (coords >= in_shape[:, None] - 0.5), axis=0)
+                values[outside] = default_value
+                data[start:start + chunk_size, frame] = values
+
+    resampled = []
+    for shape, _, data in grids:
+        data = data.reshape(shape + (n_frames,))
+        resampled.append(data if len(img.shape) > 3 else data[..., 0])
+    return resampled
+
+
+def displacement_field(mappings, reference, chunk_size=CHUNK_SIZE):
+    """
+    Compose a chain of transforms into one displacement field on the grid of
+    a reference image.
+
+    Returns
+    -------
+    field : array of float32
+        Displacement in mm in LPS coordinates of shape (X, Y, Z, 1, 3), as
+        written by antsApplyTransforms with --print-out-composite-warp-file.
+
+    """
+    shape = reference.shape[:3]
+    points = map_grid(mappings, shape, reference.affine, chunk_size)
+    for start in range(0, len(points), chunk_size):
+        stop = min(start + chunk_size, len(points))
+        points[start:stop] -= _grid_points(shape, reference.affine, start, stop)
+    points *= np.array([-1, -1, 1], dtype=np.float32)
+    return points.reshape(shape + (1, 3))
+
+
+def gaussian_smooth(img, fwhm):
+    """
+    Smooth an image with a Gaussian kernel of the given FWHM in mm.
+
+    The kernel is applied as three 1D filters along the axes, which is
+    equivalent to the 3D kernel at a fraction of the cost. As fslmaths
+    -kernel gauss -fmean does, the kernel is renormalized to the part of it
+    inside the image, so border voxels are the weighted mean of the voxels
+    within the image. As the kernel is separable, the renormalization is
+    done per axis. Frames of a 4D image are read and filtered one at a time
+    in float32.
+
+    Returns
+    -------
+    data : array of float32
+        Smoothed image.
+
+    """
+    from scipy import ndimage
+
+    sigmas = fwhm / np.sqrt(8 * np.log(2)) / np.array(img.header.get_zooms()[:3])
+    shape = img.shape[:3]
+    # Fraction of the kernel inside the image along every axis
+    weights = []
+    for axis, sigma in enumerate(sigmas):
+        weight = ndimage.gaussian_filter1d(np.ones(shape[axis], dtype=np.float32), sigma,
+                                           mode='constant')
+        weights.append(weight.reshape([-1 if i == axis else 1 for i in range(3)]))
+
+    n_frames = img.shape[3] if len(img.shape) > 3 else 1
+    data = np.empty(shape + (n_frames,), dtype=np.float32)
+    for frame in range(n_frames):
+        volume = np.asanyarray(img.dataobj[..., frame] if len(img.shape) > 3
+                               else img.dataobj, dtype=np.float32)
+        for axis, sigma in enumerate(sigmas):
+            volume = ndimage.gaussian_filter1d(volume, sigma, axis=axis, mode='constant')
+            volume /= weights[axis]
+        data[..., frame] = volume
+    return data if len(img.shape) > 3 else data[..., 0]
@@ -0,0 +1,167 @@
+from nipype.interfaces.utility import IdentityInterface
+from nipype.interfaces import (fsl, ants)
+from nipype import Workflow, Node, MapNode
+
+from ..interfaces.transforms import ApplyTransformsPython
+
+
+def append_frame_transforms(transforms, frame_transforms):
+    """
+    Combine a transform chain with the motion transform of every frame.
+
+    The motion transform is appended last, so antsApplyTransforms applies it
+    first, followed by the rest of the chain.
+    """
+    if not isinstance(transforms, list):
+        transforms = [transforms]
+    return [transforms + [frame_transform] for frame_transform in frame_transforms]
+
+
+def apply_transforms_node(engine, name, iterfield=None, **kwargs):
+    """
+    Node applying a chain of ANTs transforms with the given engine.
+
+    'external' runs antsApplyTransforms in single precision, 'python'
+    resamples in-process (see ApplyTransformsPython). Both take the same
+    inputs, except the input image type, which the python engine reads from
+    the image header. A MapNode is returned when iterfield is given.
+    """
+    if engine == 'external':
+        interface = ants.ApplyTransforms()
+    elif engine == 'python':
+        interface = ApplyTransformsPython()
+    else:
+        raise ValueError(f"ERROR. Unknown engine {engine}.")
+
+    if iterfield:
+        node = MapNode(interface, iterfield=iterfield, name=name, **kwargs)
+    else:
+        node = Node(interface, name=name, **kwargs)
+
+    if engine == 'external':
+        node.inputs.args = '--float'
+        node.terminal_output = 'file'
+    return node
+
+
+def pet_motion_correction_workflow(mem_gb: float = 1.0,
+                                   n_frames: int = 1,
+                                   engine: str = 'external',
+                                   label: str = 'pet',
+                                   name='motion_correction_wf'):
+    """
+    Build frame-wise motion correction pipeline for dynamic PET images.
+
+    The dynamic image is split into frames. Every frame is rigidly registered
+    to the temporal mean of the raw frames, one single threaded registration
+    per frame so they run in parallel. The motion corrected frames are
+    averaged into a mean image, which is used for coregistration. The raw
+    frames and their motion transforms are returned, so the final resampling
+    of each frame can combine motion correction, coregistration and
+    normalization in a single pass.
+
+
+    Parameters
+    ----------
+    mem_gb : float, optional
+        estimated size in GB of a single frame held in memory by a node.
+
+    n_frames : int, optional
+        number of frames of the dynamic PET image.
+
+    engine : string, optional
+        engine applying the motion transforms, 'external' (ANTs) or 'python'.
+
+    label : string, optional
+        label of the PET image, the motion transforms and the mean image
+        are named after it.
+
+    """
+
+    # Route input files
+    inputnode = Node(interface=IdentityInterface(
+        fields=['pet_image']),
+        name='inputnode')
+
+    outputnode = Node(interface=IdentityInterface(
+        fields=['frames',
+                'frame_transforms',
+                'mean_image']),
+        name='outputnode')
+
+    # Split dynamic PET image into frames
+    split = Node(fsl.Split(), name='split_frames', mem_gb=2 * n_frames * mem_gb)
+    split.inputs.dimension = 't'
+    split.inputs.output_type = 'NIFTI'
+
+    # Reference image for motion correction
+    reference = Node(fsl.MeanImage(), name='reference_frame', mem_gb=2 * n_frames * mem_gb)
+    reference.inputs.dimension = 'T'
+    reference.inputs.output_type = 'NIFTI'
+
+    # Rigid registration of every frame to the reference, one thread per frame
+    register_frames = MapNode(ants.Registration(), iterfield=['moving_image'],
+                              name='register_frames', n_procs=1, mem_gb=4 * mem_gb)
+    register_frames.inputs.output_transform_prefix = f'{label}_frame2ref'
+    register_frames.inputs.transforms = ['Rigid']
+    register_frames.inputs.transform_parameters = [(0.1,)]
+    register_frames.inputs.number_of_iterations = [[100, 50]]
+    register_frames.inputs.dimension = 3
+    register_frames.inputs.write_composite_transform = True
+    register_frames.inputs.collapse_output_transforms = False
+    register_frames.inputs.metric = ['Mattes']
+    register_frames.inputs.metric_weight = [1]
+    register_frames.inputs.radius_or_number_of_bins = [32]
+    register_frames.inputs.sampling_strategy = ['Regular']
+    register_frames.inputs.sampling_percentage = [0.3]
+    register_frames.inputs.convergence_threshold = [1.e-6]
+    register_frames.inputs.convergence_window_size = [10]
+    register_frames.inputs.smoothing_sigmas = [[2, 1]]
+    register_frames.inputs.sigma_units = ['vox']
+    register_frames.inputs.shrink_factors = [[4, 2]]
+    register_frames.inputs.use_histogram_matching = [False]
+    register_frames.inputs.initial_moving_transform_com = 0
+
+    # Apply motion correction to build the mean image
+    apply_frames = apply_transforms_node(engine, 'apply_motion_correction',
+                                         iterfield=['input_image', 'transforms'],
+                                         n_procs=1, mem_gb=2 * mem_gb)
+    if engine == 'external':
+        apply_frames.inputs.input_image_type = 0
+    apply_frames.inputs.interpolation = 'Linear'
+    apply_frames.inputs.invert_transform_flags = [False]
+
+    # Merge and average motion corrected frames
+    merge_frames = Node(fsl.Merge(), name='merge_frames', mem_gb=2 * n_frames * mem_gb)
+    merge_frames.inputs.dimension = 't'
+    merge_frames.inputs.output_type = 'NIFTI'
+    merge_frames.inputs.merged_file = f'{label}_pet_mc.nii'
+
+    mean = Node(fsl.MeanImage(), name='mean_image', mem_gb=2 * n_frames * mem_gb)
+    mean.inputs.dimension = 'T'
+    mean.inputs.output_type = 'NIFTI'
+
+    # Connect nodes
+    workflow = Workflow(name=name)
+
+    # Split frames and build reference
+    workflow.connect(inputnode, 'pet_image', split, 'in_file')
+    workflow.connect(inputnode, 'pet_image', reference, 'in_file')
+
+    # Register frames to reference
+    workflow.connect(split, 'out_files', register_frames, 'moving_image')
+    workflow.connect(reference, 'out_file', register_frames, 'fixed_image')
+
+    # Motion corrected mean image
+    workflow.connect(split, 'out_files', apply_frames, 'input_image')
+    workflow.connect(reference, 'out_file', apply_frames, 'reference_image')
+    workflow.connect(register_frames, 'composite_transform', apply_frames, 'transforms')
+    workflow.connect(apply_frames, 'output_image', merge_frames, 'in_files')
+    workflow.connect(merge_frames, 'merged_file', mean, 'in_file')
+
+    # Route outputs
+    workflow.connect(split, 'out_files', outputnode, 'frames')
+    workflow.connect(register_frames, 'composite_transform', outputnode, 'frame_transforms')
+    workflow.connect(mean, 'out_file', outputnode, 'mean_image')
+
+    return workflow
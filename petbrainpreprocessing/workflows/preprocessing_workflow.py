@@ -1,39 +1,183 @@
 from __future__ import division, unicode_literals
 
-from nipype.interfaces.utility import (IdentityInterface, Merge)
+from nipype.interfaces.utility import (IdentityInterface, Merge, Function)
 from nipype.interfaces import (fsl, ants, afni)
 from nipype.interfaces.base import CommandLine
 from nipype.interfaces.io import DataSink
-from nipype import Workflow, Node
+from nipype import Workflow, Node, MapNode
 
 from os.path import join as opj
 
-from ..interfaces.synthstrip import Synthstrip
-
-CommandLine.set_default_terminal_output('allatonce')
-fsl.FSLCommand.set_default_output_type('NIFTI_GZ')
-
-
-def pet_preprocessing_workflow(participant_id: str, 
-                               scratch_folder: str,
-                               perform_smoothing: bool, 
-                               name='coreg_and_norm_wf'):
+from ..interfaces.synthstrip import Synthstrip, SynthstripPython
+from ..interfaces.brainmask import ThresholdBrainMask
+from ..interfaces.resample import ResampleToReference
+from ..interfaces.compress import GzipImage
+from ..interfaces.regional import RegionalStats
+from ..interfaces.qc import CoregistrationQC
+from ..interfaces.transforms import ApplyTransformPairPython, SmoothPython
+from .motion_correction import (pet_motion_correction_workflow, append_frame_transforms,
+                                apply_transforms_node)
+
+# Multi-resolution schedules of the rigid coregistration passes. The first
+# pass aligns the PET mask to the T1w mask, which converges at a coarse
+# resolution. The second pass refines the alignment of the PET image itself.
+REGISTRATION_PRESETS = {
+    'fast': {
+        'first_pass': {
+            'number_of_iterations': [[100, 50]],
+            'shrink_factors': [[8, 4]],
+            'smoothing_sigmas': [[4, 2]],
+            'convergence_threshold': [1.e-6],
+            'convergence_window_size': [10],
+            'sampling_percentage': [0.1],
+        },
+        'second_pass': {
+            'number_of_iterations': [[200, 100]],
+            'shrink_factors': [[4, 2]],
+            'smoothing_sigmas': [[2, 1]],
+            'convergence_threshold': [1.e-6],
+            'convergence_window_size': [10],
+            'sampling_percentage': [0.2],
+        },
+    },
+    'default': {
+        'first_pass': {
+            'number_of_iterations': [[250, 100]],
+            'shrink_factors': [[8, 4]],
+            'smoothing_sigmas': [[4, 2]],
+            'convergence_threshold': [1.e-7],
+            'convergence_window_size': [10],
+            'sampling_percentage': [0.2],
+        },
+        'second_pass': {
+            'number_of_iterations': [[500, 250, 100]],
+            'shrink_factors': [[8, 4, 2]],
+            'smoothing_sigmas': [[4, 2, 1]],
+            'convergence_threshold': [1.e-7],
+            'convergence_window_size': [10],
+            'sampling_percentage': [0.3],
+        },
+    },
+    'precise': {
+        'first_pass': {
+            'number_of_iterations': [[500, 250, 100]],
+            'shrink_factors': [[8, 4, 2]],
+            'smoothing_sigmas': [[4, 2, 1]],
+            'convergence_threshold': [1.e-8],
+            'convergence_window_size': [15],
+            'sampling_percentage': [0.3],
+        },
+        'second_pass': {
+            'number_of_iterations': [[1000, 500, 250, 100]],
+            'shrink_factors': [[8, 4, 2, 1]],
+            'smoothing_sigmas': [[3, 2, 1, 0]],
+            'convergence_threshold': [1.e-8],
+            'convergence_window_size': [15],
+            'sampling_percentage': [0.5],
+        },
+    },
+}
+
+
+def _set_interface_defaults():
+    # Class wide defaults of the command line interfaces, set when a workflow
+    # is built rather than on import of this module
+    CommandLine.set_default_terminal_output('allatonce')
+    fsl.FSLCommand.set_default_output_type('NIFTI_GZ')
+
+
+def pet_scan_workflow(perform_smoothing: bool,
+                      omp_nthreads: int = 1,
+                      mem_gb: float = 1.0,
+                      skullstrip_backend: str = 'docker',
+                      skullstrip_model: str = None,
+                      n_frames: int = 1,
+                      registration_preset: str = 'default',
+                      compress_level: int = 6,
+                      atlas_file: str = None,
+                      atlas_labels: str = None,
+                      reference_region: list = None,
+                      template_mask: str = None,
+                      engine: str = 'external',
+                      label: str = 'pet',
+                      name='pet_wf'):
     """
-    Build PET brain coregistration and normalization pipeline.
+    Build PET brain coregistration and normalization pipeline of a single scan.
 
     This workflow performs image croppiong, brain extraction, coregistration
-    in two separate stages, and normalization. 
+    in two separate stages, and normalization. Dynamic PET images are motion
+    corrected first, and their mean image is used for coregistration. The T1w
+    image resampled to the PET voxel size is an input, so it can be shared by
+    all scans of a participant (see pet_preprocessing_workflow).
 
 
     Parameters
     ----------
-    participant_id : string
-        participant label for this single-participant workflow.
-
-        base_dir : string, optional
-            path to workflow storage
+    omp_nthreads : int, optional
+        maximum number of threads a single node (e.g. a registration) may use.
+
+    mem_gb : float, optional
+        estimated size in GB of the largest 3D image held in memory by a node.
+        Used to set the memory requests of the nodes for the scheduler.
+
+    skullstrip_backend : string, optional
+        brain extraction backend: 'docker' runs synthstrip-docker, 'python'
+        runs a SynthStrip model in-process and 'threshold' uses a fast
+        intensity threshold mask suited for FDG images.
+
+    skullstrip_model : string, optional
+        alternative SynthStrip model weights. Mandatory for the 'python'
+        backend, which expects a TorchScript model.
+
+    n_frames : int, optional
+        number of frames of the PET image. Images with more than one frame
+        are motion corrected, and all frames are resampled in a single pass
+        with the combined motion, coregistration and normalization transforms.
+
+    registration_preset : string, optional
+        multi-resolution schedule of the coregistration passes, one of
+        'fast', 'default' or 'precise' (see REGISTRATION_PRESETS).
+
+    compress_level : int, optional
+        gzip compression level of the images written to the results folder.
+        Intermediate images are not compressed. 0 writes the results
+        uncompressed as well.
+
+    atlas_file : string, optional
+        label image of an atlas in template space. When given, the regional
+        statistics of the normalized PET image are computed.
+
+    atlas_labels : string, optional
+        TSV file with the region names of the atlas.
+
+    reference_region : list of strings, optional
+        names or label indices of the atlas regions used as SUVR reference.
+
+    template_mask : string, optional
+        brain mask of the template. When given, the quality control reports
+        the fraction of the template brain covered by the normalized PET
+        image.
+
+    engine : string, optional
+        engine of the resampling and smoothing steps: 'external' runs
+        antsApplyTransforms and FSL, 'python' resamples and smooths
+        in-process with NumPy and SciPy. Registrations always run ANTs.
+
+    label : string, optional
+        label of the PET image, the registration outputs and the merged
+        frames of dynamic images are named after it. Scans of one session
+        share their output folders, so the outputs of each need their own
+        names.
 
     """
+    _set_interface_defaults()
+
+    dynamic = n_frames > 1
+    if engine not in ('external', 'python'):
+        raise ValueError(f"ERROR. Unknown engine {engine}.")
+    if registration_preset not in REGISTRATION_PRESETS:
+        raise ValueError(f"ERROR. Unknown registration preset {registration_preset}.")
+    preset = REGISTRATION_PRESETS[registration_preset]
     
     # Route input files
     inputnode = Node(interface=IdentityInterface(
@@ -42,178 +186,447 @@ def pet_preprocessing_workflow(participant_id: str,
                 'participant_id', 
                 'template', 
                 'T1', 
+                'T1_resampled',
                 'T1_mask', 
-                'T1_resampled_template', 
                 'transform',
                 'smooth_fwhm',
-                'num_threads']), 
+                'label']), 
         name='input_files')
 
+    # Motion correction of dynamic PET image
+    if dynamic:
+        motion_correction = pet_motion_correction_workflow(
+            mem_gb=mem_gb, n_frames=n_frames, engine=engine, label=label)
+
     # Crop PET image
-    crop = Node(afni.Autobox(), name='crop_image')
-    crop.inputs.outputtype='NIFTI_GZ'
+    crop = Node(afni.Autobox(), name='crop_image', mem_gb=mem_gb)
+    crop.inputs.outputtype = 'NIFTI'
     crop.inputs.padding = 10
 
     # Skull strip PET image
-    synthstrip = Node(Synthstrip(), name = "skull_strip")
-    synthstrip.inputs.use_gpu = False
-    synthstrip.inputs.no_csf = False
+    if skullstrip_backend == 'docker':
+        synthstrip = Node(Synthstrip(), name = "skull_strip", 
+                          n_procs=omp_nthreads, mem_gb=max(2.0, 3 * mem_gb))
+        synthstrip.inputs.output_type = 'NIFTI'
+        synthstrip.inputs.use_gpu = False
+        synthstrip.inputs.no_csf = False
+        if skullstrip_model:
+            synthstrip.inputs.model_file = skullstrip_model
+    elif skullstrip_backend == 'python':
+        synthstrip = Node(SynthstripPython(), name = "skull_strip", 
+                          n_procs=omp_nthreads, mem_gb=max(2.0, 3 * mem_gb))
+        synthstrip.inputs.model_file = skullstrip_model
+    elif skullstrip_backend == 'threshold':
+        synthstrip = Node(ThresholdBrainMask(), name = "skull_strip", 
+                          mem_gb=2 * mem_gb)
+    else:
+        raise ValueError(f"ERROR. Unknown skull strip backend {skullstrip_backend}.")
 
     # Rigister cropped PET to MR space, first pass
-    coregister_first_pass = Node(ants.Registration(), name='coreg_first_pass')
-    coregister_first_pass.inputs.output_transform_prefix = 'petmask2anatmask'
-    coregister_first_pass.inputs.output_warped_image = 'petmask2anatmask.nii.gz'
+    coregister_first_pass = Node(ants.Registration(), name='coreg_first_pass',
+                                 n_procs=omp_nthreads, mem_gb=4 * mem_gb)
+    coregister_first_pass.inputs.output_transform_prefix = f'{label}_petmask2anatmask'
+    coregister_first_pass.inputs.output_warped_image = f'{label}_petmask2anatmask.nii'
     coregister_first_pass.inputs.transforms = ['Rigid']
-    coregister_first_pass.inputs.transform_parameters = [(0.3,), (0.3,)]
-    coregister_first_pass.inputs.number_of_iterations = [[1000, 100]]*3 
+    coregister_first_pass.inputs.transform_parameters = [(0.1,)]
     coregister_first_pass.inputs.dimension = 3
-    coregister_first_pass.inputs.write_composite_transform = True
-    coregister_first_pass.inputs.collapse_output_transforms = False
+    coregister_first_pass.inputs.write_composite_transform = False
+    coregister_first_pass.inputs.collapse_output_transforms = True
     coregister_first_pass.inputs.metric = ['Mattes'] 
     coregister_first_pass.inputs.metric_weight = [1] 
     coregister_first_pass.inputs.radius_or_number_of_bins = [32] 
     coregister_first_pass.inputs.sampling_strategy = ['Regular']
-    coregister_first_pass.inputs.sampling_percentage = [0.3] 
-    coregister_first_pass.inputs.convergence_threshold = [1.e-12] 
-    coregister_first_pass.inputs.convergence_window_size = [20] 
-    coregister_first_pass.inputs.smoothing_sigmas = [[4, 2]]
     coregister_first_pass.inputs.sigma_units = ['vox'] 
-    coregister_first_pass.inputs.shrink_factors = [[15, 8]] 
     coregister_first_pass.inputs.use_estimate_learning_rate_once = [True] 
     coregister_first_pass.inputs.use_histogram_matching = [False] 
     coregister_first_pass.inputs.initial_moving_transform_com = 0
-
-    # Rigister cropped PET to MR space, second pass
-    coregister_second_pass = Node(ants.Registration(), name='coreg_second_pass')
-    coregister_second_pass.inputs.output_transform_prefix = 'pet2anat'
-    coregister_second_pass.inputs.output_warped_image = 'pet2anat.nii.gz'
+    for setting, value in preset['first_pass'].items():
+        setattr(coregister_first_pass.inputs, setting, value)
+
+    # Rigister cropped PET to MR space, second pass, initialized with the first
+    # pass. The collapsed output is a single affine of the whole PET to MR chain
+    coregister_second_pass = Node(ants.Registration(), name='coreg_second_pass',
+                                  n_procs=omp_nthreads, mem_gb=4 * mem_gb)
+    coregister_second_pass.inputs.output_transform_prefix = f'{label}_pet2anat'
+    coregister_second_pass.inputs.output_warped_image = f'{label}_pet2anat.nii'
     coregister_second_pass.inputs.transforms = ['Rigid']
-    coregister_second_pass.inputs.transform_parameters = [(0.3,), (0.3,)]
-    coregister_second_pass.inputs.number_of_iterations = [[1000, 100]]*3 
+    coregister_second_pass.inputs.transform_parameters = [(0.1,)]
     coregister_second_pass.inputs.dimension = 3
-    coregister_second_pass.inputs.write_composite_transform = True
-    coregister_second_pass.inputs.collapse_output_transforms = False
+    coregister_second_pass.inputs.write_composite_transform = False
+    coregister_second_pass.inputs.collapse_output_transforms = True
     coregister_second_pass.inputs.metric = ['Mattes'] 
     coregister_second_pass.inputs.metric_weight = [1] 
     coregister_second_pass.inputs.radius_or_number_of_bins = [32] 
     coregister_second_pass.inputs.sampling_strategy = ['Regular']
-    coregister_second_pass.inputs.sampling_percentage = [0.3] 
-    coregister_second_pass.inputs.convergence_threshold = [1.e-12] 
-    coregister_second_pass.inputs.convergence_window_size = [20] 
-    coregister_second_pass.inputs.smoothing_sigmas = [[4, 2]]
     coregister_second_pass.inputs.sigma_units = ['vox'] 
-    coregister_second_pass.inputs.shrink_factors = [[15, 8]] 
     coregister_second_pass.inputs.use_estimate_learning_rate_once = [True] 
     coregister_second_pass.inputs.use_histogram_matching = [False] 
-
-    # Merge transformation files
-    coregister_merge = Node(Merge(2), iterfield=['in'], name='merge_coreg_transformations')
+    for setting, value in preset['second_pass'].items():
+        setattr(coregister_second_pass.inputs, setting, value)
 
     # Merge all transformations
-    merge = Node(Merge(3), iterfield=['in'], name='merge_transformations')
-
-    # Apply mask coregistration to pet
-    apply_first_pass = Node(ants.ApplyTransforms(), name='apply_coreg_first_pass')
-    apply_first_pass.inputs.args = '--float'
-    apply_first_pass.inputs.input_image_type = 3
-    apply_first_pass.inputs.interpolation = 'Linear'
-    apply_first_pass.inputs.invert_transform_flags = [False]
-    apply_first_pass.inputs.num_threads = 1
-    apply_first_pass.terminal_output = 'file'
-
-    # Apply final coreg to PET image for native space analysis
-    apply_second_pass = Node(ants.ApplyTransforms(), name='apply_final_coreg')
-    apply_second_pass.inputs.args = '--float'
-    apply_second_pass.inputs.input_image_type = 3
+    merge = Node(Merge(2), iterfield=['in'], name='merge_transformations')
+
+    # Compose coregistration and normalization into a single displacement field,
+    # so the fMRIPrep transform is read once instead of once per frame
+    if dynamic:
+        compose_transforms = apply_transforms_node(engine, 'compose_transformations',
+                                                   n_procs=1, mem_gb=4 * mem_gb)
+        compose_transforms.inputs.print_out_composite_warp_file = True
+        compose_transforms.inputs.output_image = 'pet2template_xfm.nii'
+        compose_transforms.inputs.invert_transform_flags = [False, False]
+
+    if engine == 'python':
+        # Apply final coreg for native space analysis and the normalization
+        # for template space analysis in one node, which reads the PET image
+        # once. The inputs and output of the normalization are prefixed
+        # with second_.
+        if dynamic:
+            apply_second_pass = MapNode(
+                ApplyTransformPairPython(),
+                iterfield=['input_image', 'transforms', 'second_transforms'],
+                name='apply_final_coreg_and_norm', n_procs=1, mem_gb=3 * mem_gb)
+        else:
+            apply_second_pass = Node(ApplyTransformPairPython(),
+                                     name='apply_final_coreg_and_norm',
+                                     n_procs=1, mem_gb=3 * mem_gb)
+        apply_coregistration_and_normalization = apply_second_pass
+        norm_prefix = 'second_'
+    else:
+        # Apply final coreg to PET image for native space analysis
+        apply_second_pass = apply_transforms_node(
+            engine, 'apply_final_coreg',
+            iterfield=['input_image', 'transforms'] if dynamic else None,
+            n_procs=1, mem_gb=2 * mem_gb)
+        apply_second_pass.inputs.input_image_type = 3
+
+        # Apply Transformation - applies the normalization matrix to the mean image
+        apply_coregistration_and_normalization = apply_transforms_node(
+            engine, 'apply_coreg_and_norm',
+            iterfield=['input_image', 'transforms'] if dynamic else None,
+            n_procs=1, mem_gb=2 * mem_gb)
+        apply_coregistration_and_normalization.inputs.input_image_type = 3
+        apply_coregistration_and_normalization.inputs.interpolation = 'Linear'
+        norm_prefix = ''
     apply_second_pass.inputs.interpolation = 'Linear'
-    apply_second_pass.inputs.invert_transform_flags = [False, False]
-    apply_second_pass.inputs.num_threads = 1
-    apply_second_pass.terminal_output = 'file'
-
-    # Apply Transformation - applies the normalization matrix to the mean image
-    apply_coregistration_and_normalization = Node(ants.ApplyTransforms(), name='apply_coreg_and_norm')
-    apply_coregistration_and_normalization.inputs.args = '--float'
-    apply_coregistration_and_normalization.inputs.input_image_type = 3
-    apply_coregistration_and_normalization.inputs.interpolation = 'Linear'
-    apply_coregistration_and_normalization.inputs.invert_transform_flags = [False, False, False]
-    apply_coregistration_and_normalization.inputs.num_threads = 1
-    apply_coregistration_and_normalization.terminal_output = 'file'
+    apply_second_pass.inputs.invert_transform_flags = [False] * (1 + dynamic)
+    apply_coregistration_and_normalization.set_input(
+        f'{norm_prefix}invert_transform_flags', [False, False])
+    # Uncompressed, so the output is compressed once at the configured level.
+    # The outputs of both spaces share their name, in their own folders.
+    if not dynamic:
+        apply_second_pass.inputs.output_image = f'{label}_pet_trans.nii'
+        apply_coregistration_and_normalization.set_input(
+            f'{norm_prefix}output_image',
+            opj('norm', f'{label}_pet_trans.nii') if norm_prefix else f'{label}_pet_trans.nii')
+
+    # Combine transformations with frame motion and merge resampled frames
+    if dynamic:
+        frame_coreg_transforms = Node(Function(input_names=['transforms', 'frame_transforms'],
+                                               output_names=['transforms'],
+                                               function=append_frame_transforms),
+                                      name='frame_coreg_transformations')
+        frame_transforms = Node(Function(input_names=['transforms', 'frame_transforms'],
+                                         output_names=['transforms'],
+                                         function=append_frame_transforms),
+                                name='frame_transformations')
+
+        merge_final_coreg = Node(fsl.Merge(), name='merge_final_coreg_frames',
+                                 mem_gb=2 * n_frames * mem_gb)
+        merge_final_coreg.inputs.dimension = 't'
+        merge_final_coreg.inputs.output_type = 'NIFTI'
+        merge_final_coreg.inputs.merged_file = f'{label}_pet_trans.nii'
+        merge_coreg_and_norm = Node(fsl.Merge(), name='merge_coreg_and_norm_frames',
+                                    mem_gb=2 * n_frames * mem_gb)
+        merge_coreg_and_norm.inputs.dimension = 't'
+        merge_coreg_and_norm.inputs.output_type = 'NIFTI'
+        merge_coreg_and_norm.inputs.merged_file = f'{label}_pet_trans.nii'
 
     # Smoothing
     if perform_smoothing:
-        smooth = Node(fsl.Smooth(), name='fwhm_smoothing')
+        if engine == 'python':
+            smooth = Node(SmoothPython(), name='fwhm_smoothing', mem_gb=2 * mem_gb)
+        else:
+            smooth = Node(fsl.Smooth(), name='fwhm_smoothing', mem_gb=2 * n_frames * mem_gb)
+            smooth.inputs.output_type = 'NIFTI'
+
+    # Regional statistics of the normalized PET image
+    if atlas_file:
+        regional_stats = Node(RegionalStats(), name='regional_stats',
+                              mem_gb=3 * n_frames * mem_gb)
+        regional_stats.inputs.atlas_file = atlas_file
+        if atlas_labels:
+            regional_stats.inputs.labels_file = atlas_labels
+        if reference_region:
+            regional_stats.inputs.reference_region = list(reference_region)
+
+    # Quality control of the coregistration and normalization
+    quality_control = Node(CoregistrationQC(), name='quality_control',
+                           mem_gb=(4 + n_frames) * mem_gb)
+    if template_mask:
+        quality_control.inputs.template_mask = template_mask
 
     # Datasink
     datasink = Node(DataSink(), name="output_files")
 
-    # Set subject scratch folder if defined
-    if scratch_folder:
-        scratch_folder = opj(scratch_folder, participant_id)
-
     # Connect nodes
-    workflow = Workflow(name=name, base_dir=scratch_folder)
+    workflow = Workflow(name=name)
 
-    # Crop PET image
-    workflow.connect(inputnode, 'pet_image', crop, 'in_file')
+    # Crop PET image, or the motion corrected mean image of a dynamic PET image
+    if dynamic:
+        workflow.connect(inputnode, 'pet_image', motion_correction, 'inputnode.pet_image')
+        workflow.connect(motion_correction, 'outputnode.mean_image', crop, 'in_file')
+    else:
+        workflow.connect(inputnode, 'pet_image', crop, 'in_file')
 
     # Skull strip PET image
     workflow.connect(crop, 'out_file', synthstrip, 'in_file')
-    # workflow.connect(inputnode, 'num_threads', synthstrip, 'num_threads') # TODO: Not yet implemented
 
     # Register masks
     workflow.connect(inputnode, 'T1_mask', coregister_first_pass, 'fixed_image')
     workflow.connect(synthstrip, 'mask_file', coregister_first_pass, 'moving_image')
-    workflow.connect(inputnode, 'num_threads', coregister_first_pass, 'num_threads')
     
-    # Apply mask rotation to pet image
-    workflow.connect(synthstrip, 'out_file', apply_first_pass, 'input_image')
-    workflow.connect(inputnode, 'T1_resampled_template', apply_first_pass, 'reference_image')
-    workflow.connect(coregister_first_pass, 'composite_transform', apply_first_pass, 'transforms')
-
-    # Register cropped PET to MR
-    workflow.connect(apply_first_pass, 'output_image', coregister_second_pass, 'moving_image')
+    # Register skull stripped PET to MR, starting from the mask registration
+    workflow.connect(synthstrip, 'out_file', coregister_second_pass, 'moving_image')
     workflow.connect(inputnode, 'T1', coregister_second_pass, 'fixed_image')
-    workflow.connect(inputnode, 'num_threads', coregister_second_pass, 'num_threads')
-
-    # Merge coregistrations for native space output
-    workflow.connect(coregister_second_pass, 'composite_transform', coregister_merge, 'in1')
-    workflow.connect(coregister_first_pass, 'composite_transform', coregister_merge, 'in2')
+    workflow.connect(coregister_first_pass, 'forward_transforms', coregister_second_pass, 'initial_moving_transform')
 
     # Coregistration, Normalization -> merge transformations
     workflow.connect(inputnode, 'transform', merge, 'in1')
-    workflow.connect(coregister_second_pass, 'composite_transform', merge, 'in2')
-    workflow.connect(coregister_first_pass, 'composite_transform', merge, 'in3')
+    workflow.connect(coregister_second_pass, 'forward_transforms', merge, 'in2')
 
-    # Transformations -> apply final coregistration
-    workflow.connect(inputnode, 'pet_image', apply_second_pass, 'input_image')
-    workflow.connect(inputnode, 'T1_resampled_template', apply_second_pass, 'reference_image')
-    workflow.connect(coregister_merge, 'out', apply_second_pass, 'transforms')
+    if dynamic:
+        workflow.connect(inputnode, 'template', compose_transforms, 'input_image')
+        workflow.connect(inputnode, 'template', compose_transforms, 'reference_image')
+        workflow.connect(merge, 'out', compose_transforms, 'transforms')
 
-    # Transformations -> apply coregistration and normalization to pet image
-    workflow.connect(inputnode, 'pet_image', apply_coregistration_and_normalization, 'input_image')
-    workflow.connect(inputnode, 'template', apply_coregistration_and_normalization, 'reference_image')
-    workflow.connect(merge, 'out', apply_coregistration_and_normalization, 'transforms')
+    # Transformations -> apply final coregistration
+    workflow.connect(inputnode, 'T1_resampled', apply_second_pass, 'reference_image')
+    if dynamic:
+        workflow.connect(motion_correction, 'outputnode.frames', apply_second_pass, 'input_image')
+        workflow.connect(coregister_second_pass, 'forward_transforms', frame_coreg_transforms, 'transforms')
+        workflow.connect(motion_correction, 'outputnode.frame_transforms', frame_coreg_transforms, 'frame_transforms')
+        workflow.connect(frame_coreg_transforms, 'transforms', apply_second_pass, 'transforms')
+        workflow.connect(apply_second_pass, 'output_image', merge_final_coreg, 'in_files')
+        pet_final = (merge_final_coreg, 'merged_file')
+    else:
+        workflow.connect(inputnode, 'pet_image', apply_second_pass, 'input_image')
+        workflow.connect(coregister_second_pass, 'forward_transforms', apply_second_pass, 'transforms')
+        pet_final = (apply_second_pass, 'output_image')
+
+    # Transformations -> apply coregistration and normalization to pet image,
+    # the python engine reads the input image of the final coreg
+    workflow.connect(inputnode, 'template', apply_coregistration_and_normalization, f'{norm_prefix}reference_image')
+    if dynamic:
+        if not norm_prefix:
+            workflow.connect(motion_correction, 'outputnode.frames', apply_coregistration_and_normalization, 'input_image')
+        workflow.connect(compose_transforms, 'output_image', frame_transforms, 'transforms')
+        workflow.connect(motion_correction, 'outputnode.frame_transforms', frame_transforms, 'frame_transforms')
+        workflow.connect(frame_transforms, 'transforms', apply_coregistration_and_normalization, f'{norm_prefix}transforms')
+        workflow.connect(apply_coregistration_and_normalization, f'{norm_prefix}output_image', merge_coreg_and_norm, 'in_files')
+        pet_norm = (merge_coreg_and_norm, 'merged_file')
+    else:
+        if not norm_prefix:
+            workflow.connect(inputnode, 'pet_image', apply_coregistration_and_normalization, 'input_image')
+        workflow.connect(merge, 'out', apply_coregistration_and_normalization, f'{norm_prefix}transforms')
+        pet_norm = (apply_coregistration_and_normalization, f'{norm_prefix}output_image')
 
     # Smooth PET image
     if perform_smoothing:
-        workflow.connect(apply_coregistration_and_normalization, 'output_image', smooth, 'in_file')
+        workflow.connect(*pet_norm, smooth, 'in_file')
         workflow.connect(inputnode, 'smooth_fwhm', smooth, 'fwhm')
 
+    # Regional statistics
+    if atlas_file:
+        workflow.connect(*pet_norm, regional_stats, 'in_file')
+        workflow.connect(inputnode, 'label', regional_stats, 'label')
+
+    # Quality control, from the uncompressed images of the coregistration passes
+    workflow.connect(coregister_first_pass, 'warped_image', quality_control, 'first_pass_mask')
+    workflow.connect(coregister_second_pass, 'warped_image', quality_control, 'coreg_pet')
+    workflow.connect(inputnode, 'T1', quality_control, 'T1')
+    workflow.connect(inputnode, 'T1_mask', quality_control, 'T1_mask')
+    workflow.connect(*pet_norm, quality_control, 'norm_pet')
+    workflow.connect(inputnode, 'label', quality_control, 'label')
+
+    # Compress images once on their way to the output folders
+    def compressed(node, field, name):
+        if not compress_level:
+            return node, field
+        gzip_image = Node(GzipImage(compress_level=compress_level),
+                          name=f'gzip_{name}', mem_gb=n_frames * mem_gb)
+        workflow.connect(node, field, gzip_image, 'in_file')
+        return gzip_image, 'out_file'
+
     # Route results files to output folders
     workflow.connect(inputnode, 'results_folder', datasink, 'base_directory')
     workflow.connect(inputnode, 'participant_id', datasink, 'container')
-    workflow.connect(crop, 'out_file', datasink, 'convert.pet_crop')
-    workflow.connect(synthstrip, 'out_file', datasink, 'convert.pet_skullstrip')
-    workflow.connect(coregister_first_pass, 'warped_image', datasink, 'coreg.mask')
-    workflow.connect(coregister_second_pass, 'warped_image', datasink, 'coreg.pet')
-    workflow.connect(inputnode, 'T1_resampled_template', datasink, 'coreg.T1_resampled')
-    workflow.connect(apply_second_pass, 'output_image', datasink, 'coreg.pet_final')
-    workflow.connect(coregister_first_pass, 'composite_transform', datasink, 'transforms.cocoregister_first_pass')
-    workflow.connect(coregister_second_pass, 'composite_transform', datasink, 'transforms.cocoregister_second_pass')
-    workflow.connect(apply_coregistration_and_normalization, 'output_image', datasink, 'norm.pet')
+    workflow.connect(*compressed(crop, 'out_file', 'pet_crop'), datasink, 'convert.pet_crop')
+    workflow.connect(*compressed(synthstrip, 'out_file', 'pet_skullstrip'), datasink, 'convert.pet_skullstrip')
+    workflow.connect(*compressed(coregister_first_pass, 'warped_image', 'coreg_mask'), datasink, 'coreg.mask')
+    workflow.connect(*compressed(coregister_second_pass, 'warped_image', 'coreg_pet'), datasink, 'coreg.pet')
+    workflow.connect(inputnode, 'T1_resampled', datasink, 'coreg.T1_resampled')
+    workflow.connect(*compressed(*pet_final, 'pet_final'), datasink, 'coreg.pet_final')
+    workflow.connect(coregister_first_pass, 'forward_transforms', datasink, 'transforms.cocoregister_first_pass')
+    workflow.connect(coregister_second_pass, 'forward_transforms', datasink, 'transforms.cocoregister_second_pass')
+    workflow.connect(*compressed(*pet_norm, 'pet_norm'), datasink, 'norm.pet')
+
+    if dynamic:
+        workflow.connect(*compressed(motion_correction, 'outputnode.mean_image', 'pet_mean'),
+                         datasink, 'motion.pet_mean')
+        workflow.connect(motion_correction, 'outputnode.frame_transforms', datasink, 'transforms.motion_correction')
 
     if perform_smoothing:
-        workflow.connect(smooth, 'smoothed_file', datasink, 'smooth')
+        workflow.connect(*compressed(smooth, 'smoothed_file', 'pet_smooth'), datasink, 'smooth')
+
+    if atlas_file:
+        workflow.connect(regional_stats, 'out_file', datasink, 'stats')
+
+    workflow.connect(quality_control, 'out_file', datasink, 'qc')
+    workflow.connect(quality_control, 'coreg_mosaic', datasink, 'qc.@coreg_mosaic')
+    workflow.connect(quality_control, 'norm_mosaic', datasink, 'qc.@norm_mosaic')
 
     return workflow
 
+
+def _voxel_size(scan):
+    # Voxel size of a scan as used by ResampleToReference
+    return tuple(round(float(size), 4) for size in scan['voxel_size'][:3])
+
+
+def pet_preprocessing_workflow(participant_id: str,
+                               scratch_folder: str,
+                               perform_smoothing: bool,
+                               scans: list,
+                               omp_nthreads: int = 1,
+                               mem_gb: float = 1.0,
+                               skullstrip_backend: str = 'docker',
+                               skullstrip_model: str = None,
+                               cache_dir: str = None,
+                               cache_size_gb: float = None,
+                               registration_preset: str = 'default',
+                               compress_level: int = 6,
+                               atlas_file: str = None,
+                               atlas_labels: str = None,
+                               reference_region: list = None,
+                               template_mask: str = None,
+                               engine: str = 'external',
+                               name='coreg_and_norm_wf'):
+    """
+    Build PET brain coregistration and normalization pipeline of a participant.
+
+    All PET scans of the participant, e.g. of several tracers or sessions,
+    share one anatomical branch: the T1w image is resampled once per PET
+    voxel size and passed to every scan. Each scan is processed by its own
+    branch (see pet_scan_workflow), so the branches run in parallel.
+
+
+    Parameters
+    ----------
+    participant_id : string
+        participant label for this single-participant workflow.
+
+        base_dir : string, optional
+            path to workflow storage
+
+    scans : list of dicts
+        PET scans of the participant. Each scan has a 'label' (its file name
+        without suffix, used to name its branch), the path of its 'pet_image',
+        its 'session' (None without sessions), its number of frames
+        ('n_frames'), its 'voxel_size' and the estimated size in GB of its
+        largest 3D image ('mem_gb').
+
+    omp_nthreads : int, optional
+        maximum number of threads a single node (e.g. a registration) may use.
+
+    mem_gb : float, optional
+        estimated size in GB of the T1w image held in memory by a node.
+
+    cache_dir : string, optional
+        folder of the derivative cache in which the T1w image resampled to
+        the PET voxel size is stored.
+
+    cache_size_gb : float, optional
+        maximum size of the derivative cache in GB.
+
+    Other parameters are passed on to pet_scan_workflow.
+
+    """
+    _set_interface_defaults()
+
+    # Route input files shared by all scans
+    inputnode = Node(interface=IdentityInterface(
+        fields=['results_folder',
+                'template',
+                'T1',
+                'T1_mask',
+                'transform',
+                'smooth_fwhm']),
+        name='input_files')
+
+    # Set subject scratch folder if defined
+    if scratch_folder:
+        scratch_folder = opj(scratch_folder, participant_id)
+
+    workflow = Workflow(name=name, base_dir=scratch_folder)
+
+    # Scans with the same voxel size share the resampled T1w image, the first
+    # scan of each voxel size is used as reference
+    references = {}
+    for scan in scans:
+        references.setdefault(_voxel_size(scan), scan)
+
+    T1_resampled = {}
+    for i, (voxel_size, reference) in enumerate(references.items()):
+        suffix = f'_{i}' if len(references) > 1 else ''
+
+        # Resample T1w to PET voxel dimensions (needed as reference image for ANTs)
+        resample_T1 = Node(ResampleToReference(), name=f'resample_T1{suffix}',
+                           mem_gb=3 * mem_gb)
+        resample_T1.inputs.reference_image = reference['pet_image']
+        if cache_dir:
+            resample_T1.inputs.cache_dir = cache_dir
+        if cache_size_gb:
+            resample_T1.inputs.cache_size_gb = cache_size_gb
+        workflow.connect(inputnode, 'T1', resample_T1, 'in_file')
+        T1_resampled[voxel_size] = (resample_T1, 'out_file')
+
+        # The resampled T1w is written to the outputs of every scan, compress
+        # it once. ANTs only reads its header when it is used as reference.
+        if compress_level:
+            gzip_T1 = Node(GzipImage(compress_level=compress_level),
+                           name=f'gzip_T1_resampled{suffix}', mem_gb=mem_gb)
+            workflow.connect(resample_T1, 'out_file', gzip_T1, 'in_file')
+            T1_resampled[voxel_size] = (gzip_T1, 'out_file')
+
+    # One branch per PET scan
+    for scan in scans:
+        scan_wf = pet_scan_workflow(
+            perform_smoothing,
+            omp_nthreads=omp_nthreads,
+            mem_gb=scan['mem_gb'],
+            skullstrip_backend=skullstrip_backend,
+            skullstrip_model=skullstrip_model,
+            n_frames=scan['n_frames'],
+            registration_preset=registration_preset,
+            compress_level=compress_level,
+            atlas_file=atlas_file,
+            atlas_labels=atlas_labels,
+            reference_region=reference_region,
+            template_mask=template_mask,
+            engine=engine,
+            label=scan['label'],
+            name=f"pet_wf_{scan['label']}")
+        scan_wf.inputs.input_files.pet_image = scan['pet_image']
+        scan_wf.inputs.input_files.label = scan['label']
+        # Outputs of every session are stored in their own folder
+        scan_wf.inputs.input_files.participant_id = (
+            opj(participant_id, f"ses-{scan['session']}")
+            if scan['session'] is not None else participant_id)
+
+        for field in ['results_folder', 'template', 'T1', 'T1_mask', 'transform',
+                      'smooth_fwhm']:
+            workflow.connect(inputnode, field, scan_wf, f'input_files.{field}')
+        workflow.connect(*T1_resampled[_voxel_size(scan)], scan_wf, 'input_files.T1_resampled')
+
+    return workflow
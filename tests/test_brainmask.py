@@ -0,0 +1,26 @@
+import nibabel as nb
+import numpy as np
+import pytest
+
+from petbrainpreprocessing.interfaces.brainmask import ThresholdBrainMask
+
+
+def test_threshold_brain_mask_keeps_the_brain(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    grid = np.indices((30, 30, 30))
+    data = (np.sqrt(((grid - 14.5) ** 2).sum(axis=0)) < 8) * 100.0
+    nb.save(nb.Nifti1Image(data.astype(np.float32), np.diag([2.0, 2.0, 2.0, 1.0])), "pet.nii")
+
+    result = ThresholdBrainMask(in_file="pet.nii").run()
+    mask = nb.load(result.outputs.mask_file).get_fdata() > 0
+    assert mask[15, 15, 15] and not mask[0, 0, 0]
+
+
+@pytest.mark.parametrize('value', [0.0, -1.0])
+def test_threshold_brain_mask_rejects_images_without_uptake(tmp_path, monkeypatch, value):
+    monkeypatch.chdir(tmp_path)
+    data = np.full((10, 10, 10), value, dtype=np.float32)
+    nb.save(nb.Nifti1Image(data, np.eye(4)), "pet.nii")
+
+    with pytest.raises(ValueError, match="no positive intensities"):
+        ThresholdBrainMask(in_file="pet.nii").run()
@@ -0,0 +1,53 @@
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from petbrainpreprocessing.cache import DerivativeCache, file_hash
+
+
+def hash_files(cache_dir, file_paths):
+    cache = DerivativeCache(cache_dir)
+    return [cache.key(file_path) for file_path in file_paths]
+
+
+def indexed_paths(cache_dir):
+    with sqlite3.connect(str(cache_dir / "file_hashes.sqlite")) as connection:
+        return {path for path, in connection.execute("SELECT path FROM file_hashes")}
+
+
+def test_concurrent_launches_keep_all_digests(tmp_path):
+    file_paths = []
+    for i in range(40):
+        file_path = tmp_path / f"sub-{i:02d}_T1w.nii"
+        file_path.write_bytes(bytes([i]) * 1000)
+        file_paths.append(str(file_path))
+
+    cache_dir = tmp_path / "cache"
+    with ProcessPoolExecutor(max_workers=4, mp_context=get_context('spawn')) as executor:
+        list(executor.map(hash_files, [str(cache_dir)] * 4,
+                          [file_paths[i::4] for i in range(4)]))
+
+    assert indexed_paths(cache_dir) == set(file_paths)
+
+
+def test_changed_files_are_hashed_again(tmp_path):
+    file_path = tmp_path / "T1w.nii"
+    file_path.write_bytes(b"first")
+    cache = DerivativeCache(str(tmp_path / "cache"))
+    first_key = cache.key(str(file_path))
+
+    file_path.write_bytes(b"second version")
+    assert cache.key(str(file_path)) != first_key
+    assert cache._file_hash(str(file_path)) == file_hash(str(file_path))
+
+
+def test_evict_removes_digests_of_deleted_files(tmp_path):
+    kept, deleted = tmp_path / "kept.nii", tmp_path / "deleted.nii"
+    kept.write_bytes(b"kept")
+    deleted.write_bytes(b"deleted")
+    cache = DerivativeCache(str(tmp_path / "cache"))
+    cache.key(str(kept), str(deleted))
+
+    deleted.unlink()
+    cache.evict()
+    assert indexed_paths(tmp_path / "cache") == {str(kept)}
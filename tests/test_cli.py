@@ -0,0 +1,56 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+
+# Heavy modules that are only imported once the command line is parsed
+HEAVY_MODULES = ['nipype', 'nibabel', 'numpy']
+
+# Seconds --help may take at most, best of a few runs. Generous, so slow
+# machines pass; it catches work done before the command line is parsed,
+# such as network access or scanning the datasets.
+STARTUP_LIMIT_S = 2.0
+
+PRINT_IMPORTED_MODULES = """
+import sys
+from {module} import main
+
+sys.argv = ['{command}', '-h']
+try:
+    main()
+except SystemExit:
+    pass
+print(','.join(sorted(sys.modules)), file=sys.stderr)
+"""
+
+
+COMMANDS = [
+    ('petbrainpreprocessing.pet_brain_preprocessing', 'pet_brain_preprocessing'),
+    ('petbrainpreprocessing.tools', 'pet_brain_preprocessing_tools'),
+]
+
+
+@pytest.mark.parametrize('module, command', COMMANDS)
+def test_help_does_not_import_heavy_modules(module, command):
+    result = subprocess.run(
+        [sys.executable, '-c', PRINT_IMPORTED_MODULES.format(module=module, command=command)],
+        capture_output=True, text=True, check=True)
+
+    assert f"usage: {command}" in result.stdout
+    imported = {name.split('.')[0] for name in result.stderr.strip().split(',')}
+    assert not imported & set(HEAVY_MODULES)
+
+
+@pytest.mark.parametrize('module, command', COMMANDS)
+def test_help_starts_quickly(module, command):
+    wall_times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, '-c', PRINT_IMPORTED_MODULES.format(module=module, command=command)],
+            capture_output=True, check=True)
+        wall_times.append(time.perf_counter() - start)
+
+    assert min(wall_times) < STARTUP_LIMIT_S
@@ -0,0 +1,89 @@
+import os
+import stat
+from os.path import join as opj
+
+import pytest
+from nipype import Node, Workflow
+from nipype.interfaces.io import DataSink
+from nipype.interfaces.utility import Rename
+
+from petbrainpreprocessing.cluster import set_cluster_resources
+from petbrainpreprocessing.manifest import RunManifest
+
+
+# Stand-ins of the SLURM commands: sbatch logs its arguments and runs the
+# batch script right away, squeue reports no pending jobs
+STUB_SLURM = {
+    'sbatch': ('#!/bin/sh\n'
+               'echo "$@" >> "$(dirname "$0")/sbatch.log"\n'
+               'for script; do :; done\n'
+               'bash "$script" > /dev/null 2>&1\n'
+               'echo "Submitted batch job $$"\n'),
+    'squeue': '#!/bin/sh\n',
+}
+
+LABEL = 'sub-01_trc-FDG'
+
+
+@pytest.fixture
+def stub_slurm(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for command, script in STUB_SLURM.items():
+        file_path = bin_dir / command
+        file_path.write_text(script)
+        file_path.chmod(file_path.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    # Part of the job names of the SLURM plugin, set by login shells
+    monkeypatch.setenv("LOGNAME", os.environ.get("LOGNAME", "pytest"))
+    return bin_dir / "sbatch.log"
+
+
+def build_workflow(base_dir, output_dir):
+    # The node layout of pet_brain_preprocessing: a scan workflow ending in
+    # its DataSink within a participant workflow within the top level one
+    in_file = base_dir.parent / "pet.nii"
+    in_file.write_text(LABEL)
+    scan_wf = Workflow(name=f'pet_wf_{LABEL}')
+    image = Node(Rename(in_file=str(in_file), format_string=f"{LABEL}_pet.nii"),
+                 name='rename_image', n_procs=2, mem_gb=3)
+    datasink = Node(DataSink(base_directory=str(output_dir), container='sub-01'),
+                    name='output_files')
+    scan_wf.connect(image, 'out_file', datasink, 'pet')
+
+    participant_wf = Workflow(name='coreg_and_norm_wf_sub-01')
+    participant_wf.add_nodes([scan_wf])
+    wf = Workflow(name='pet_brain_preprocessing_wf', base_dir=str(base_dir))
+    wf.config['execution']['poll_sleep_duration'] = 0.1
+    wf.add_nodes([participant_wf])
+    return wf, participant_wf
+
+
+@pytest.mark.parametrize('plugin', ['SLURM', 'SLURMGraph'])
+def test_slurm_manifest(tmp_path, stub_slurm, plugin):
+    output_dir = tmp_path / "output"
+    wf, participant_wf = build_workflow(tmp_path / "work", output_dir)
+
+    manifest = RunManifest(opj(output_dir, "logs", "manifest"))
+    manifest.start(LABEL, f'pet_wf_{LABEL}', {'pet_image': 'hash'}, {'fwhm': None})
+    plugin_args = {'sbatch_args': '--partition=short'}
+    if plugin == 'SLURMGraph':
+        manifest.add_completion_node(participant_wf, f'pet_wf_{LABEL}')
+    else:
+        plugin_args['status_callback'] = manifest
+
+    set_cluster_resources(wf, plugin)
+    wf.run(plugin, plugin_args=plugin_args)
+
+    # Every job requests the cores and memory of its node, next to the
+    # arguments given to all jobs
+    sbatch_calls = stub_slurm.read_text().splitlines()
+    assert all('--partition=short' in call for call in sbatch_calls)
+    assert any('--cpus-per-task=2 --mem=3072M' in call and 'rename_image' in call
+               for call in sbatch_calls)
+
+    record = manifest.read(LABEL)
+    assert record['status'] == 'complete'
+    assert record['outputs'] == [str(output_dir / "sub-01" / "pet" / f"{LABEL}_pet.nii")]
+    assert manifest.is_complete(LABEL, {'pet_image': 'hash'}, {'fwhm': None})
+
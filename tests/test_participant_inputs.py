@@ -0,0 +1,50 @@
+import pytest
+
+from petbrainpreprocessing.layout import DatasetIndex
+from petbrainpreprocessing.pet_brain_preprocessing import collect_inputs, get_participants
+
+
+ANATOMICAL_FILES = ["desc-preproc_T1w.nii.gz", "desc-brain_mask.nii.gz",
+                    "from-T1w_to-MNI152NLin2009cAsym_mode-image_xfm.h5"]
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    # sub-01 is complete, sub-02 lacks its fMRIPrep derivatives and sub-03
+    # has no PET image
+    bids_dir = tmp_path / "bids"
+    anat_dir = tmp_path / "fmriprep"
+    for subject, has_pet, has_anat in [("01", True, True), ("02", True, False),
+                                       ("03", False, True)]:
+        (bids_dir / f"sub-{subject}" / "anat").mkdir(parents=True)
+        (bids_dir / f"sub-{subject}" / "anat" / f"sub-{subject}_T1w.nii.gz").touch()
+        if has_pet:
+            (bids_dir / f"sub-{subject}" / "pet").mkdir()
+            (bids_dir / f"sub-{subject}" / "pet" / f"sub-{subject}_pet.nii.gz").touch()
+        if has_anat:
+            (anat_dir / f"sub-{subject}" / "anat").mkdir(parents=True)
+            for name in ANATOMICAL_FILES:
+                (anat_dir / f"sub-{subject}" / "anat" / f"sub-{subject}_{name}").touch()
+
+    index = DatasetIndex(str(tmp_path / "layout.sqlite"))
+    index.update(str(bids_dir))
+    index.update(str(anat_dir))
+    return index, str(bids_dir), str(anat_dir)
+
+
+def test_incomplete_participants_are_skipped(dataset, capsys):
+    index, bids_dir, anat_dir = dataset
+    participants = get_participants(index, bids_dir)
+    assert participants == ["sub-01", "sub-02", "sub-03"]
+
+    inputs = collect_inputs(participants, index, bids_dir, anat_dir, skip_incomplete=True)
+    assert [scan["label"] for scan in inputs] == ["sub-01"]
+    warnings = capsys.readouterr().err
+    assert "Skipping sub-02" in warnings and "Skipping sub-03" in warnings
+
+
+@pytest.mark.parametrize("participant", ["sub-02", "sub-03"])
+def test_named_incomplete_participant_raises(dataset, participant):
+    index, bids_dir, anat_dir = dataset
+    with pytest.raises(FileNotFoundError):
+        collect_inputs(["sub-01", participant], index, bids_dir, anat_dir)
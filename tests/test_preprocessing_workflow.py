@@ -0,0 +1,88 @@
+import os
+
+import nibabel as nb
+import numpy as np
+
+from petbrainpreprocessing.workflows.preprocessing_workflow import pet_preprocessing_workflow
+
+
+# Nodes whose outputs are written to the results folder under a fixed name
+NAMED_OUTPUTS = {
+    'coreg_first_pass': ['output_transform_prefix', 'output_warped_image'],
+    'coreg_second_pass': ['output_transform_prefix', 'output_warped_image'],
+    'merge_final_coreg_frames': ['merged_file'],
+    'merge_coreg_and_norm_frames': ['merged_file'],
+    'motion_correction_wf.register_frames': ['output_transform_prefix'],
+    'motion_correction_wf.merge_frames': ['merged_file'],
+}
+
+
+def test_scans_of_a_session_have_their_own_output_names(tmp_path):
+    # Two dynamic tracers of one session share the output folders of the session
+    scans = []
+    for tracer in ['FDG', 'PIB']:
+        pet_image = tmp_path / f"sub-01_ses-1_trc-{tracer}_pet.nii.gz"
+        pet_image.touch()
+        scans.append({
+            'label': f"sub-01_ses-1_trc-{tracer}",
+            'pet_image': str(pet_image),
+            'session': '1',
+            'n_frames': 3,
+            'voxel_size': (2.0, 2.0, 2.0),
+            'mem_gb': 0.1,
+        })
+    wf = pet_preprocessing_workflow('sub-01', None, True, scans)
+
+    names = {}
+    for scan in scans:
+        for node_name, fields in NAMED_OUTPUTS.items():
+            node = wf.get_node(f"pet_wf_{scan['label']}.{node_name}")
+            for field in fields:
+                value = getattr(node.inputs, field)
+                assert value.startswith(scan['label'])
+                names.setdefault((node_name, field), set()).add(value)
+    assert all(len(values) == len(scans) for values in names.values())
+
+
+def test_scans_of_different_voxel_sizes_have_their_own_resampled_T1w(tmp_path):
+    # FDG at 4 mm and FEOBV at 3 mm in one session
+    T1 = tmp_path / "sub-01_desc-preproc_T1w.nii"
+    nb.save(nb.Nifti1Image(np.ones((48, 56, 48), dtype=np.float32), np.eye(4)), str(T1))
+    scans = []
+    for tracer, voxel_size in [('FDG', 4.0), ('FEOBV', 3.0)]:
+        pet_image = tmp_path / f"sub-01_ses-1_trc-{tracer}_pet.nii"
+        affine = np.diag([voxel_size] * 3 + [1.0])
+        nb.save(nb.Nifti1Image(np.ones((10, 10, 10), dtype=np.float32), affine), str(pet_image))
+        scans.append({
+            'label': f"sub-01_ses-1_trc-{tracer}",
+            'pet_image': str(pet_image),
+            'session': '1',
+            'n_frames': 1,
+            'voxel_size': (voxel_size,) * 3,
+            'mem_gb': 0.1,
+        })
+    wf = pet_preprocessing_workflow('sub-01', None, True, scans, compress_level=0)
+
+    # Every scan gets the T1w resampled to its own voxel size
+    resampled = {}
+    for source, target, _ in wf._graph.edges(data=True):
+        if source.name.startswith('resample_T1'):
+            resampled[target.name] = source
+    assert len({id(node) for node in resampled.values()}) == len(scans)
+
+    out_files = {}
+    for scan in scans:
+        node = resampled[f"pet_wf_{scan['label']}"]
+        node.base_dir = str(tmp_path / "work")
+        node.inputs.in_file = str(T1)
+        out_files[scan['label']] = node.run().outputs.out_file
+
+    # Sunk into the same session folder, so their names differ
+    names = {label: os.path.basename(out_file) for label, out_file in out_files.items()}
+    assert names == {
+        'sub-01_ses-1_trc-FDG': 'sub-01_desc-preproc_res-4p0mm_resampled-to-PET_T1w.nii',
+        'sub-01_ses-1_trc-FEOBV': 'sub-01_desc-preproc_res-3p0mm_resampled-to-PET_T1w.nii',
+    }
+    for scan in scans:
+        zooms = nb.load(out_files[scan['label']]).header.get_zooms()
+        assert np.allclose(zooms, scan['voxel_size'])
@@ -0,0 +1,203 @@
+import nibabel as nb
+import numpy as np
+import pytest
+from nibabel.processing import resample_from_to
+from scipy import ndimage
+from scipy.io import savemat
+
+from petbrainpreprocessing.interfaces.transforms import (ApplyTransformPairPython,
+                                                        ApplyTransformsPython, SmoothPython)
+from petbrainpreprocessing.transforms import AffineMapping, read_transform, read_transforms
+
+
+LPS = np.diag([-1.0, -1.0, 1.0])
+
+# Rotation about z and a shear, so the order of the transforms matters
+MATRIX = np.array([[0.9, -0.2, 0.1],
+                   [0.3, 1.1, 0.0],
+                   [0.0, 0.1, 0.95]])
+TRANSLATION = np.array([4.0, -2.0, 3.0])
+CENTER = np.array([10.0, -5.0, 2.0])
+
+POINTS = np.array([[0.0, 0.0, 0.0],
+                   [12.5, -3.0, 7.0],
+                   [-20.0, 40.0, -15.0]])
+
+
+def write_itk_text(file_path, matrix=MATRIX, translation=TRANSLATION, center=CENTER):
+    parameters = " ".join(str(value) for value in list(np.ravel(matrix)) + list(translation))
+    with open(file_path, "w") as f:
+        f.write("#Insight Transform File V1.0\n"
+                "#Transform 0\n"
+                "Transform: AffineTransform_double_3_3\n"
+                f"Parameters: {parameters}\n"
+                f"FixedParameters: {' '.join(str(value) for value in center)}\n")
+    return str(file_path)
+
+
+def itk_map(points, matrix=MATRIX, translation=TRANSLATION, center=CENTER):
+    # ITK maps LPS points x to M (x - c) + t + c
+    lps = points @ LPS
+    return ((lps - center) @ matrix.T + translation + center) @ LPS
+
+
+def test_itk_text_transform_maps_ras_points(tmp_path):
+    mapping, = read_transform(write_itk_text(tmp_path / "affine.txt"))
+    assert np.allclose(mapping.map(POINTS), itk_map(POINTS))
+
+
+def test_matlab_transform_matches_text_transform(tmp_path):
+    file_path = str(tmp_path / "pet2anat0GenericAffine.mat")
+    savemat(file_path, {
+        'AffineTransform_double_3_3': np.concatenate([MATRIX.ravel(), TRANSLATION])[:, None],
+        'fixed': CENTER[:, None],
+    })
+    mapping, = read_transform(file_path)
+    assert np.allclose(mapping.map(POINTS), itk_map(POINTS))
+
+
+def test_inverse_transform(tmp_path):
+    mapping, = read_transform(write_itk_text(tmp_path / "affine.txt"), invert=True)
+    assert np.allclose(mapping.map(itk_map(POINTS)), POINTS)
+
+
+def test_composite_applies_last_added_transform_first(tmp_path):
+    h5py = pytest.importorskip("h5py")
+
+    shift = np.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 5.0, 1.0, -2.0])
+    shift[[0, 4, 8]] = 1.0
+    file_path = str(tmp_path / "Composite.h5")
+    with h5py.File(file_path, "w") as f:
+        group = f.create_group("TransformGroup")
+        transforms = [("CompositeTransform_double_3", [], []),
+                      ("AffineTransform_double_3_3",
+                       np.concatenate([MATRIX.ravel(), TRANSLATION]), CENTER),
+                      ("AffineTransform_double_3_3", shift, np.zeros(3))]
+        for index, (transform_type, parameters, fixed_parameters) in enumerate(transforms):
+            transform = group.create_group(str(index))
+            transform["TransformType"] = [transform_type.encode()]
+            transform["TransformParameters"] = np.asarray(parameters, dtype=np.float64)
+            transform["TransformFixedParameters"] = np.asarray(fixed_parameters,
+                                                               dtype=np.float64)
+
+    points = POINTS
+    for mapping in read_transform(file_path):
+        points = mapping.map(points)
+    shifted = itk_map(POINTS, np.eye(3), shift[9:], np.zeros(3))
+    assert np.allclose(points, itk_map(shifted))
+
+
+def test_chain_maps_output_points_by_first_transform_first(tmp_path):
+    first = write_itk_text(tmp_path / "first.txt")
+    second = write_itk_text(tmp_path / "second.txt", MATRIX.T, -TRANSLATION, np.zeros(3))
+
+    mappings = read_transforms([first, second], [False, False])
+    # Consecutive linear transforms are combined into one
+    assert len(mappings) == 1 and isinstance(mappings[0], AffineMapping)
+    expected = itk_map(itk_map(POINTS), MATRIX.T, -TRANSLATION, np.zeros(3))
+    assert np.allclose(mappings[0].map(POINTS), expected)
+
+
+def phantom(shape, affine, n_frames=1):
+    # Smooth blobs well within the field of view, zero at the borders
+    grid = np.indices(shape, dtype=np.float64)
+    center = (np.array(shape) - 1) / 2
+    radius = np.sqrt(sum(((axis - c) / (s / 4)) ** 2
+                         for axis, c, s in zip(grid, center, shape)))
+    data = np.stack([np.clip(1 - radius, 0, None) * (100 + 10 * frame)
+                     + (radius < 0.5) * frame for frame in range(n_frames)], axis=-1)
+    return nb.Nifti1Image(data.astype(np.float32).squeeze(), affine)
+
+
+@pytest.mark.parametrize('n_frames', [1, 3])
+def test_apply_transforms_python_matches_nibabel(tmp_path, monkeypatch, n_frames):
+    monkeypatch.chdir(tmp_path)
+    affine = np.diag([2.0, 2.0, 2.5, 1.0])
+    affine[:3, 3] = [-30, -34, -25]
+    nb.save(phantom((30, 34, 20), affine, n_frames), "pet.nii")
+    reference_affine = np.diag([1.5, 1.5, 1.5, 1.0])
+    reference_affine[:3, 3] = [-24, -27, -18]
+    reference = nb.Nifti1Image(np.zeros((32, 36, 24), dtype=np.float32), reference_affine)
+    nb.save(reference, "T1w.nii")
+    small_matrix = np.array([[0.99, -0.1, 0.0], [0.1, 0.99, 0.0], [0.0, 0.0, 1.0]])
+    transform = write_itk_text(tmp_path / "pet2anat.txt", small_matrix, [2.0, -1.0, 1.5],
+                               [1.0, 2.0, 0.0])
+
+    apply = ApplyTransformsPython()
+    apply.inputs.input_image = "pet.nii"
+    apply.inputs.reference_image = "T1w.nii"
+    apply.inputs.transforms = [transform]
+    result = apply.run()
+    resampled = nb.load(result.outputs.output_image)
+
+    # Resampling through T equals resampling an image whose voxels are
+    # placed by the inverse of T
+    mapping, = read_transform(transform)
+    img = nb.load("pet.nii")
+    moved = nb.Nifti1Image(img.get_fdata(), np.linalg.inv(mapping.matrix) @ img.affine)
+    frames = [nb.Nifti1Image(moved.dataobj[..., frame], moved.affine)
+              for frame in range(n_frames)] if n_frames > 1 else [moved]
+    expected = np.stack([resample_from_to(frame, reference, order=1).get_fdata()
+                         for frame in frames], axis=-1).squeeze()
+
+    # The blobs overlap the reference grid
+    assert expected.max() > 50
+    assert resampled.shape == expected.shape
+    assert np.allclose(resampled.affine, reference_affine)
+    assert np.allclose(resampled.get_fdata(), expected, atol=1e-4)
+
+
+def test_apply_transform_pair_matches_two_runs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    nb.save(phantom((30, 34, 20), np.diag([2.0, 2.0, 2.5, 1.0]), n_frames=2), "pet.nii")
+    nb.save(nb.Nifti1Image(np.zeros((20, 24, 16), dtype=np.float32),
+                           np.diag([3.0, 3.0, 3.0, 1.0])), "T1w.nii")
+    nb.save(nb.Nifti1Image(np.zeros((32, 36, 24), dtype=np.float32),
+                           np.diag([1.5, 1.5, 1.5, 1.0])), "template.nii")
+    coreg = write_itk_text(tmp_path / "pet2anat.txt", np.eye(3), [2.0, -1.0, 1.5])
+    norm = write_itk_text(tmp_path / "anat2template.txt")
+
+    pair = ApplyTransformPairPython(input_image="pet.nii", reference_image="T1w.nii",
+                                    transforms=[coreg], second_reference_image="template.nii",
+                                    second_transforms=[norm, coreg],
+                                    output_image="pet_trans.nii",
+                                    second_output_image="norm/pet_trans.nii").run()
+
+    for output, reference, transforms in [("output_image", "T1w.nii", [coreg]),
+                                          ("second_output_image", "template.nii", [norm, coreg])]:
+        single = ApplyTransformsPython(input_image="pet.nii", reference_image=reference,
+                                       transforms=transforms,
+                                       output_image=f"single_{output}.nii").run()
+        resampled = nb.load(getattr(pair.outputs, output))
+        expected = nb.load(single.outputs.output_image)
+        assert expected.get_fdata().max() > 50
+        assert resampled.shape == expected.shape
+        assert np.allclose(resampled.affine, expected.affine)
+        assert np.array_equal(resampled.get_fdata(), expected.get_fdata())
+
+
+def test_smooth_python_renormalizes_the_kernel_at_the_borders(tmp_path, monkeypatch):
+    # fslmaths -kernel gauss -fmean weights the voxels within the image only,
+    # FSL is not needed as the reference is computed in 3D here. The
+    # tolerance covers the float32 filtering of values up to 210.
+    monkeypatch.chdir(tmp_path)
+    # A ramp up to the borders, where the border handling matters
+    ramp = 5 * np.arange(20, dtype=np.float64)[:, None, None, None]
+    data = phantom((20, 24, 16), np.eye(4), n_frames=2).get_fdata() + ramp
+    img = nb.Nifti1Image(data.astype(np.float32), np.diag([2.0, 2.0, 3.0, 1.0]))
+    nb.save(img, "pet.nii")
+
+    smooth = SmoothPython()
+    smooth.inputs.in_file = "pet.nii"
+    smooth.inputs.fwhm = 6
+    result = smooth.run()
+
+    sigmas = 6 / np.sqrt(8 * np.log(2)) / np.array([2.0, 2.0, 3.0])
+    weights = ndimage.gaussian_filter(np.ones(data.shape[:3]), sigmas, mode='constant')
+    expected = np.stack([ndimage.gaussian_filter(data[..., frame], sigmas, mode='constant')
+                         / weights for frame in range(2)], axis=-1)
+    smoothed = nb.load(result.outputs.smoothed_file).get_fdata()
+    assert np.allclose(smoothed, expected, atol=1e-3)
+    # Repeating the border voxels, as mode='nearest' does, differs there
+    nearest = ndimage.gaussian_filter(data[..., 0], sigmas, mode='nearest')
+    assert np.abs(smoothed[0, ..., 0] - nearest[0]).min() > 1